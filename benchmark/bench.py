@@ -0,0 +1,334 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+# code for the loopback benchmark by Saiid El Hajj Chehade
+
+# usage:
+# >>> python benchmark\bench.py --sizes 64K,1M,16M --segments 1000,8000 --modes tcp-ack,tcp-stream,udp
+# >>> python benchmark\bench.py --output baseline.json
+# >>> python benchmark\bench.py --baseline baseline.json --threshold 0.2
+# >>> python benchmark\bench.py --modes udp --impair loss=0.01,delay=10,jitter=2,bandwidth=50M --seed 1
+# >>> python benchmark\bench.py --sizes 16M --streams 4
+# >>> python benchmark\bench.py --content text --compress zlib
+# >>> python benchmark\bench.py --modes udp --check crc32 --impair corrupt=0.01
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_PATH = os.path.join(ROOT_PATH, 'server')
+CLIENT_PATH = os.path.join(ROOT_PATH, 'client')
+CONTROL_PORT = 5000
+
+# transfer modes: connection type and options asked from the server
+MODES = {
+    'tcp-ack': ('TCP', {'mode': 'ack'}),
+    'tcp-stream': ('TCP', {'mode': 'stream'}),
+    'udp': ('UDP', {})
+}
+
+sys.path.insert(0, CLIENT_PATH)
+from connections.mainConnection import MainConnection
+import connections.FTP
+from connections.parallel import downloadParallel
+from impair import Impairment, UdpImpairmentRelay
+
+
+def parseSize(text):
+    """
+    :param text: str - size in bytes with an optional K, M or G suffix
+    :returns int - the size in bytes
+    """
+    match = re.fullmatch(r'(\d+)([KMG]?)', text.strip().upper())
+    assert match, f'Invalid size "{text}"'
+    return int(match.group(1)) * {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}[match.group(2)]
+
+
+def makeContent(size, content):
+    """
+    :param size: int - size of the file in bytes
+    :param content: str - 'random' for bytes that do not compress, 'text' for words that do
+    :returns bytes - the data of a file
+    """
+    if content == 'random':
+        return os.urandom(size)
+
+    rng = random.Random(size)
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(2000)]
+    text = bytearray()
+    while len(text) < size:
+        text += ' '.join(rng.choices(words, k=1000)).encode('utf-8') + b'\n'
+    return bytes(text[:size])
+
+
+def startServer(workPath, sizes, engine, content='random'):
+    """
+    Starts a server on localhost from a copy of the server app, with one generated file per size in its catalog.
+
+    :param workPath: str - directory to copy the server to
+    :param sizes: list - file sizes in bytes
+    :param engine: str - 'thread' or 'asyncio'
+    :param content: str - optional - content of the files (see makeContent)
+    :returns (subprocess.Popen, dict) - the server process and the file id per size
+    """
+    serverPath = os.path.join(workPath, 'server')
+    shutil.copytree(SERVER_PATH, serverPath, ignore=shutil.ignore_patterns('__pycache__'))
+
+    # paths are built the same way as in server\config.py
+    filePath = serverPath + "\\files"
+    listPath = serverPath + "\\files.json"
+
+    config = os.path.join(serverPath, 'config.py')
+    with open(config) as f:
+        text = f.read()
+    text = re.sub(r"SERVER_ENGINE = .*", f"SERVER_ENGINE = '{engine}'", text)
+    text = re.sub(r"LOG_LEVEL = .*", "LOG_LEVEL = 'WARNING'", text)
+    with open(config, 'w') as f:
+        f.write(text)
+
+    files = []
+    ids = {}
+    for i, size in enumerate(sizes):
+        files.append({'id': i + 1, 'name': f'bench{size}', 'type': 'bin'})
+        ids[size] = i + 1
+        with open(filePath + "\\" + f'bench{size}.bin', 'wb') as f:
+            f.write(makeContent(size, content))
+    with open(listPath, 'w') as f:
+        json.dump({'lastFileID': len(files), 'files': files}, f)
+
+    server = subprocess.Popen([sys.executable, 'app.py'], cwd=serverPath,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # wait for the control session
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', CONTROL_PORT), timeout=1).close()
+            break
+        except OSError:
+            assert server.poll() is None, 'Server stopped'
+            assert time.monotonic() < deadline, 'Server did not start'
+            time.sleep(0.1)
+
+    return server, ids
+
+
+def runCase(mode, segment, sizes, ids, repeat, workPath, impairment=None, seed=None, streams=1, compress='',
+            check=''):
+    """
+    Downloads and uploads a file of every size over one FTP connection.
+
+    :param mode: str - key of MODES
+    :param segment: str - segment size asked from the server, 'auto' to probe the path MTU over UDP
+    :param sizes: list - file sizes in bytes
+    :param ids: dict - file id per size
+    :param repeat: int - transfers per measurement
+    :param workPath: str - directory for the transferred files
+    :param impairment: Impairment - optional - impairments of a relay put in front of UDP sessions
+    :param seed: int - optional - seed of the relay
+    :param streams: int - optional - sessions every download is split into
+    :param compress: str - optional - codecs asked from the server, by preference. '' to send the files raw
+    :param check: str - optional - integrity check asked from the server. '' to not check
+    :returns list - one result per size and direction
+    """
+    typeCode, options = MODES[mode]
+    options = dict(options)
+    if segment != 'auto':
+        options['segment'] = segment
+    else:
+        options['segment'] = connections.FTP.SEGMENT_SIZE
+    if compress:
+        options['compress'] = compress
+    if check:
+        options['check'] = check
+    connections.FTP.UDP_MTU_PROBE = segment == 'auto'
+
+    relays = []
+
+    def route(ip, port):
+        relays.append(UdpImpairmentRelay((ip, port), up=impairment, seed=seed).start())
+        return relays[-1].address
+
+    def openConnection():
+        return MainConnection(server_ip='127.0.0.1').connectFTP(
+            typeCode, options=options, route=route if impairment and typeCode == 'UDP' else None)
+
+    connection = openConnection()
+
+    downloadPath = os.path.join(workPath, 'download')
+    uploadPath = os.path.join(workPath, 'upload')
+    os.makedirs(downloadPath, exist_ok=True)
+    os.makedirs(uploadPath, exist_ok=True)
+
+    results = []
+    try:
+        for size in sizes:
+            name = f'bench{size}'
+            # the client reads uploads from directory\name.type
+            shutil.copyfile(os.path.join(workPath, 'server') + "\\files\\" + name + ".bin",
+                            uploadPath + "\\" + f'up{size}.bin')
+
+            transfers = {
+                'download': lambda: downloadParallel(connection, openConnection, ids[size], downloadPath, streams)
+                if streams > 1 else connection.downloadFile(ids[size], downloadPath),
+                'upload': lambda: connection.sendFile(uploadPath, f'up{size}', 'bin')
+            }
+            for direction, transfer in transfers.items():
+                samples = []
+                for _ in range(repeat):
+                    cpu = time.process_time()
+                    start = time.perf_counter()
+                    transfer()
+                    wall = time.perf_counter() - start
+                    cpu = time.process_time() - cpu
+
+                    # the server measured the same transfer
+                    server = connection.getStats()['transfers'][-1]
+                    samples.append({'wall': wall, 'clientCpu': cpu, 'server': server})
+
+                wall = statistics.median(sample['wall'] for sample in samples)
+                results.append({
+                    'case': f'{mode}/segment={segment}/size={size}/{direction}',
+                    'mode': mode,
+                    'segment': segment,
+                    'size': size,
+                    'direction': direction,
+                    'repeat': repeat,
+                    'seconds': wall,
+                    'throughput': size * 8 / wall,
+                    'clientCpu': statistics.median(sample['clientCpu'] for sample in samples),
+                    'serverCpu': statistics.median(sample['server']['cpu'] for sample in samples),
+                    'retransmits': sum(sample['server']['retransmits'] for sample in samples),
+                    'timeouts': sum(sample['server'].get('timeouts', 0) for sample in samples),
+                    'corrupted': sum(sample['server'].get('corrupted', 0) for sample in samples),
+                    'latency': {
+                        key: statistics.median(sample['server']['latency'][key] for sample in samples)
+                        for key in ('p50', 'p90', 'p99', 'max')
+                    }
+                })
+                if relays:
+                    # counters of the relay of the connection so far, for all its transfers
+                    results[-1]['relay'] = {direction: dict(counters)
+                                            for direction, counters in relays[0].stats.items()}
+                print(f"{results[-1]['case']}: {results[-1]['throughput'] / 1E6:.1f} Mbps, "
+                      f"p50 {results[-1]['latency']['p50']:.0f} µs, client cpu {results[-1]['clientCpu']:.3f} s, "
+                      f"server cpu {results[-1]['serverCpu']:.3f} s", file=sys.stderr)
+    finally:
+        connection.close()
+        for relay in relays:
+            relay.stop()
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares results with a baseline run.
+
+    :param results: list - results of this run
+    :param baseline: dict - output of an earlier run
+    :param threshold: float - allowed relative loss, 0.2 for 20%
+    :returns list - descriptions of the regressions
+    """
+    previous = {result['case']: result for result in baseline['results']}
+    regressions = []
+
+    for result in results:
+        old = previous.get(result['case'])
+        if not old:
+            continue
+
+        if result['throughput'] < old['throughput'] * (1 - threshold):
+            regressions.append(f"{result['case']}: throughput {result['throughput'] / 1E6:.1f} Mbps, "
+                               f"baseline {old['throughput'] / 1E6:.1f} Mbps")
+        if result['latency']['p50'] > old['latency']['p50'] * (1 + threshold):
+            regressions.append(f"{result['case']}: p50 latency {result['latency']['p50']:.0f} µs, "
+                               f"baseline {old['latency']['p50']:.0f} µs")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Loopback benchmark of the FTP transfer paths')
+    parser.add_argument('--sizes', default='64K,1M,16M', help='file sizes, with K, M or G suffixes')
+    parser.add_argument('--segments', default='1000,8000', help="segment sizes. 'auto' probes the path MTU over UDP")
+    parser.add_argument('--modes', default=','.join(MODES), help='transfer modes: ' + ', '.join(MODES))
+    parser.add_argument('--engine', default='thread', choices=('thread', 'asyncio'), help='server engine')
+    parser.add_argument('--repeat', type=int, default=3, help='transfers per measurement. the median is reported')
+    parser.add_argument('--output', help='file to write the results to. stdout if not given')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative regression')
+    parser.add_argument('--impair', help='impairments of a relay in front of UDP sessions, e.g. loss=0.01,delay=20')
+    parser.add_argument('--seed', type=int, help='seed of the impairments')
+    parser.add_argument('--streams', type=int, default=1, help='sessions every download is split into')
+    parser.add_argument('--compress', default='', help="codecs asked from the server, e.g. 'zlib' or 'lzma,zlib'")
+    parser.add_argument('--check', default='', help="integrity check asked from the server, e.g. 'crc32'")
+    parser.add_argument('--content', default='random', choices=('random', 'text'), help='content of the files')
+    args = parser.parse_args()
+
+    sizes = [parseSize(size) for size in args.sizes.split(',')]
+    segments = args.segments.split(',')
+    modes = args.modes.split(',')
+    for mode in modes:
+        assert mode in MODES, f'Invalid mode "{mode}"'
+    impairment = Impairment.parse(args.impair) if args.impair else None
+
+    # the progress of the client would be measured with the transfers
+    logging.disable(logging.INFO)
+
+    workPath = tempfile.mkdtemp(prefix='ftp-bench-')
+    server, ids = startServer(workPath, sizes, args.engine, args.content)
+    try:
+        results = []
+        for mode in modes:
+            for segment in segments:
+                # streaming mode does not use segments and only UDP probes the path MTU
+                if mode == 'tcp-stream' and segment != segments[0] or segment == 'auto' and MODES[mode][0] != 'UDP':
+                    continue
+                results += runCase(mode, segment, sizes, ids, args.repeat, workPath, impairment, args.seed,
+                                   args.streams, args.compress, args.check)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workPath, ignore_errors=True)
+
+    report = {
+        'engine': args.engine,
+        'impair': args.impair,
+        'streams': args.streams,
+        'compress': args.compress,
+        'check': args.check,
+        'content': args.content,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print('REGRESSION', regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+import argparse
+import heapq
+import random
+import re
+import socket
+import threading
+import time
+
+# code for the network impairment relay by Saiid El Hajj Chehade
+
+# usage:
+# >>> python benchmark\impair.py --listen 7000 --target 127.0.0.1:6000 --impair loss=0.02,delay=20,jitter=5
+# or from a script:
+#   relay = UdpImpairmentRelay(('127.0.0.1', 6000), Impairment(loss=0.02, delay=20))
+#   relay.start()
+#   ... send to relay.address ...
+#   relay.down.loss = 0.1   # impairments can be changed while the relay runs
+#   relay.stop()
+
+
+class Impairment:
+    """
+    Impairments of one direction of the relay. Times are in milliseconds, the bandwidth in bits/s.
+    """
+
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, reorder=0.0, reorderDelay=10.0, duplicate=0.0,
+                 bandwidth=None, queue=1000.0, corrupt=0.0):
+        """
+        :param loss: float - probability to drop a datagram
+        :param delay: float - ms added to every datagram
+        :param jitter: float - maximum ms added to or removed from the delay, uniformly
+        :param reorder: float - probability to hold a datagram back so later ones overtake it
+        :param reorderDelay: float - ms a reordered datagram is held back
+        :param duplicate: float - probability to send a datagram twice
+        :param bandwidth: float - optional - bits/s the direction carries. unlimited if None
+        :param queue: float - ms of data waiting for the bandwidth before datagrams are dropped
+        :param corrupt: float - probability to flip one bit of a file segment (212 datagram) after its opcode
+        """
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.reorderDelay = reorderDelay
+        self.duplicate = duplicate
+        self.bandwidth = bandwidth
+        self.queue = queue
+        self.corrupt = corrupt
+
+    def copy(self):
+        return Impairment(**vars(self))
+
+    @staticmethod
+    def parse(text):
+        """
+        Reads impairments in the format key=value,key=value. Bandwidths take K, M or G suffixes.
+
+        :param text: str - the impairments, e.g. loss=0.01,delay=20,jitter=5,bandwidth=10M
+        :returns Impairment
+        """
+        impairment = Impairment()
+        for field in filter(None, text.split(',')):
+            key, value = field.split('=', 1)
+            assert hasattr(impairment, key), f'Unknown impairment "{key}"'
+
+            match = re.fullmatch(r'([\d.]+)([KMG]?)', value.strip().upper())
+            assert match, f'Invalid value "{value}"'
+            setattr(impairment, key, float(match.group(1)) * {'': 1, 'K': 1E3, 'M': 1E6, 'G': 1E9}[match.group(2)])
+        return impairment
+
+
+class UdpImpairmentRelay:
+    """
+    Relays UDP datagrams between clients and a server and impairs them on the way.
+    Every client gets its own socket towards the server, so the server sees one address per client.
+    Datagrams are scheduled for their departure time and sent by one thread, which also applies the bandwidth.
+    """
+
+    def __init__(self, target, up=None, down=None, listen=('127.0.0.1', 0), seed=None):
+        """
+        :param target: (str, int) - address of the server
+        :param up: Impairment - optional - impairments from the clients to the server
+        :param down: Impairment - optional - impairments from the server to the clients. same as up if not given
+        :param listen: (str, int) - address the clients send to. port 0 to let the kernel choose
+        :param seed: int - optional - seed of the random impairments, to repeat a run
+        """
+        self.target = target
+        self.up = up or Impairment()
+        self.down = down or self.up.copy()
+        self.random = random.Random(seed)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(listen)
+        self.address = self.socket.getsockname()
+
+        self.upstreams = {}  # client address -> socket towards the server
+        self.schedule = []  # heap of (departure time, order, socket, data, address)
+        self.order = 0
+        self.nextFree = {'up': 0.0, 'down': 0.0}  # time each direction finishes sending its queued data
+        self.condition = threading.Condition()
+        self.running = False
+        self.threads = []
+
+        # counters per direction
+        self.stats = {direction: {'received': 0, 'sent': 0, 'lost': 0, 'duplicated': 0, 'reordered': 0,
+                                  'overflowed': 0, 'corrupted': 0} for direction in ('up', 'down')}
+
+    def start(self):
+        """
+        Starts relaying in background threads.
+        :returns UdpImpairmentRelay - the relay
+        """
+        self.running = True
+        self.spawn(self.relayClients)
+        self.spawn(self.sendScheduled)
+        return self
+
+    def stop(self):
+        """
+        Stops relaying and closes the sockets.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        # closing a socket does not wake a thread blocked on it, shutting it down does
+        for sock in [self.socket] + list(self.upstreams.values()):
+            try:
+                sock.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+            sock.close()
+        for thread in self.threads:
+            thread.join(timeout=1)
+
+    def spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def relayClients(self):
+        """
+        Receives the datagrams of the clients and schedules them towards the server.
+        """
+        while self.running:
+            try:
+                data, addr = self.socket.recvfrom(65535)
+            except OSError:
+                return
+            if not self.running:
+                return
+
+            upstream = self.upstreams.get(addr)
+            if upstream is None:
+                upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                upstream.connect(self.target)
+                self.upstreams[addr] = upstream
+                self.spawn(self.relayServer, upstream, addr)
+
+            self.impair('up', self.up, upstream, data, None)
+
+    def relayServer(self, upstream, client):
+        """
+        Receives the datagrams of the server for one client and schedules them towards the client.
+        """
+        while self.running:
+            try:
+                data = upstream.recv(65535)
+            except OSError:
+                return
+            if not self.running:
+                return
+
+            self.impair('down', self.down, self.socket, data, client)
+
+    def impair(self, direction, impairment, sock, data, addr):
+        """
+        Decides the fate of a datagram and schedules its copies.
+        """
+        stats = self.stats[direction]
+        now = time.monotonic()
+
+        # both directions share the random generator and the schedule
+        with self.condition:
+            stats['received'] += 1
+
+            if self.random.random() < impairment.loss:
+                stats['lost'] += 1
+                return
+
+            if data[:3] == b'212' and len(data) > 3 and self.random.random() < impairment.corrupt:
+                stats['corrupted'] += 1
+                bit = self.random.randrange(24, len(data) * 8)
+                data = bytearray(data)
+                data[bit // 8] ^= 1 << bit % 8
+                data = bytes(data)
+
+            copies = 1
+            if self.random.random() < impairment.duplicate:
+                stats['duplicated'] += 1
+                copies = 2
+
+            for _ in range(copies):
+                delay = impairment.delay + self.random.uniform(-impairment.jitter, impairment.jitter)
+                if self.random.random() < impairment.reorder:
+                    stats['reordered'] += 1
+                    delay += impairment.reorderDelay
+                departure = now + max(delay, 0) / 1000
+
+                # the datagram waits for the data queued before it to be sent
+                if impairment.bandwidth:
+                    start = max(now, self.nextFree[direction])
+                    if (start - now) * 1000 > impairment.queue:
+                        stats['overflowed'] += 1
+                        continue
+                    self.nextFree[direction] = start + len(data) * 8 / impairment.bandwidth
+                    departure += self.nextFree[direction] - now
+
+                heapq.heappush(self.schedule, (departure, self.order, sock, data, addr))
+                self.order += 1
+            self.condition.notify()
+
+    def sendScheduled(self):
+        """
+        Sends the datagrams when their departure time comes.
+        """
+        while True:
+            with self.condition:
+                while self.running and (not self.schedule or self.schedule[0][0] > time.monotonic()):
+                    timeout = self.schedule[0][0] - time.monotonic() if self.schedule else None
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                _, _, sock, data, addr = heapq.heappop(self.schedule)
+
+            try:
+                if addr is None:
+                    sock.send(data)
+                else:
+                    sock.sendto(data, addr)
+            except OSError:
+                continue
+            with self.condition:
+                self.stats['up' if addr is None else 'down']['sent'] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UDP relay that impairs the traffic between clients and a server')
+    parser.add_argument('--listen', type=int, default=7000, help='port the clients send to')
+    parser.add_argument('--target', default='127.0.0.1:6000', help='address of the server, ip:port')
+    parser.add_argument('--impair', default='', help='impairments of both directions, e.g. loss=0.01,delay=20')
+    parser.add_argument('--up', help='impairments from the clients to the server, instead of --impair')
+    parser.add_argument('--down', help='impairments from the server to the clients, instead of --impair')
+    parser.add_argument('--seed', type=int, help='seed of the random impairments')
+    args = parser.parse_args()
+
+    ip, port = args.target.rsplit(':', 1)
+    relay = UdpImpairmentRelay((ip, int(port)),
+                               up=Impairment.parse(args.up if args.up is not None else args.impair),
+                               down=Impairment.parse(args.down if args.down is not None else args.impair),
+                               listen=('0.0.0.0', args.listen), seed=args.seed).start()
+    print(f'[Impairment Relay]: {relay.address[1]} -> {args.target}')
+
+    try:
+        while True:
+            time.sleep(5)
+            print('[Impairment Relay]:', relay.stats)
+    except KeyboardInterrupt:
+        relay.stop()
+
+
+if __name__ == '__main__':
+    main()
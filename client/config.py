@@ -3,4 +3,45 @@ import os
 ROOT_PATH = os.path.dirname(__file__)
 FILE_PATH = ROOT_PATH+"\\files"
 LIST_PATH = ROOT_PATH+"\\files.json"
-SERVER_IP = '127.0.0.1'
\ No newline at end of file
+SERVER_IP = '127.0.0.1'
+# number of UDP segments sent before waiting for acknowledgments. 1 is stop-and-wait
+UDP_WINDOW_SIZE = 32
+
+# seconds a UDP message waits for its acknowledgment before it is sent again. the timeout follows the measured
+# round trip time between UDP_MIN_RTO and UDP_MAX_RTO, starting from UDP_INITIAL_RTO
+UDP_INITIAL_RTO = 0.5
+UDP_MIN_RTO = 0.01
+UDP_MAX_RTO = 5
+# retransmissions of a UDP message before the peer is given up
+UDP_MAX_RETRIES = 12
+
+# TCP transfer mode requested from the server: 'ack' acknowledges every segment, 'stream' confirms the file once
+TCP_MODE = 'stream'
+
+# payload bytes per segment asked from the server
+SEGMENT_SIZE = 1000
+# find the largest UDP datagram that reaches the server without fragmentation and use it as segment size
+UDP_MTU_PROBE = True
+
+# sessions a download is split into, one byte range each. files smaller than two ranges of PARALLEL_MIN_RANGE bytes
+# are downloaded over one session
+PARALLEL_STREAMS = 4
+PARALLEL_MIN_RANGE = 1 << 20
+
+# lowest level of the printed log messages: 'DEBUG', 'INFO', 'WARNING' or 'ERROR'
+LOG_LEVEL = 'INFO'
+# seconds between two progress messages of a transfer
+PROGRESS_INTERVAL = 0.5
+
+# codecs asked from the server to compress transfers with, by preference: 'zlib', 'lzma' or both separated by commas.
+# files that are compressed already are sent raw. '' to never compress
+COMPRESSION = 'zlib'
+# threads compressing the segments of a transfer ahead of the sender
+COMPRESSION_WORKERS = 2
+
+# uploads of files of at least DELTA_MIN_SIZE bytes that the server has a version of only send the changes
+DELTA_MIN_SIZE = 64 * 1024
+
+# integrity check asked from the server: 'crc32' checks every UDP segment and every file against its crc32 and sends
+# damaged segments again. '' to not check
+CHECK = 'crc32'
@@ -1,19 +1,36 @@
 from .connection import Connection
 import time
-from file import readFile, compileData, writeFile,  segmentData
+import socket
+import zlib
+from file import PartialFile, FileRange, streamFile, getFileSize, getFileHash, getChecksum
 import json
+from framing import FrameReader, packFrame, frameHeader
+from log import Progress
+from rto import RetransmitTimer
+from compression import chooseCodec, encodeSegments, decodeSegment
+from delta import SIGNATURE, makeDelta
+from integrity import packSegment, unpackSegment
 
-from config import FILE_PATH, SERVER_IP
+from config import FILE_PATH, SERVER_IP, UDP_WINDOW_SIZE, TCP_MODE, SEGMENT_SIZE, UDP_MTU_PROBE, COMPRESSION, \
+    DELTA_MIN_SIZE, CHECK
 
 # Rim Barakat and Elie Melki
 class TcpFTPConnection(Connection):
 #rim and elie
-    def __init__(self, port, server_ip=None):
+    def __init__(self, port, server_ip=None, options=None):
         self.fileToReceive = None
         self.SEPERATOR = b'\x1c'
 
-        self.BUFFER_SIZE = 1000
+        self.STREAM_SEGMENT = 65536  # bytes written or read at once in streaming mode
+        # options granted by the server
+        self.options = options or {}
+        self.BUFFER_SIZE = int(self.options.get('segment', SEGMENT_SIZE))  # payload bytes per segment
         Connection.__init__(self, 'TCP FTP Connection', port, 'TCP', server_ip=server_ip)
+        # messages are written whole. a frame header written before its data, like in sendStream, is sent at once
+        # instead of waiting for the acknowledgment of the last data (Nagle)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # messages are framed with a fixed [opcode|length] header (see framing.py)
+        self.reader = FrameReader(self.socket)
 
     # get the list of files available in the server
     def getFiles(self):
@@ -28,45 +45,108 @@ class TcpFTPConnection(Connection):
 
         return fileList
 
+    def getStats(self):
+        """
+        Gets the transfer statistics of the session from the server.
+        :returns dict - transfers, current and cache statistics
+        """
+        self.sendMessage("250")
+        opcode, stats, _ = self.listen()
+
+        assert opcode == b'250', f'Incorrect response {opcode}'
+
+        return json.loads(stats)
+
+    def getUploadOffset(self, fileName, fileType, size):
+        """
+        Asks the server where an interrupted upload of a file can continue from.
+        :returns int - bytes of the file kept by the server
+        """
+        self.sendMessage(f'218{fileName}\x1c{fileType}\x1c{size}')
+        opcode, args, _ = self.listen()
+
+        assert opcode == b'218', f'Incorrect response {opcode}'
+
+        return int(args.decode('utf-8'))
+
+    def getFileDetails(self, fileID):
+        """
+        :param fileID: int - id of the file in the file list
+        :returns (str, str, int) - name, type and size in bytes of the file
+        """
+        self.sendMessage(f'219{fileID}')
+        opcode, args, _ = self.listen()
+
+        assert opcode == b'219', f'Incorrect response {opcode}'
+
+        fileName, fileType, size = args.split(self.SEPERATOR)
+        return fileName.decode('utf-8'), fileType.decode('utf-8'), int(size.decode('utf-8'))
+
     # client downloads files from server
-    def downloadFile(self, fileID, directory, log= lambda a,b,c: None ):
-        self.sendMessage(f'241{fileID}')
+    def downloadFile(self, fileID, directory, log= lambda a,b,c: None, offset=0, length=None):
+        """
+        :param offset: int - optional - bytes of the file kept from an interrupted download, to continue from
+        :param length: int - optional - bytes to download from the offset into the .ranges file of the file
+        (see downloadParallel). the file is downloaded up to its end if not given
+        """
+        self.sendMessage(formatDownload(fileID, offset, length))
         opcode, args, timestamp = self.listen()
 
+        if opcode == b'400' and offset and length is None:
+            # the file changed on the server since the data was kept. start over
+            return self.downloadFile(fileID, directory, log)
         assert opcode == b'241', "Incorrect Response"
 
-        fileName, fileType, numSegments = args.split(b'\x1c')
+        argList = args.split(b'\x1c')
+        fileName, fileType, numSegments = argList[:3]
         fileName, fileType, numSegments = fileName.decode('utf-8'), fileType.decode('utf-8'), int(
             numSegments.decode('utf-8'))
+        codec = argList[4].decode('utf-8') if len(argList) > 4 else ''
+        crc = int(argList[5], 16) if len(argList) > 5 and argList[5] else None
 
         # generate file data
         self.fileToReceive = {
             'name': fileName,
             'type': fileType,
-            'segments': [],  # list of arriving segments
+            'progress': Progress(self.log),  # samples the progress messages
+            # data is written to it as it arrives
+            'file': PartialFile(fileName, fileType, directory, offset) if length is None else
+            FileRange(fileName, fileType, directory, offset),
+            'codec': codec,  # codec of the segments. '' if raw
+            'crc': crc,  # crc32 of the data announced by the server. None if it is not checked
             'received': 0,  # number of received segments
             'total': numSegments,  # total number of segments
             'timestamps': [time.perf_counter_ns() / 1000.0],  # timestamps of arrival of segments
             'rate': 0,  # realtime average of bitrate
             'path': directory
         }
-        
 
-        while self.fileToReceive:
-            opcode, args, timestamp = self.listen()
-            assert opcode == b'212', "Incorrect Response"
-            self.receiveSegment(args, timestamp, log)
+        try:
+            # in streaming mode the header carries the size of the data sent from the offset
+            if self.options.get('mode') == 'stream':
+                self.fileToReceive['size'] = int(argList[3].decode('utf-8'))
+                return self.receiveStream(log)
+
+            while self.fileToReceive:
+                opcode, args, timestamp = self.listen()
+                assert opcode == b'212', "Incorrect Response"
+                self.receiveSegment(args, timestamp, log)
+        finally:
+            # the download stopped in the middle. the data received so far is kept to continue it
+            if self.fileToReceive:
+                self.fileToReceive['file'].close()
+                self.fileToReceive = None
 
     def receiveSegment(self, args, timestamp, log= lambda a,b,c: None ):
 
         assert self.fileToReceive is not None, "Server not expecting file"
         assert self.fileToReceive['received'] != self.fileToReceive['total'], "Received all segments"
 
-        data = args
+        data = decodeSegment(self.fileToReceive['codec'], args, self.BUFFER_SIZE)
         # increment the number of segments received
         self.fileToReceive["received"] += 1
-        # save the segment data and append data
-        self.fileToReceive['segments'].append(data)
+        # save the segment data
+        self.fileToReceive['file'].append(data)
         # add the timestamp of arrival of segment
         self.fileToReceive['timestamps'].append(timestamp)
 
@@ -78,54 +158,137 @@ class TcpFTPConnection(Connection):
             duration=timestamp - self.fileToReceive['timestamps'][-2]
         )
         self.sendMessage('100 received')
-        print(f'[{self.name}]:',
-              f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["rate"])} bps ')
+        if self.fileToReceive['progress'].due(self.fileToReceive['received'], self.fileToReceive['total']):
+            self.log.info(f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["rate"])} bps ')
 
         log(self.fileToReceive["received"],self.fileToReceive["total"],self.fileToReceive["rate"])
 
         if self.fileToReceive['received'] == self.fileToReceive['total']:
-            data = compileData(self.fileToReceive['segments'])
-            writeFile(self.fileToReceive['name'], self.fileToReceive['type'], self.fileToReceive['path'], data)
+            self.verifyFile()
+            self.fileToReceive['file'].commit()
 
-            print(f'[{self.name}]:',
-                  f'file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] Received successfully')
+            self.log.info(f'file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] Received successfully')
 
             self.fileToReceive = None
 
+    def receiveStream(self, log= lambda a,b,c: None ):
+        """
+        Receives the data of the file in transit in streaming mode and confirms it with its crc32.
+        The whole file is the payload of one 212 message and is read in chunks.
+        A compressed file is sent as one 212 message per compressed chunk instead, and an empty 212 message ends it.
+        With the 'check' option the data is only kept if it matches the crc32 sent by the server.
+        """
+
+        size = self.fileToReceive['size']
+        codec = self.fileToReceive['codec']
+        receivedBytes = 0
+        crc = 0
+
+        if not codec:
+            header = self.reader.readHeader()
+            assert header == (b'212', size), "Incorrect Response"
+
+        while receivedBytes < size or codec:
+            if codec:
+                opcode, payload, timestamp = self.listen()
+                assert opcode == b'212', "Incorrect Response"
+                if not payload:
+                    # end of the file
+                    break
+                data = decodeSegment(codec, payload, self.STREAM_SEGMENT)
+            else:
+                data = self.reader.readChunk(min(self.STREAM_SEGMENT, size - receivedBytes))
+                timestamp = time.perf_counter_ns() / 1000.0
+                assert data, "Server ended connection"
+
+            receivedBytes += len(data)
+            crc = zlib.crc32(data, crc)
+
+            # save the data
+            self.fileToReceive['file'].append(data)
+            self.fileToReceive['timestamps'].append(timestamp)
+            self.fileToReceive['received'] = receivedBytes * self.fileToReceive['total'] // max(size, 1)
+
+            # get average rate
+            self.fileToReceive['rate'] = getAverageRate(
+                sampleNumber=len(self.fileToReceive['timestamps']) - 1,
+                oldAverage=self.fileToReceive['rate'],
+                newSampleSize=len(data),
+                duration=timestamp - self.fileToReceive['timestamps'][-2]
+            )
+            if self.fileToReceive['progress'].due(self.fileToReceive['received'], self.fileToReceive['total']):
+                self.log.info(f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["rate"])} bps ')
+
+            log(self.fileToReceive["received"], self.fileToReceive["total"], self.fileToReceive["rate"])
+
+        assert receivedBytes == size, f'Expected {size} bytes, received {receivedBytes}'
+
+        # confirm the whole file once
+        self.sendMessage(f'100{crc:08x}')
+        if self.fileToReceive['crc'] is not None and crc != self.fileToReceive['crc']:
+            # the server refuses the confirmation of data that does not match
+            self.listen()
+        self.verifyFile()
+        self.fileToReceive['file'].commit()
+        self.log.info(f'file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] Received successfully')
+
+        self.fileToReceive = None
+
     # client uploads files on server
-    def sendFile(self, directory, fileName, fileType, log = lambda a,b,c: None):
-        data = readFile(fileName, fileType, directory)
+    def sendFile(self, directory, fileName, fileType, log = lambda a,b,c: None, resume=False, delta=False,
+                 dedup=False):
+        """
+        :param resume: bool - optional - continue from the data the server kept of an interrupted upload of the file
+        :param delta: bool - optional - send only the changes to the version of the file the server has, if any
+        :param dedup: bool - optional - send no data if the server has a file with the same content already
+        """
+        if dedup and linkFile(self, directory, fileName, fileType):
+            return
 
-        segments, numSegments = segmentData(self.BUFFER_SIZE, data)
+        size = getFileSize(fileName, fileType, directory)
+        offset = self.getUploadOffset(fileName, fileType, size) if resume else 0
 
-        print(f'[{self.name}]:', f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        if delta and not offset and size >= DELTA_MIN_SIZE and \
+                sendDelta(self, directory, fileName, fileType, self.STREAM_SEGMENT * 16, log):
+            return
+
+        # files that are compressed already are sent raw
+        codec = chooseCodec(self.codecs(), fileName, fileType, directory, offset)
+
+        if self.options.get('mode') == 'stream':
+            return self.sendStream(directory, fileName, fileType, log, offset, codec)
+
+        segments, numSegments, size = streamFile(self.BUFFER_SIZE, fileName, fileType, directory, offset)
+        size -= offset
+
+        self.log.info(f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        progress = Progress(self.log)
 
         # generate file data
         self.fileToSend = {
             'name': fileName,
             'type': fileType,
-            'ACKS': [False] * numSegments,  # list of arriving segments
-            'sent': 0,  # number of received segments
             'total': numSegments,  # total number of segments
             'bitrates': [time.perf_counter_ns() / 1000.0],  # timestamps of arrival of segments
         }
 
-        self.sendMessage(f'211{fileName}\x1c{fileType}\x1c{numSegments}')
+        self.sendMessage(f'211{fileName}\x1c{fileType}\x1c{numSegments}\x1c{size + offset}\x1c{offset}\x1c{codec}' +
+                         self.formatChecksum(directory, fileName, fileType, offset))
         # generate average bitrate 
         start = None
         end = None
-        for i, s in enumerate(segments):
+        for i, (_, s) in enumerate(encodeSegments(segments, codec)):
             startS, endS, bitrate = self.sendSegment(i, s)
-            print(f'[{self.name}]:',
-                  f'Sending file [{fileName}.{fileType}] - ({i + 1}/{numSegments}) - {round(bitrate)} bps')
+            if progress.due(i + 1, numSegments):
+                self.log.info(f'Sending file [{fileName}.{fileType}] - ({i + 1}/{numSegments}) - {round(bitrate)} bps')
             log(i + 1,numSegments,bitrate )
 
             if not start:
                 start = startS
             end = endS
 
-        throughput = len(data) * 8 / (end - start) * 1E6
-        print(f'[{self.name}]:', f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
+        throughput = size * 8 / (end - start) * 1E6
+        self.log.info(f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
 
     def sendSegment(self, index, segment):
         msg = f'212'
@@ -134,6 +297,59 @@ class TcpFTPConnection(Connection):
         bitrate = len(segment) * 8 / durationAll * 1E6
         return startSend, endAll, bitrate
 
+    def sendStream(self, directory, fileName, fileType, log = lambda a,b,c: None, offset=0, codec=''):
+        """
+        Uploads a file in streaming mode. The data is written as one 212 message without waiting for acknowledgments
+        and the server confirms the whole file with its crc32.
+        A compressed file is written as one 212 message per compressed chunk, and an empty 212 message ends it.
+        """
+
+        segments, numSegments, size = streamFile(self.STREAM_SEGMENT, fileName, fileType, directory, offset)
+
+        self.log.info(f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        progress = Progress(self.log)
+
+        self.sendMessage(f'211{fileName}\x1c{fileType}\x1c{numSegments}\x1c{size}\x1c{offset}\x1c{codec}' +
+                         self.formatChecksum(directory, fileName, fileType, offset))
+        size -= offset
+        opcode, args, _ = self.listen()
+        assert opcode == b'100', f'Server refused file: {args}'
+
+        crc = 0
+        sentBytes = 0
+
+        def checked(segments):
+            # the crc32 covers the file data, before it is compressed
+            nonlocal crc
+            for s in segments:
+                crc = zlib.crc32(s, crc)
+                yield s
+
+        start = time.perf_counter_ns() / 1000.0
+        if not codec:
+            self.socket.sendall(frameHeader(b'212', size))
+        # the chunks are compressed in the compression threads ahead of the socket
+        for i, (fileBytes, s) in enumerate(encodeSegments(checked(segments), codec)):
+            self.socket.sendall(packFrame(b'212' + s) if codec else s)
+            sentBytes += fileBytes
+
+            bitrate = getBitrate(sentBytes, time.perf_counter_ns() / 1000.0 - start)
+            if progress.due(i + 1, numSegments):
+                self.log.info(f'Sending file [{fileName}.{fileType}] - ({i + 1}/{numSegments}) - {round(bitrate)} bps')
+            log(i + 1, numSegments, bitrate)
+        if codec:
+            # end of the file
+            self.socket.sendall(packFrame(b'212'))
+
+        # wait for the confirmation of the whole file
+        opcode, args, _ = self.listen()
+        end = time.perf_counter_ns() / 1000.0
+        assert opcode == b'100', f'Server refused file: {args}'
+        assert args[:8] == bytes(f'{crc:08x}', 'utf-8'), f'File [{fileName}.{fileType}] was corrupted in transit'
+
+        throughput = size * 8 / (end - start) * 1E6
+        self.log.info(f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
+
     def sendMessage(self, message, isString=True, waitSuccess=False):
         """
                     Sends a message to the client.
@@ -147,44 +363,109 @@ class TcpFTPConnection(Connection):
 
             # send message to client
             ticSend = time.perf_counter_ns() / 1000.0
-            self.socket.sendall(data)
+            self.socket.sendall(packFrame(data))
             tocSend = time.perf_counter_ns() / 1000.0
             tocAll = tocSend
             if waitSuccess:
                 # wait message from client
-                rec = self.socket.recv(1024)
+                rec = self.reader.readFrame()
                 tocAll = time.perf_counter_ns() / 1000.0
+                assert rec is not None, "Server ended connection"
 
                 # verify acknowledgment message
-                if rec and rec[:3] == b'100':
-                    return ticSend, tocSend, tocAll, tocSend - ticSend, tocAll - ticSend
-                else:
+                assert rec[:3] != b'400', f'Server refused segment: {rec[3:]}'
+                if rec[:3] != b'100':
                     ticSend, tocSend, tocAll, _, _ = self.sendMessage(data, isString=False, waitSuccess=True)
 
+            return ticSend, tocSend, tocAll, tocSend - ticSend, tocAll - ticSend
+
+    def request(self, message, isString=True):
+        """
+        Sends a request and waits for its reply.
+        :returns (byteArray, byteArray, float) - opcode, args and time of arrival of the reply
+        """
+        self.sendMessage(message, isString)
+        return self.listen()
 
     def listen(self):
-        data = self.socket.recv(1024)
+        data = self.reader.readFrame()
         timestamp = time.perf_counter_ns() / 1000.0
-        assert len(data) > 3, "No agrs received"
+        assert data is not None, "Server ended connection"
+        assert len(data) >= 3, "No opcode received"
         return data[:3], data[3:], timestamp
 
     def type():
         return 0  # type 0 for TCP 
 
+    def codecs(self):
+        """
+        :returns list - codecs granted by the server, by preference
+        """
+        return list(filter(None, self.options.get('compress', '').split(',')))
+
+    def check(self):
+        """
+        :returns str - integrity check granted by the server. '' if none
+        """
+        return self.options.get('check', '')
+
+    def formatChecksum(self, directory, fileName, fileType, offset=0):
+        """
+        :returns str - the crc32 field of the 211 request of a file, sent with the 'check' option. '' otherwise
+        """
+        return f'\x1c{getChecksum(fileName, fileType, directory, offset):08x}' if self.check() else ''
+
+    def verifyFile(self):
+        """
+        Checks the data of the file in transit against the crc32 sent by the server. A corrupted download is dropped.
+        """
+        fileToReceive = self.fileToReceive
+        intact = fileToReceive['file'].verify(fileToReceive['crc'])
+        if not intact:
+            self.fileToReceive = None
+        assert intact, f'File [{fileToReceive["name"]}.{fileToReceive["type"]}] was corrupted in transit'
+
+    @staticmethod
+    def defaultOptions():
+        options = {'mode': TCP_MODE, 'segment': SEGMENT_SIZE}
+        if COMPRESSION:
+            options['compress'] = COMPRESSION
+        if CHECK:
+            options['check'] = CHECK
+        return options
+
 # Marc Andraos
 class UdpFTPConnection(Connection):
     #Mark
-    def __init__(self, port, server_ip=None):
+    def __init__(self, port, server_ip=None, options=None):
 
         self.fileToReceive  = None
+        # options granted by the server
+        self.options = options or {}
         self.SEPERATOR = b'\x1c'
-        self.BUFFER_SIZE = 1000
+        self.SEGMENT_HEADER = 20  # bytes in front of the data of a segment datagram, with its crc32
+        self.MIN_DATAGRAM = 548  # datagram size every IPv4 path carries without fragmentation
+        self.MAX_DATAGRAM = 65507  # largest UDP payload over IPv4
+        self.PROBE_TIMEOUT = 0.25  # seconds to wait for the answer of an MTU probe
+        self.BUFFER_SIZE = int(self.options.get('segment', SEGMENT_SIZE))  # payload bytes per segment
+        # bytes asked from recvfrom at least. replies naming files, like 241, can be longer than a segment
+        self.CONTROL_BUFFER = 4096
+        self.RECEIVE_BUFFER = max(self.CONTROL_BUFFER, self.BUFFER_SIZE + self.SEGMENT_HEADER)  # bytes asked from recvfrom
+        self.WINDOW_SIZE = UDP_WINDOW_SIZE  # maximum number of segments in flight
+        # timeout of unacknowledged messages, adapted to the round trip time of the server
+        self.timer = RetransmitTimer()
+        # sequence number of the first segment of the next file sent. segments are numbered on from one file to the
+        # next, so a late acknowledgment of a segment of an earlier file is never taken for one of the file in transit
+        self.nextSequence = 0
         Connection.__init__(self, 'UDP FTP Connection', port, 'UDP', server_ip=server_ip)
 
+        # servers that negotiate the segment size also answer MTU probes
+        if UDP_MTU_PROBE and 'segment' in self.options:
+            self.setSegmentSize(self.probeSegmentSize())
+
 
     def getFiles(self):
-        self.sendMessage("230")
-        opcode, fileListString, _ = self.listen()
+        opcode, fileListString, _ = self.request("230")
 
         assert opcode == b'230', f'Incorrect response {opcode}'
 
@@ -194,21 +475,151 @@ class UdpFTPConnection(Connection):
 
         return fileList
 
+    def getStats(self):
+        """
+        Gets the transfer statistics of the session from the server.
+        :returns dict - transfers, current and cache statistics
+        """
+        # the statistics can be bigger than a segment
+        opcode, stats, _ = self.request("250", self.MAX_DATAGRAM)
 
-    def downloadFile(self, fileID, directory, log= lambda a,b,c: a ):
-        self.sendMessage(f'241{fileID}')
-        opcode, args, timestamp = self.listen()
+        assert opcode == b'250', f'Incorrect response {opcode}'
+
+        return json.loads(stats)
 
+
+    def probeSegmentSize(self):
+        """
+        Finds the largest datagram that reaches the server without fragmentation with a binary search of 213 probes.
+        :returns int - the largest segment payload that fits in that datagram
+        """
+
+        # forbid fragmentation so oversized probes are refused or dropped instead of split
+        if hasattr(socket, 'IP_MTU_DISCOVER'):
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MTU_DISCOVER, socket.IP_PMTUDISC_DO)
+        elif hasattr(socket, 'IP_DONTFRAGMENT'):
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_DONTFRAGMENT, 1)
+
+        # low always gets through, high is the first size not known to get through
+        low, high = self.MIN_DATAGRAM, self.MAX_DATAGRAM + 1
+        while high - low > 16:
+            size = (low + high) // 2
+            if self.probe(size):
+                low = size
+            else:
+                high = size
+
+        self.log.info(f'Largest datagram without fragmentation: {low} bytes')
+        return low - self.SEGMENT_HEADER
+
+    def probe(self, size, attempts=2):
+        """
+        Sends a 213 probe padded to the given datagram size and waits for the server to answer it.
+        :param size: int - size of the datagram to test
+        :param attempts: int - number of probes sent before giving up
+        :returns bool - True if the probe reached the server
+        """
+        message = bytes(f'213{size}\x1c', 'utf-8')
+        message += bytes(size - len(message))
+        expected = bytes(f'213{size}', 'utf-8')
+
+        try:
+            for attempt in range(attempts):
+                # the kernel refuses datagrams larger than the known path MTU right away
+                try:
+                    self.socket.sendto(message, self.server)
+                except OSError:
+                    return False
+                sent = time.perf_counter()
+
+                self.socket.settimeout(self.PROBE_TIMEOUT)
+                try:
+                    # answers of earlier probes are skipped
+                    while True:
+                        rec, addr = self.socket.recvfrom(self.RECEIVE_BUFFER)
+                        if addr == self.server and rec == expected:
+                            # answered probes give the first round trip samples
+                            if attempt == 0:
+                                self.timer.sample(time.perf_counter() - sent)
+                            return True
+                except socket.timeout:
+                    continue
+        finally:
+            self.socket.settimeout(None)
+
+        return False
+
+    def setSegmentSize(self, size):
+        """
+        OPCODE 214
+        Asks the server to use the given segment size for the session and sizes the receive buffers to match.
+        :param size: int - requested payload bytes per segment
+        """
+        # answers of earlier probes are skipped
+        _, args, _ = self.request(f'214{size}', expected=b'214')
+
+        self.BUFFER_SIZE = int(args.decode('utf-8'))
+        self.RECEIVE_BUFFER = max(self.CONTROL_BUFFER, self.BUFFER_SIZE + self.SEGMENT_HEADER)
+
+        # let the kernel hold a whole window of segments
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.WINDOW_SIZE * self.RECEIVE_BUFFER)
+        self.log.info(f'Segment size set to {self.BUFFER_SIZE} bytes')
+
+    def getUploadOffset(self, fileName, fileType, size):
+        """
+        Asks the server where an interrupted upload of a file can continue from.
+        :returns int - bytes of the file kept by the server
+        """
+        opcode, args, _ = self.request(f'218{fileName}\x1c{fileType}\x1c{size}')
+
+        assert opcode == b'218', f'Incorrect response {opcode}'
+
+        return int(args.decode('utf-8'))
+
+    def getFileDetails(self, fileID):
+        """
+        :param fileID: int - id of the file in the file list
+        :returns (str, str, int) - name, type and size in bytes of the file
+        """
+        opcode, args, _ = self.request(f'219{fileID}')
+
+        assert opcode == b'219', f'Incorrect response {opcode}'
+
+        fileName, fileType, size = args.split(self.SEPERATOR)
+        return fileName.decode('utf-8'), fileType.decode('utf-8'), int(size.decode('utf-8'))
+
+    def downloadFile(self, fileID, directory, log= lambda a,b,c: a, offset=0, length=None):
+        """
+        :param offset: int - optional - bytes of the file kept from an interrupted download, to continue from
+        :param length: int - optional - bytes to download from the offset into the .ranges file of the file
+        (see downloadParallel). the file is downloaded up to its end if not given
+        """
+        opcode, args, timestamp = self.request(formatDownload(fileID, offset, length))
+
+        if opcode == b'400' and offset and length is None:
+            # the file changed on the server since the data was kept. start over
+            return self.downloadFile(fileID, directory, log)
         assert opcode == b'241', "Incorrect Response"
 
-        fileName, fileType, numSegments = args.split(b'\x1c')
+        argList = args.split(b'\x1c')
+        fileName, fileType, numSegments = argList[:3]
         fileName, fileType, numSegments = fileName.decode('utf-8'), fileType.decode('utf-8'), int(numSegments.decode('utf-8'))
+        codec = argList[4].decode('utf-8') if len(argList) > 4 else ''
+        crc = int(argList[5], 16) if len(argList) > 5 and argList[5] else None
+        first = int(argList[6].decode('utf-8')) if len(argList) > 6 else 0
 
         # generate file data
         self.fileToReceive = {
             'name': fileName,
             'type': fileType,
-            'segments': [None] * numSegments,  # list of arriving segments
+            'progress': Progress(self.log),  # samples the progress messages
+            # segments are written to it in order
+            'file': PartialFile(fileName, fileType, directory, offset) if length is None else
+            FileRange(fileName, fileType, directory, offset),
+            'codec': codec,  # codec of the segments. '' if raw
+            'crc': crc,  # crc32 of the data announced by the server. None if it is not checked
+            'first': first,  # sequence number of the first segment
+            'arrived': bytearray(numSegments),  # 1 for every segment already received
             'received': 0,  # number of received segments
             'total': numSegments,  # total number of segments
             'timestamps': [time.perf_counter_ns() / 1000.0],  # timestamps of arrival of segments
@@ -217,10 +628,20 @@ class UdpFTPConnection(Connection):
         }
         self.sendMessage(f'100 file ready to receive')
 
-        while self.fileToReceive:
-            opcode, args, timestamp = self.listen()
-            assert opcode == b'212', "Incorrect Response"
-            self.receiveSegment(args, timestamp,log)
+        try:
+            while self.fileToReceive:
+                opcode, args, timestamp = self.listen()
+                if opcode == b'241' and self.fileToReceive['received'] == 0:
+                    # the server did not get the acknowledgment of the file and sent it again
+                    self.sendMessage(f'100 file ready to receive')
+                    continue
+                assert opcode == b'212', "Incorrect Response"
+                self.receiveSegment(args, timestamp,log)
+        finally:
+            # the download stopped in the middle. the data received in order is kept to continue it
+            if self.fileToReceive:
+                self.fileToReceive['file'].close()
+                self.fileToReceive = None
 
 
     def receiveSegment(self, args, timestamp, log= lambda a,b,c: a ):
@@ -228,21 +649,29 @@ class UdpFTPConnection(Connection):
         assert self.fileToReceive is not None, "Server not expecting file"
         assert self.fileToReceive['received'] != self.fileToReceive['total'], "Received all segments"
 
-        # find index of first separator
-        separateAt = args.find(self.SEPERATOR)
-        assert separateAt != -1, "Expected 2 arguments: sequence number, data"
-        # split args
-        seqNum, data = [args[:separateAt], args[separateAt+1:]]
-        seqNum = int(seqNum.decode('utf-8'))
+        sequence, data, intact = unpackSegment(args, self.check())
+        # index of the segment in the file
+        seqNum = sequence - self.fileToReceive['first'] if sequence is not None else None
 
+        # a damaged segment is dropped and asked for again, unless a copy of it arrived already
+        if not intact:
+            if seqNum is not None and 0 <= seqNum < self.fileToReceive['total'] and \
+                    not self.fileToReceive['arrived'][seqNum]:
+                self.sendMessage(f'101{sequence}')
+            return
+
+        assert sequence is not None, "Expected 2 arguments: sequence number, data"
         assert seqNum < self.fileToReceive['total'], "Sequence number not in range"
-        if self.fileToReceive['segments'][seqNum] is not None:
-            self.sendMessage(f'100{seqNum}')
+        # a retransmission of an earlier file, whose acknowledgment was lost. acknowledge it again
+        if seqNum < 0 or self.fileToReceive['arrived'][seqNum]:
+            self.sendMessage(f'100{sequence}')
             return
         # increment the number of segments received
         self.fileToReceive["received"] += 1
         # save the segment data
-        self.fileToReceive['segments'][seqNum] = data
+        self.fileToReceive['arrived'][seqNum] = 1
+        data = decodeSegment(self.fileToReceive['codec'], data, self.BUFFER_SIZE)
+        self.fileToReceive['file'].writeSegment(seqNum, data)
         # add the timestamp of arrival of segment
         self.fileToReceive['timestamps'].append(timestamp)
 
@@ -252,61 +681,161 @@ class UdpFTPConnection(Connection):
             newSampleSize=len(data),
             duration=timestamp - self.fileToReceive['timestamps'][-2]
         )
-        self.sendMessage(f'100{seqNum}')
-        print(f'[{self.name}]:',
-              f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["rate"])} bps ')
+        self.sendMessage(f'100{sequence}')
+        if self.fileToReceive['progress'].due(self.fileToReceive['received'], self.fileToReceive['total']):
+            self.log.info(f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["rate"])} bps ')
 
         log(self.fileToReceive["received"],self.fileToReceive["total"],self.fileToReceive["rate"] )
 
         if self.fileToReceive['received'] == self.fileToReceive['total']:
-            data = compileData(self.fileToReceive['segments'])
-            writeFile(self.fileToReceive['name'], self.fileToReceive['type'], self.fileToReceive['path'], data)
-            print(f'[{self.name}]:',
-                  f'file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] Received successfully')
+            self.verifyFile()
+            self.fileToReceive['file'].commit()
+            self.log.info(f'file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] Received successfully')
 
             self.fileToReceive = None
 
 
-    def sendFile(self, directory, fileName, fileType, log = lambda a,b,c: None):
+    def sendFile(self, directory, fileName, fileType, log = lambda a,b,c: None, resume=False, delta=False,
+                 dedup=False):
+        """
+        :param resume: bool - optional - continue from the data the server kept of an interrupted upload of the file
+        :param delta: bool - optional - send only the changes to the version of the file the server has, if any
+        :param dedup: bool - optional - send no data if the server has a file with the same content already
+        """
+        if dedup and linkFile(self, directory, fileName, fileType):
+            return
 
-        data = readFile(fileName, fileType, directory)
+        size = getFileSize(fileName, fileType, directory)
+        offset = self.getUploadOffset(fileName, fileType, size) if resume else 0
 
-        segments, numSegments = segmentData(self.BUFFER_SIZE, data)
+        if delta and not offset and size >= DELTA_MIN_SIZE and \
+                sendDelta(self, directory, fileName, fileType, self.BUFFER_SIZE + self.SEGMENT_HEADER, log):
+            return
+
+        # a compressed segment has a flag byte, so it carries one byte less of the file to fit in a datagram
+        codec = chooseCodec(self.codecs(), fileName, fileType, directory, offset) if self.BUFFER_SIZE > 1 else ''
+        segmentSize = self.BUFFER_SIZE - 1 if codec else self.BUFFER_SIZE
 
-        print(f'[{self.name}]:', f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        segments, numSegments, size = streamFile(segmentSize, fileName, fileType, directory, offset)
+
+        self.log.info(f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        progress = Progress(self.log)
 
         # generate file data
         self.fileToSend = {
             'name': fileName,
             'type': fileType,
-            'ACKS': [False] * numSegments,  # list of arriving segments
-            'sent': 0,  # number of received segments
             'total': numSegments,  # total number of segments
             'bitrates': [time.perf_counter_ns() / 1000.0],  # timestamps of arrival of segments
         }
 
-        self.sendMessage(f'211{fileName}\x1c{fileType}\x1c{numSegments}', waitSuccess=True)
+        first = self.nextSequence
+        self.nextSequence += numSegments
+        self.sendMessage(f'211{fileName}\x1c{fileType}\x1c{numSegments}\x1c{size}\x1c{offset}\x1c{codec}' +
+                         self.formatChecksum(directory, fileName, fileType, offset) + f'\x1c{first}', waitSuccess=True)
+        size -= offset
 
-        start = None
-        end = None
-        for i, s in enumerate(segments):
-            startS, endS, bitrate = self.sendSegment(i, s)
-            print(f'[{self.name}]:',
-                  f'Sending file [{fileName}.{fileType}] - ({i + 1}/{numSegments}) - {round(bitrate)} bps')
-            log(i + 1,numSegments,bitrate)
+        def onAcknowledged(index, done, bitrate):
+            if progress.due(done, numSegments):
+                self.log.info(f'Sending file [{fileName}.{fileType}] - ({done}/{numSegments}) - {round(bitrate)} bps')
+            log(done, numSegments, bitrate)
 
-            if not start:
-                start = startS
-            end = endS
+        start, end = self.sendWindow(encodeSegments(segments, codec), numSegments, first, onAcknowledged)
 
-        throughput = len(data) * 8 / (end - start) * 1E6
-        print(f'[{self.name}]:', f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
+        throughput = size * 8 / (end - start) * 1E6
+        self.log.info(f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps - '
+                      f'timeouts: {self.timer.timeouts} - retransmits: {self.timer.retransmits}')
 
-    def sendSegment(self,index, segment):
-        msg = f'212{index}\x1c'
-        startSend, endSend, endAll, durationSend, durationAll = self.sendMessage(bytes(msg,'utf-8')+segment,isString=False, waitSuccess=True)
-        bitrate = len(segment)*8/durationAll*1E6
-        return startSend, endAll, bitrate
+    def sendWindow(self, segments, numSegments, first, onAcknowledged):
+        """
+        Sends the segments with selective repeat.
+        Up to WINDOW_SIZE segments are in flight and each one is sent again on its own when its acknowledgment times out,
+        or right away when the server got it damaged.
+        The timeout follows the round trip times of the segments sent once.
+        Segments carry their sequence number, and so do their acknowledgments. Acknowledgments of segments that are
+        not in flight, like the other copies of a segment sent again or segments of an earlier file, are skipped.
+
+        :param segments: iterator - (file bytes, payload) of every segment of the file
+        :param numSegments: int - number of segments in the iterator
+        :param first: int - sequence number of the first segment
+        :param onAcknowledged: function(index, done, bitrate) - called for every newly acknowledged segment
+        :returns (float, float) - time of the first send and of the last acknowledgment in microseconds
+        """
+
+        # sequence number -> [message, time of first send, time of last send, segment size, attempts]
+        inFlight = {}
+        nextIndex = 0
+        done = 0
+        start = end = time.perf_counter_ns() / 1000.0
+
+        try:
+            while done < numSegments:
+                # fill the window
+                while len(inFlight) < self.WINDOW_SIZE and nextIndex < numSegments:
+                    size, segment = next(segments)
+                    message = packSegment(first + nextIndex, segment, self.check())
+                    self.socket.sendto(message, self.server)
+                    sent = time.perf_counter_ns() / 1000.0
+                    inFlight[first + nextIndex] = [message, sent, sent, size, 1]
+                    nextIndex += 1
+
+                # wait for an acknowledgment until the oldest segment in flight times out
+                timeout = self.timer.timeout() * 1E6
+                oldest = min(entry[2] for entry in inFlight.values())
+                remaining = oldest + timeout - time.perf_counter_ns() / 1000.0
+                self.socket.settimeout(max(remaining / 1E6, 0.001))
+
+                try:
+                    rec, addr = self.socket.recvfrom(self.RECEIVE_BUFFER)
+                except socket.timeout:
+                    self.timer.expire()
+                    # send again only the segments that timed out
+                    now = time.perf_counter_ns() / 1000.0
+                    for entry in inFlight.values():
+                        if now - entry[2] >= timeout:
+                            self.timer.retransmit(entry[4])
+                            self.socket.sendto(entry[0], self.server)
+                            entry[2] = now
+                            entry[4] += 1
+                    continue
+
+                now = time.perf_counter_ns() / 1000.0
+
+                if addr != self.server:
+                    continue
+                # the server refused the file, like when its data did not match its crc32
+                assert rec[:3] != b'400', f'Server refused file: {rec[3:]}'
+                # ignore all messages that are not segment acknowledgments from the server
+                if rec[:3] not in (b'100', b'101'):
+                    continue
+                try:
+                    sequence = int(rec[3:].decode('utf-8'))
+                except ValueError:
+                    continue
+
+                # already acknowledged, or a segment of an earlier file
+                entry = inFlight.get(sequence)
+                if entry is None:
+                    continue
+
+                if rec[:3] == b'101':
+                    # the segment was damaged on the way. only this segment is sent again, the timer keeps running
+                    self.timer.retransmit(entry[4])
+                    self.socket.sendto(entry[0], self.server)
+                    entry[2] = now
+                    entry[4] += 1
+                    continue
+
+                _, sent, _, size, attempts = inFlight.pop(sequence)
+                done += 1
+                end = now
+                if attempts == 1:
+                    self.timer.sample((now - sent) / 1E6)
+                onAcknowledged(sequence - first, done, getBitrate(size, now - sent))
+        finally:
+            self.socket.settimeout(None)
+
+        return start, end
 
     def sendMessage(self, message, isString=True, waitSuccess=False):
         """
@@ -325,33 +854,96 @@ class UdpFTPConnection(Connection):
             tocSend = time.perf_counter_ns()/1000.0
             tocAll = tocSend
             if waitSuccess:
-                # wait message from client
-
-                try:
-                    self.socket.settimeout(5)
-                    rec, addr = self.socket.recvfrom(1024)
-                    tocAll = time.perf_counter_ns() / 1000.0
-                    self.socket.settimeout(1000)
-                    # ignore all messages if not from client
-                    while addr != self.server:
-                        rec, addr = self.socket.recvfrom(1024)
-                        tocAll = time.perf_counter_ns() / 1000.0
-
-                    # verify acknowledgment message
-                    if rec and rec[:3] == b'100':
-                        return ticSend, tocSend,tocAll, tocSend-ticSend, tocAll-ticSend
-                    else:
-                        ticSend, tocSend, tocAll,_, _ = self.sendMessage(data, isString=False, waitSuccess=True)
-                except Exception:
-                    ticSend, tocSend, tocAll, _, _ = self.sendMessage(data, isString=False, waitSuccess=True)
-
-
+                tocAll = self.waitAcknowledgment(data, ticSend)
 
             return ticSend, tocSend,tocAll, tocSend-ticSend, tocAll-ticSend
 
-    def listen(self):
+    def waitAcknowledgment(self, data, sent):
+        """
+        Waits for the server to acknowledge a message and sends it again every time the timer expires.
+        :param data: byteArray - the message sent
+        :param sent: float - time of the first send in microseconds
+        :returns float - time of the acknowledgment in microseconds
+        :raises RetransmitLimitError - when the server does not answer
+        """
+        attempts = 1
+        deadline = time.perf_counter() + self.timer.timeout()
+        try:
+            while True:
+                self.socket.settimeout(max(deadline - time.perf_counter(), 0.001))
+                try:
+                    rec, addr = self.socket.recvfrom(self.RECEIVE_BUFFER)
+                except socket.timeout:
+                    self.timer.expire()
+                    self.timer.retransmit(attempts)
+                    self.socket.sendto(data, self.server)
+                    attempts += 1
+                    deadline = time.perf_counter() + self.timer.timeout()
+                    continue
+
+                # ignore all messages if not an acknowledgment from server. late acknowledgments of segments carry
+                # their sequence number
+                if addr == self.server and rec[:3] == b'100' and not rec[3:4].isdigit():
+                    received = time.perf_counter_ns() / 1000.0
+                    if attempts == 1:
+                        self.timer.sample((received - sent) / 1E6)
+                    return received
+        finally:
+            self.socket.settimeout(None)
+
+    def request(self, message, bufferSize=None, expected=None, isString=True):
+        """
+        Sends a request and waits for its reply. The request is sent again every time the timer expires.
+        :param message: str - the request
+        :param bufferSize: int - optional - bytes asked from recvfrom, for replies bigger than a segment
+        :param expected: byteArray - optional - opcode of the reply. other messages are skipped. replies other than
+        the opcode of the request and 400 are skipped if not given
+        :param isString: bool - optional - False if the request is a byteArray
+        :returns (byteArray, byteArray, float) - opcode, args and time of arrival of the reply
+        :raises RetransmitLimitError - when the server does not answer
+        """
+        opcode = (message.encode('utf-8') if isString else message)[:3]
+        attempts = 1
+        sent = time.perf_counter()
+        self.sendMessage(message, isString)
+        try:
+            while True:
+                self.socket.settimeout(self.timer.timeout())
+                try:
+                    reply = self.listen(bufferSize)
+                except socket.timeout:
+                    # request or reply lost
+                    self.timer.expire()
+                    self.timer.retransmit(attempts)
+                    self.sendMessage(message, isString)
+                    attempts += 1
+                    continue
+
+                if expected and reply[0] != expected:
+                    continue
+                # late replies to an earlier request that was sent again, when the server was slow to answer it
+                if not expected and reply[0] not in (opcode, b'400'):
+                    continue
+                if attempts == 1:
+                    self.timer.sample(time.perf_counter() - sent)
+                return reply
+        finally:
+            self.socket.settimeout(None)
+
+    def listen(self, bufferSize=None):
+        """
+        :param bufferSize: int - optional - bytes asked from recvfrom, for replies bigger than a segment
+        """
+        bufferSize = bufferSize or self.RECEIVE_BUFFER
+
+        data, addr = self.socket.recvfrom(bufferSize)
 
-        data, addr = self.socket.recvfrom(1024)
+        # late retransmissions of a finished download lost their acknowledgment. acknowledge them again and skip them.
+        # late acknowledgments of messages that were sent again and late requests for damaged segments are skipped too
+        while addr == self.server and (data[:3] == b'212' and self.fileToReceive is None or data[:3] in (b'100', b'101')):
+            if data[:3] == b'212':
+                self.sendMessage(b'100' + data[3:data.find(self.SEPERATOR)], isString=False)
+            data, addr = self.socket.recvfrom(bufferSize)
 
         timestamp = time.perf_counter_ns()/1000.0
         assert addr == self.server, "Received message not from server"
@@ -363,18 +955,172 @@ class UdpFTPConnection(Connection):
         Closes Connection and socket connection.
         '''
 
-        print(f'[{self.name}]: Closing Connection')
+        self.log.info('Closing Connection')
         self.sendMessage('600 close')
 
 
     def type():
         return 1  # type 1 for UDP
 
+    def codecs(self):
+        """
+        :returns list - codecs granted by the server, by preference
+        """
+        return list(filter(None, self.options.get('compress', '').split(',')))
+
+    def check(self):
+        """
+        :returns str - integrity check granted by the server. '' if none
+        """
+        return self.options.get('check', '')
+
+    def formatChecksum(self, directory, fileName, fileType, offset=0):
+        """
+        :returns str - the crc32 field of the 211 request of a file. empty without the 'check' option, as the sequence
+        number of the first segment follows it
+        """
+        return f'\x1c{getChecksum(fileName, fileType, directory, offset):08x}' if self.check() else '\x1c'
+
+    def verifyFile(self):
+        """
+        Checks the data of the file in transit against the crc32 sent by the server. A corrupted download is dropped.
+        """
+        fileToReceive = self.fileToReceive
+        intact = fileToReceive['file'].verify(fileToReceive['crc'])
+        if not intact:
+            self.fileToReceive = None
+        assert intact, f'File [{fileToReceive["name"]}.{fileToReceive["type"]}] was corrupted in transit'
+
+    @staticmethod
+    def defaultOptions():
+        options = {'segment': SEGMENT_SIZE}
+        if COMPRESSION:
+            options['compress'] = COMPRESSION
+        if CHECK:
+            options['check'] = CHECK
+        return options
+
+def linkFile(connection, directory, fileName, fileType):
+    """
+    Asks the server to add a file from the content of a file it has already, without sending its data.
+
+    :param connection: TcpFTPConnection or UdpFTPConnection
+    :param directory: str - path of the file
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :returns bool - False if the server has no file with this content. the file is uploaded then
+    """
+    size = getFileSize(fileName, fileType, directory)
+    digest = getFileHash(fileName, fileType, directory)
+
+    opcode, args, _ = connection.request(f'217{fileName}\x1c{fileType}\x1c{size}\x1c{digest}')
+    if opcode == b'400':
+        # servers without the opcode
+        return False
+    assert opcode == b'217', f'Incorrect response {opcode}'
+
+    if args != b'1':
+        return False
+    connection.log.info(f'Server has the content of [{fileName}.{fileType}] already. Nothing sent')
+    return True
+
+
+def sendDelta(connection, directory, fileName, fileType, maxRequest, log=lambda a, b, c: None):
+    """
+    Uploads a new version of a file the server has as the changes to the copy of the server (see delta.py).
+    The signature of the copy is asked for in pages and the delta is sent in pieces, each with one request and reply.
+
+    :param connection: TcpFTPConnection or UdpFTPConnection
+    :param directory: str - path of the file
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param maxRequest: int - largest request in bytes
+    :param log: function(done, total, bitrate) - optional - progress of the delta, in bytes
+    :returns bool - False if the server has no copy of the file or the delta is not worth sending. the file is sent
+    whole then
+    """
+    location = directory + "\\" + fileName + "." + fileType
+    size = getFileSize(fileName, fileType, directory)
+
+    signature = bytearray()
+    numBlocks = None
+    while numBlocks is None or len(signature) < numBlocks * SIGNATURE.size:
+        first = len(signature) // SIGNATURE.size
+        opcode, args, _ = connection.request(f'215{fileName}\x1c{fileType}\x1c{first}')
+        if opcode == b'400':
+            # the server has no copy of the file
+            return False
+        assert opcode == b'215', f'Incorrect response {opcode}'
+
+        fields = args.split(b'\x1c', 5)
+        if int(fields[4]) != first:
+            # reply to a request that was sent again
+            continue
+        blockSize, baseSize, numBlocks, maxDelta = [int(field) for field in fields[:4]]
+        assert fields[5] or first == numBlocks, "Empty page of signatures"
+        signature += fields[5]
+
+    # a delta bigger than half the file is not worth it
+    delta, digest = makeDelta(location, blockSize, bytes(signature), baseSize, min(maxDelta, size // 2))
+    if delta is None:
+        return False
+
+    connection.log.info(f'Sending file [{fileName}.{fileType}] as a delta of {len(delta)} bytes')
+
+    offset = 0
+    start = time.perf_counter_ns() / 1000.0
+    while True:
+        header = bytes(f'216{fileName}\x1c{fileType}\x1c{blockSize}\x1c{digest}\x1c{len(delta)}\x1c{offset}\x1c',
+                       'utf-8')
+        piece = delta[offset:offset + max(1, maxRequest - len(header))]
+        opcode, args, _ = connection.request(header + piece, isString=False)
+        if opcode == b'400':
+            # the copy of the server changed since its signature was sent
+            connection.log.warning(f'Server refused delta: {args}')
+            return False
+        assert opcode == b'216', f'Incorrect response {opcode}'
+
+        if int(args) != offset + len(piece):
+            # reply to a piece that was sent again
+            continue
+        offset += len(piece)
+        log(offset, len(delta), getBitrate(offset, max(time.perf_counter_ns() / 1000.0 - start, 1)))
+        if offset == len(delta):
+            break
+
+    throughput = getBitrate(size, max(time.perf_counter_ns() / 1000.0 - start, 1))
+    connection.log.info(f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
+    return True
+
+
+def formatDownload(fileID, offset=0, length=None):
+    """
+    :returns str - the 241 request of a file, of the part of the file after offset, or of a range of the file
+    """
+    if length is not None:
+        return f'241{fileID}\x1c{offset}\x1c{length}'
+    return f'241{fileID}\x1c{offset}' if offset else f'241{fileID}'
+
+
 def getBitrate(dataSize, duration):
     bits = dataSize * 8
     return bits / duration * 1E6
 
-def getAverageRate(sampleNumber, oldAverage, newSampleSize, duration):
-        newRate = getBitrate(newSampleSize, duration )
-        #return (sampleNumber - 1) * 1.0 / sampleNumber * oldAverage + newRate / sampleNumber
+def getAverageRate(sampleNumber, oldAverage, newSampleSize, duration, alpha=0.125):
+    """
+    Moving average of the bitrate, weighted towards the newest samples.
+
+    :param sampleNumber: int - number of samples including the new one
+    :param oldAverage: float - average of the previous samples
+    :param newSampleSize: int - bytes of the new sample
+    :param duration: float - µs taken by the new sample
+    :param alpha: float - weight of the new sample
+    :returns float - the new average in bits/s
+    """
+    if duration <= 0:
+        return oldAverage
+
+    newRate = getBitrate(newSampleSize, duration)
+    if sampleNumber <= 1:
         return newRate
+    return oldAverage + alpha * (newRate - oldAverage)
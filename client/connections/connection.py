@@ -3,6 +3,32 @@
 import socket
 from sockets import openSocket
 from config import SERVER_IP
+from log import getLogger
+
+
+def parseOptions(args):
+    '''
+    Parses the options granted for a connection.
+    :param args: byteArray - key=value fields separated by \x1c
+    :returns dict - option name to value
+    '''
+    options = {}
+    for field in args.strip().split(b'\x1c'):
+        if b'=' in field:
+            key, value = field.split(b'=', 1)
+            options[key.decode('utf-8')] = value.decode('utf-8')
+    return options
+
+
+def formatOptions(options):
+    '''
+    Formats the options requested for a connection as \x1c separated key=value fields.
+    :param options: dict - option name to value
+    :returns str - the fields, each preceded by a separator
+    '''
+    return ''.join(f'\x1c{key}={value}' for key, value in options.items())
+
+
 class Connection:
     '''
     Connection is a base class for the possible socket connections to the server.
@@ -22,6 +48,7 @@ class Connection:
         '''
         # definitions
         self.name = name
+        self.log = getLogger(name)
         if server_ip:
             self.server = (server_ip, port)
         else:
@@ -46,7 +73,7 @@ class Connection:
         Closes session and socket connection.
         '''
 
-        print(f'[{self.name}]: Closing Connection')
+        self.log.info('Closing Connection')
         self.socket.shutdown(socket.SHUT_RDWR)
         self.socket.close()
 
@@ -62,14 +89,14 @@ class Connection:
         # decode received message into string
         text = payload.decode('utf-8')
 
-        print("[" + self.name + "]: Received:", text)
+        self.log.debug(f'Received: {text}')
 
         # send optional acknowledgment
         self.sendMessage('100 Received')
 
     def onConnection(self):
         # for the base class we just want to run on connection
-        print(f'[{self.name}]: Connected')
+        self.log.info('Connected')
 
 
     def sendMessage(self, message):
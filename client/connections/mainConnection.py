@@ -1,8 +1,9 @@
 # Code for main connection by Saiid El Hajj Chehade
 
-from .connection import Connection
+from .connection import Connection, parseOptions, formatOptions
 from .FTP import TcpFTPConnection, UdpFTPConnection
 import time
+from framing import FrameReader, packFrame
 class MainConnection(Connection):
     """
     ClientConnection is the connection that handles user entry and main operations.
@@ -19,6 +20,7 @@ class MainConnection(Connection):
         #     b'222': self.keepAlive
         # }
         Connection.__init__(self, 'Client Connection', 5000, 'TCP', server_ip=server_ip)
+        self.reader = FrameReader(self.socket)
 
     def sendMessage(self, message, waitSuccess=False):
         """
@@ -27,15 +29,13 @@ class MainConnection(Connection):
         :param message: str - the payload of the message to be sent
         """
         if self.socket is not None:
-            raw = bytes(message + "\n\r", 'utf-8')
+            raw = packFrame(bytes(message, 'utf-8'))
             self.socket.sendall(raw)
 
             if waitSuccess:
-                data = self.socket.recv(1024)
-                if data and data[:3] == b'100':
-                    return
-                else:
-                    self.sendMessage(message, waitSuccess = True)
+                data = self.reader.readFrame()
+                assert data is not None, "Server ended connection"
+                assert data[:3] == b'100', 'Wrong response'
 
     # def run(self):
     #
@@ -65,7 +65,8 @@ class MainConnection(Connection):
 
     def listen(self):
 
-        data = self.socket.recv(1024)
+        data = self.reader.readFrame()
+        assert data is not None, "Server ended connection"
         return self.onReceived(data)
 
     def onReceived(self, payload):
@@ -83,7 +84,14 @@ class MainConnection(Connection):
         return opcode, args
 
     # OPCODE 210
-    def connectFTP(self, typeCode):
+    def connectFTP(self, typeCode, options=None, route=None):
+        """
+        Asks the server for an FTP session and connects to it.
+        :param typeCode: str - 'TCP' or 'UDP'
+        :param options: dict - optional - requested session options. defaults to the options of the connection type
+        :param route: function(ip, port) - optional - gives the address the session is reached at, e.g. a local relay
+        :returns the FTP connection, set up with the options granted by the server
+        """
 
         # definitions
         FTPConnection = {
@@ -95,13 +103,25 @@ class MainConnection(Connection):
             self.sendMessage(f'400 Connection Type invalid. possible values  TCP, UDP.')
             return
 
+        if options is None:
+            options = FTPConnection[typeCode].defaultOptions()
+
         # send a message about the port of FTP Server
-        self.sendMessage(f'210{FTPConnection[typeCode].type()}')
+        self.sendMessage(f'210{FTPConnection[typeCode].type()}' + formatOptions(options))
 
         opcode, args = self.listen()
 
         assert opcode == b'210', 'No Confirmation from server'
 
+        # the port is followed by the options granted by the server
+        port, *granted = args.strip().split(b'\x1c', 1)
+        granted = parseOptions(granted[0]) if granted else {}
+        # the transfers fall back to the defaults of the protocol for the options the server did not grant
+        refused = {key: value for key, value in options.items() if granted.get(key) != str(value)}
+        if refused:
+            self.log.warning('Options not granted by the server: ' +
+                             ', '.join(f'{key}={value}' for key, value in refused.items()))
+
         self.sendMessage(f'100')
 
         start = time.perf_counter_ns()/1000.0
@@ -109,10 +129,14 @@ class MainConnection(Connection):
         while time.perf_counter_ns()/1000.0-start < 1000:
             pass
 
-        print(f'[{self.name}]: Starting FTP Connection')
+        self.log.info('Starting FTP Connection')
         self.close()
 
-        return FTPConnection[typeCode](int(args.decode('utf-8')), server_ip = self.server[0])
+        ip, port = self.server[0], int(port.decode('utf-8'))
+        if route:
+            ip, port = route(ip, port)
+
+        return FTPConnection[typeCode](port, server_ip = ip, options=granted)
 
     # OPCODE 222
     def keepAlive(self, args):
@@ -0,0 +1,103 @@
+# code for parallel downloads by Saiid El Hajj Chehade
+
+import os
+import threading
+import time
+from config import PARALLEL_STREAMS, PARALLEL_MIN_RANGE
+from log import getLogger
+
+logger = getLogger('Parallel Download')
+
+
+def splitRanges(size, streams, minimum=PARALLEL_MIN_RANGE):
+    """
+    Splits a file into ranges of about the same size.
+
+    :param size: int - size of the file in bytes
+    :param streams: int - maximum number of ranges
+    :param minimum: int - smallest range worth its own session
+    :returns list - (offset, length) of every range
+    """
+    streams = max(1, min(streams, size // max(minimum, 1)))
+    step = max(1, -(-size // streams))
+    return [(offset, min(step, size - offset)) for offset in range(0, size, step)] or [(0, 0)]
+
+
+def downloadParallel(connection, openConnection, fileID, directory, streams=PARALLEL_STREAMS,
+                     log=lambda a, b, c: None):
+    """
+    Downloads a file over several FTP sessions at once. Every session downloads its own byte range of the file into
+    a .ranges file preallocated next to the destination, so one file can use more than one flow of the link.
+    The range of the given connection is downloaded in the calling thread, the other ranges in background threads.
+    Files smaller than two ranges of PARALLEL_MIN_RANGE bytes are downloaded over the given connection only.
+
+    :param connection: TcpFTPConnection or UdpFTPConnection - downloads the first range
+    :param openConnection: function() - opens another FTP session with the same server
+    :param fileID: int - id of the file in the file list
+    :param directory: str - path to save in
+    :param streams: int - optional - maximum number of sessions
+    :param log: function(done, total, bitrate) - optional - progress of the whole file, in segments
+    :returns int - number of sessions used
+    """
+    fileName, fileType, size = connection.getFileDetails(fileID)
+    ranges = splitRanges(size, streams)
+    if len(ranges) == 1:
+        connection.downloadFile(fileID, directory, log)
+        return 1
+
+    location = directory + "\\" + fileName + "." + fileType
+    with open(location + ".ranges", 'wb') as f:
+        f.truncate(size)
+
+    # received segments, number of segments and bitrate of every range
+    progress = [(0, 0, 0)] * len(ranges)
+    errors = []
+
+    def track(index, done, total, bitrate):
+        progress[index] = (done, total, bitrate)
+
+    def download(index, offset, length):
+        try:
+            other = openConnection()
+            try:
+                other.downloadFile(fileID, directory, lambda a, b, c: track(index, a, b, c), offset=offset,
+                                   length=length)
+            finally:
+                other.close()
+        except Exception as e:
+            errors.append(e)
+
+    def report(done, total, bitrate):
+        track(0, done, total, bitrate)
+
+        # ranges that did not start yet count as many segments as the first one
+        done = sum(p[0] for p in progress)
+        total = sum(p[1] or progress[0][1] for p in progress)
+        # the end of the file is only reported once all the ranges are written
+        log(min(done, total - 1), total, sum(p[2] for p in progress))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=download, args=(i, offset, length), daemon=True)
+               for i, (offset, length) in enumerate(ranges) if i > 0]
+    for thread in threads:
+        thread.start()
+
+    try:
+        connection.downloadFile(fileID, directory, report, offset=ranges[0][0], length=ranges[0][1])
+    except Exception as e:
+        errors.append(e)
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        # the ranges that were written cannot be continued. the file starts over next time
+        os.remove(location + ".ranges")
+        raise errors[0]
+
+    os.replace(location + ".ranges", location)
+
+    bitrate = size * 8 / (time.perf_counter() - start)
+    total = sum(p[1] for p in progress)
+    log(total, total, bitrate)
+    logger.info(f'file [{fileName}.{fileType}] Received successfully over {len(ranges)} sessions - {round(bitrate)} bps')
+    return len(ranges)
@@ -1,4 +1,7 @@
+import hashlib
 import json
+import os
+import zlib
 from config import LIST_PATH, FILE_PATH
 # Saiid El Hajj Chehade
 
@@ -60,6 +63,209 @@ def segmentData(maxSize, data):
     return iter(segments), len(segments)
 
 
-def compileData(dataSegments):
-    return b''.join(dataSegments)
+def streamFile(maxSize, fileName, fileType, directory, offset=0):
+    """
+    Opens a file as a lazy segment iterator. Segments are read from disk only when they are asked for,
+    so memory use does not grow with the size of the file.
+
+    :param maxSize: int - maximum number of bytes per segment
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :param offset: int - optional - bytes at the start of the file to skip, to continue an interrupted upload
+
+    :returns (iterator, int, int) - segment iterator, number of segments, size of the file in bytes
+
+    """
+
+    # get the full path to destination
+    location = directory + "\\" + fileName + "." + fileType
+
+    size = os.path.getsize(location)
+
+    # same segmentation as segmentData: an empty file is one empty segment
+    numSegments = max(1, -(-(size - offset) // maxSize))
+
+    def segments():
+        with open(location, 'rb') as f:
+            f.seek(offset)
+            for _ in range(numSegments):
+                yield f.read(maxSize)
+
+    return segments(), numSegments, size
+
+
+def getFileSize(fileName, fileType, directory):
+    """
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :returns int - size of the file in bytes
+    """
+    return os.path.getsize(directory + "\\" + fileName + "." + fileType)
+
+
+def getFileHash(fileName, fileType, directory):
+    """
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :returns str - sha256 of the file as hex
+    """
+    digest = hashlib.sha256()
+    with open(directory + "\\" + fileName + "." + fileType, 'rb') as f:
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def getChecksum(fileName, fileType, directory, offset=0):
+    """
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :param offset: int - optional - bytes at the start of the file left out
+    :returns int - crc32 of the file data from the offset
+    """
+    crc = 0
+    with open(directory + "\\" + fileName + "." + fileType, 'rb') as f:
+        f.seek(offset)
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            crc = zlib.crc32(data, crc)
+    return crc
+
+
+class PartialFile:
+    """
+    A file being downloaded. Data is written in order to a .part file next to the destination, and the .part file is
+    renamed to the destination once the file is complete. A download that stops keeps the .part file, so a later
+    download of the same file can continue from its size (see getPartialSize).
+    The crc32 of the data of this download is computed as it is written, to check it once it is complete.
+    """
+
+    def __init__(self, fileName, fileType, directory, offset=0):
+        """
+        :param fileName: str - name of file
+        :param fileType: str - type of file
+        :param directory: str - path to save in
+        :param offset: int - optional - bytes of the .part file to continue from
+        """
+        # get the full path to destination
+        self.location = directory + "\\" + fileName + "." + fileType
+        self.tempLocation = self.location + ".part"
+
+        if offset:
+            self.file = open(self.tempLocation, 'r+b')
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        else:
+            self.file = open(self.tempLocation, 'wb')
+
+        # segments that arrived before the segments in front of them
+        self.pending = {}
+        self.nextSegment = 0
+        # crc32 of the data written
+        self.crc = 0
+
+    def append(self, data):
+        """
+        Writes data after the data written so far.
+        """
+        self.file.write(data)
+        self.crc = zlib.crc32(data, self.crc)
+
+    def writeSegment(self, seqNum, data):
+        """
+        Writes a segment once all the segments in front of it are written. Segments may arrive in any order.
+
+        :param seqNum: int - index of the segment in the data of this download
+        :param data: bytes - segment data
+        """
+        self.pending[seqNum] = data
+        while self.nextSegment in self.pending:
+            self.append(self.pending.pop(self.nextSegment))
+            self.nextSegment += 1
+
+    def verify(self, crc):
+        """
+        Checks the data of this download against the crc32 sent by the server. Corrupted data is dropped.
+
+        :param crc: int - crc32 of the data of this download. nothing is checked if None
+        :returns bool - False if the data did not match and was dropped
+        """
+        if crc is None or crc == self.crc:
+            return True
+
+        self.discard()
+        return False
+
+    def commit(self):
+        """
+        Moves the complete file to its destination.
+        """
+        self.file.close()
+        os.replace(self.tempLocation, self.location)
+
+    def close(self):
+        """
+        Stops an incomplete download. The data written in order stays in the .part file.
+        """
+        self.file.close()
+
+    def discard(self):
+        """
+        Drops a corrupted download with its .part file, so the next download of the file starts over.
+        """
+        self.file.close()
+        os.remove(self.tempLocation)
+
+
+class FileRange(PartialFile):
+    """
+    A byte range of a file downloaded in parallel. Every range writes to its place in one .ranges file next to the
+    destination, preallocated by the caller, which renames it once all the ranges are complete.
+    """
+
+    def __init__(self, fileName, fileType, directory, offset):
+        """
+        :param fileName: str - name of file
+        :param fileType: str - type of file
+        :param directory: str - path to save in
+        :param offset: int - position of the range in the file
+        """
+        self.location = directory + "\\" + fileName + "." + fileType
+        self.tempLocation = self.location + ".ranges"
+
+        self.file = open(self.tempLocation, 'r+b')
+        self.file.seek(offset)
+
+        # segments that arrived before the segments in front of them
+        self.pending = {}
+        self.nextSegment = 0
+        # crc32 of the data of the range written
+        self.crc = 0
+
+    def commit(self):
+        """
+        Finishes the range. The file is moved to its destination by the caller.
+        """
+        self.file.close()
+
+    def discard(self):
+        """
+        Drops a corrupted range. The .ranges file is deleted by the caller.
+        """
+        self.file.close()
+
+
+def getPartialSize(fileName, fileType, directory):
+    """
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path to save in
+    :returns int - bytes kept from an interrupted download of the file. 0 if there is none
+    """
+    location = directory + "\\" + fileName + "." + fileType + ".part"
+
+    return os.path.getsize(location) if os.path.exists(location) else 0
 
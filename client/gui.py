@@ -10,8 +10,10 @@ from tkinter import HORIZONTAL
 from tkinter import filedialog as fd
 from tkinter.ttk import Progressbar
 from connections.mainConnection import MainConnection
+from connections.parallel import downloadParallel
 import os
 from config import SERVER_IP
+from file import getPartialSize
 
 connection = None
 
@@ -49,7 +51,8 @@ def connectionPrompt():
             conn = connect()
             conn = conn.connectFTP('UDP')
             mainWindow.destroy()
-            fileWindow(conn)
+            # more sessions are opened to download files in parallel
+            fileWindow(conn, lambda: connect().connectFTP('UDP'))
         else:
             showError("Empty IP")
 
@@ -59,7 +62,7 @@ def connectionPrompt():
             conn = connect()
             conn = conn.connectFTP('TCP')
             mainWindow.destroy()
-            fileWindow(conn)
+            fileWindow(conn, lambda: connect().connectFTP('TCP'))
         else:
             showError("Empty IP")
 
@@ -92,7 +95,7 @@ from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg,
 
 
 # the file window that deals with the file list, downloading and uploading files
-def fileWindow(connection):
+def fileWindow(connection, openConnection):
     # get the file list from the server
     fileList = connection.getFiles()
 
@@ -209,7 +212,14 @@ def fileWindow(connection):
                 path = fd.askdirectory()
                 if len(path) < 2: return
 
-                connection.downloadFile(fileList[i]['id'], path, log=progress)
+                # continue an interrupted download of the file
+                *filename, filetype = fileList[i]['file'].split('.')
+                offset = getPartialSize('.'.join(filename), filetype, path)
+
+                if offset:
+                    connection.downloadFile(fileList[i]['id'], path, log=progress, offset=offset)
+                else:
+                    downloadParallel(connection, openConnection, fileList[i]['id'], path, log=progress)
 
             btn = tk.Button(
                 master=frame,
@@ -246,7 +256,8 @@ def fileWindow(connection):
 
         window.update_idletasks()
 
-        connection.sendFile(directory, filename, filetype, log=progress)
+        # the server keeps the data of interrupted uploads to continue them
+        connection.sendFile(directory, filename, filetype, log=progress, resume=True, delta=True, dedup=True)
 
     btn = tk.Button(
         text='Upload',
@@ -0,0 +1,72 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from config import LOG_LEVEL, PROGRESS_INTERVAL
+
+# code for logging by Saiid El Hajj Chehade
+# server/ and client/ have identical copies of this module. change both (see tests/test_shared.py)
+
+# records are queued by the sessions and written to stdout by a background thread,
+# so sending or receiving data never waits for the console
+logQueue = queue.SimpleQueue()
+logHandler = logging.StreamHandler(sys.stdout)
+logHandler.setFormatter(logging.Formatter('[%(name)s]: %(message)s'))
+
+logListener = logging.handlers.QueueListener(logQueue, logHandler)
+logListener.start()
+# write the records still queued when the program ends
+atexit.register(logListener.stop)
+
+
+def getLogger(name):
+    """
+    Gets the logger of a session. Messages are printed as [name]: message.
+
+    :param name: str - name of the session
+    :returns logging.Logger - the logger
+    """
+    logger = logging.getLogger(name)
+
+    if not logger.handlers:
+        logger.setLevel(LOG_LEVEL)
+        logger.addHandler(logging.handlers.QueueHandler(logQueue))
+        logger.propagate = False
+
+    return logger
+
+
+class Progress:
+    """
+    Samples the progress of a transfer. The first and last steps are reported and the steps between them at most
+    once every PROGRESS_INTERVAL seconds, so a large file does not log every one of its segments.
+    """
+
+    def __init__(self, logger, interval=PROGRESS_INTERVAL):
+        """
+        :param logger: logging.Logger - logger the progress is reported to
+        :param interval: float - minimum seconds between two reports
+        """
+        self.enabled = logger.isEnabledFor(logging.INFO)
+        self.interval = interval
+        self.nextReport = 0
+
+    def due(self, done, total):
+        """
+        Tells if a step should be reported.
+
+        :param done: int - completed steps
+        :param total: int - number of steps
+        :returns bool - True if the step is reported
+        """
+        if not self.enabled:
+            return False
+
+        now = time.monotonic()
+        if done < total and now < self.nextReport:
+            return False
+
+        self.nextReport = now + self.interval
+        return True
@@ -0,0 +1,96 @@
+from config import UDP_INITIAL_RTO, UDP_MIN_RTO, UDP_MAX_RTO, UDP_MAX_RETRIES
+
+# code for the UDP retransmission timer by Saiid El Hajj Chehade
+# server/ and client/ have identical copies of this module. change both (see tests/test_shared.py)
+
+
+class RetransmitLimitError(TimeoutError):
+    """
+    Raised when a message is still not acknowledged after UDP_MAX_RETRIES retransmissions.
+    """
+    pass
+
+
+class RetransmitTimer:
+    """
+    Retransmission timeout of a UDP peer, estimated from round trip samples the way TCP does (RFC 6298).
+    srtt and rttvar are moving averages of the round trip time and of its variation, and the timeout is
+    srtt + 4 * rttvar. Every expiry doubles the timeout until the next sample.
+    Only messages sent once give samples: the acknowledgment of a retransmitted message can answer any copy (Karn).
+    Times are in seconds.
+    """
+
+    ALPHA = 0.125  # weight of the newest sample in srtt
+    BETA = 0.25  # weight of the newest sample in rttvar
+    K = 4  # deviations added to srtt
+    MAX_RETRIES = UDP_MAX_RETRIES
+
+    def __init__(self, initial=UDP_INITIAL_RTO, minimum=UDP_MIN_RTO, maximum=UDP_MAX_RTO):
+        """
+        :param initial: float - timeout before the first sample
+        :param minimum: float - lowest timeout
+        :param maximum: float - highest timeout, backoff included
+        """
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = 1
+
+        self.samples = 0
+        self.timeouts = 0  # expiries of the timer
+        self.retransmits = 0  # messages sent again
+
+    def sample(self, rtt):
+        """
+        Updates the estimate with the round trip time of a message sent once.
+        :param rtt: float - seconds from sending the message to its acknowledgment
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+
+        self.rto = self.srtt + self.K * self.rttvar
+        self.backoff = 1
+        self.samples += 1
+
+    def timeout(self):
+        """
+        :returns float - seconds to wait for an acknowledgment
+        """
+        return min(max(self.rto, self.minimum) * self.backoff, self.maximum)
+
+    def expire(self):
+        """
+        Records an expiry of the timer and backs off.
+        """
+        self.timeouts += 1
+        if self.timeout() < self.maximum:
+            self.backoff *= 2
+
+    def retransmit(self, attempts):
+        """
+        Records a message sent again.
+        :param attempts: int - times the message was sent before
+        :raises RetransmitLimitError - when the message was already sent MAX_RETRIES times again
+        """
+        if attempts > self.MAX_RETRIES:
+            raise RetransmitLimitError(f'No acknowledgment after {attempts} attempts')
+        self.retransmits += 1
+
+    def summary(self):
+        """
+        :returns dict - the estimate in µs and the counters
+        """
+        return {
+            'srtt': self.srtt * 1E6 if self.srtt is not None else None,
+            'rttvar': self.rttvar * 1E6 if self.rttvar is not None else None,
+            'rto': self.timeout() * 1E6,
+            'samples': self.samples,
+            'timeouts': self.timeouts,
+            'retransmits': self.retransmits
+        }
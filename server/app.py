@@ -1,4 +1,14 @@
-from sessions.client import ClientSession
+from config import SERVER_ENGINE
+from file import loadCatalog
+
+# read the file list once before serving clients
+loadCatalog()
 
 #initiate the server
-clientSession = ClientSession()
+if SERVER_ENGINE == 'asyncio':
+    import asyncio
+    from sessions.asyncSessions import serve
+    asyncio.run(serve())
+else:
+    from sessions.client import ClientSession
+    clientSession = ClientSession()
@@ -0,0 +1,208 @@
+import bisect
+import io
+import json
+import math
+import os
+import random
+import uuid
+from config import CHUNK_PATH, CHUNK_MIN_SIZE, CHUNK_AVERAGE_SIZE, CHUNK_MAX_SIZE
+
+# code for the chunk store by Saiid El Hajj Chehade
+
+# With the 'chunks' storage, files are split into chunks that are stored once under CHUNK_PATH, named by the sha256
+# of their data, however many files hold them. A file is kept as a manifest next to its location listing its chunks.
+# Chunks end where the content says so rather than at fixed offsets, so a file with data inserted or removed still
+# shares the chunks before and after the change: a gear hash of the last 64 bytes is rolled over the data and a chunk
+# ends where the top bits of the hash are all zero.
+MANIFEST = ".manifest"
+
+# random values of the gear hash, one per byte value. seeded so that chunks end at the same places on every run
+GEAR = [random.Random(6001 + b).getrandbits(64) for b in range(256)]
+MASK = (1 << 64) - 1
+# a chunk ends where these bits of the hash are zero, about CHUNK_AVERAGE_SIZE bytes after CHUNK_MIN_SIZE
+CUT_BITS = round(math.log2(CHUNK_AVERAGE_SIZE))
+CUT_MASK = ((1 << CUT_BITS) - 1) << (64 - CUT_BITS)
+# bytes of data held by the hash
+WINDOW = 64
+
+
+def findCut(data):
+    """
+    :param data: bytes - data from the start of a chunk. at least CHUNK_MAX_SIZE bytes unless it is the end of the file
+    :returns int - size of the chunk
+    """
+    end = min(len(data), CHUNK_MAX_SIZE)
+    if end <= CHUNK_MIN_SIZE:
+        return end
+
+    # the bytes before CHUNK_MIN_SIZE cannot end the chunk. only the last WINDOW of them are in the hash there
+    h = 0
+    for b in data[CHUNK_MIN_SIZE - WINDOW:CHUNK_MIN_SIZE]:
+        h = (h + h + GEAR[b]) & MASK
+
+    pos = CHUNK_MIN_SIZE
+    for b in data[CHUNK_MIN_SIZE:end]:
+        h = (h + h + GEAR[b]) & MASK
+        pos += 1
+        if not h & CUT_MASK:
+            return pos
+    return end
+
+
+def splitChunks(f):
+    """
+    Splits a file into content-defined chunks.
+
+    :param f: file - the file, opened for reading in binary
+    :returns iterator - data of every chunk, in order
+    """
+    buffer = b''
+    eof = False
+    while True:
+        while not eof and len(buffer) < CHUNK_MAX_SIZE:
+            data = f.read(4 * CHUNK_MAX_SIZE)
+            eof = not data
+            buffer += data
+        if not buffer:
+            return
+
+        cut = findCut(buffer)
+        yield buffer[:cut]
+        buffer = buffer[cut:]
+
+
+def getChunkLocation(key):
+    """
+    :param key: str - sha256 of the chunk data
+    :returns str - full path of the chunk
+    """
+    return CHUNK_PATH + "\\" + key
+
+
+def writeChunk(key, data):
+    """
+    Writes a chunk to the store unless it is there already. The chunk is written to a temporary file first, so a
+    chunk in the store is always complete.
+
+    :param key: str - sha256 of the chunk data
+    :param data: bytes - the chunk
+    :returns bool - whether the chunk was new
+    """
+    location = getChunkLocation(key)
+    if os.path.exists(location):
+        return False
+
+    tempLocation = location + "." + uuid.uuid4().hex + ".part"
+    with open(tempLocation, 'wb') as f:
+        f.write(data)
+    os.replace(tempLocation, location)
+    return True
+
+
+def readManifest(location, header=False):
+    """
+    Reads the manifest of a file. The first line holds the size and the sha256 of the file, every other line the key
+    and size of a chunk.
+
+    :param location: str - full path of the file
+    :param header: bool - optional - only read the size and the sha256
+    :returns dict - size, hash and chunks ([key, size] of every chunk) of the file. None if it has no manifest
+    """
+    try:
+        f = open(location + MANIFEST, 'r')
+    except FileNotFoundError:
+        return None
+
+    with f:
+        manifest = json.loads(f.readline())
+        if not header:
+            manifest['chunks'] = [[key, int(size)] for key, size in (line.split() for line in f)]
+    return manifest
+
+
+def writeManifest(location, manifest):
+    """
+    Writes the manifest of a file (see readManifest). It is written to a temporary file and renamed over the old one,
+    so the manifest of a file is always complete.
+
+    :param location: str - full path of the file
+    :param manifest: dict - size, hash and chunks of the file
+    """
+    tempLocation = location + MANIFEST + "." + uuid.uuid4().hex + ".part"
+    with open(tempLocation, 'w') as f:
+        f.write(json.dumps({'size': manifest['size'], 'hash': manifest['hash']}) + '\n')
+        f.writelines(f'{key} {size}\n' for key, size in manifest['chunks'])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tempLocation, location + MANIFEST)
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    Reads a file of the chunk store as one file. A chunk is opened when the reads reach it.
+    It has no file descriptor, so socket.sendfile falls back to reading it.
+    """
+
+    def __init__(self, manifest):
+        """
+        :param manifest: dict - manifest of the file (see readManifest)
+        """
+        super().__init__()
+        self.chunks = manifest['chunks']
+        self.size = manifest['size']
+
+        # offset of every chunk in the file
+        self.starts = []
+        start = 0
+        for _, size in self.chunks:
+            self.starts.append(start)
+            start += size
+        assert start == self.size, "Manifest does not add up to the size of the file"
+
+        self.pos = 0
+        self.index = None  # index of the open chunk
+        self.chunk = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, b):
+        if self.pos >= self.size:
+            return 0
+
+        index = bisect.bisect_right(self.starts, self.pos) - 1
+        if index != self.index:
+            if self.chunk:
+                self.chunk.close()
+            self.chunk = open(getChunkLocation(self.chunks[index][0]), 'rb')
+            self.index = index
+
+        inside = self.pos - self.starts[index]
+        self.chunk.seek(inside)
+        read = self.chunk.readinto(memoryview(b)[:self.chunks[index][1] - inside])
+        if not read:
+            raise OSError(f"Chunk {self.chunks[index][0]} is cut")
+        self.pos += read
+        return read
+
+    def close(self):
+        if self.chunk:
+            self.chunk.close()
+            self.chunk = None
+        super().close()
@@ -0,0 +1,124 @@
+import lzma
+import math
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from config import COMPRESSION_WORKERS
+
+# code for transfer compression by Saiid El Hajj Chehade
+# server/ and client/ have identical copies of this module. change both (see tests/test_shared.py)
+
+# Every segment of a compressed transfer is compressed on its own, so segments can still be sent again, written out of
+# order and continued from an offset. Its payload starts with a flag byte: RAW when the segment did not get smaller.
+RAW = b'\x00'
+COMPRESSED = b'\x01'
+
+# types that are compressed already. their segments would not get smaller
+COMPRESSED_TYPES = {'7z', 'apk', 'avi', 'bz2', 'docx', 'gif', 'gz', 'jar', 'jpeg', 'jpg', 'mkv', 'mov', 'mp3', 'mp4',
+                    'pdf', 'png', 'pptx', 'rar', 'tgz', 'webp', 'xlsx', 'xz', 'zip', 'zst'}
+# files whose first SAMPLE_SIZE bytes carry more than MAX_ENTROPY bits per byte are sent raw
+SAMPLE_SIZE = 65536
+MAX_ENTROPY = 7.5
+
+# segments are at most 64KB, so lzma does not need a bigger dictionary
+LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 6, 'dict_size': 1 << 16}]
+
+# codec name -> (compress, decompressor)
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 1), lambda: zlib.decompressobj()),
+    'lzma': (lambda data: lzma.compress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS),
+             lambda: lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=LZMA_FILTERS))
+}
+
+# zlib and lzma release the GIL, so segments are compressed in parallel with the sender
+executor = ThreadPoolExecutor(COMPRESSION_WORKERS, thread_name_prefix='compress')
+
+
+def getEntropy(data):
+    """
+    :param data: bytes - a sample of a file
+    :returns float - bits of information per byte, from 0 for a repeated byte to 8 for random data
+    """
+    if not data:
+        return 0.0
+    return -sum(count / len(data) * math.log2(count / len(data)) for count in Counter(data).values())
+
+
+def chooseCodec(codecs, fileName, fileType, directory, offset=0, openFile=None):
+    """
+    Chooses how a file is sent. Files that are compressed already are sent raw.
+
+    :param codecs: list - codecs granted to the session, in order of preference
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :param offset: int - optional - where the data sent starts
+    :param openFile: function - optional - opens the file for reading in binary from its full path. open() if not given
+    :returns str - codec of the transfer. '' to send it raw
+    """
+    if not codecs or fileType.lower() in COMPRESSED_TYPES:
+        return ''
+
+    location = directory + "\\" + fileName + "." + fileType
+    with openFile(location) if openFile else open(location, 'rb') as f:
+        f.seek(offset)
+        sample = f.read(SAMPLE_SIZE)
+
+    return '' if getEntropy(sample) > MAX_ENTROPY else codecs[0]
+
+
+def encodeSegment(codec, segment):
+    """
+    :param codec: str - codec of the transfer
+    :param segment: bytes - file data
+    :returns bytes - payload of the segment
+    """
+    compressed = CODECS[codec][0](segment)
+    if len(compressed) < len(segment):
+        return COMPRESSED + compressed
+    return RAW + segment
+
+
+def encodeSegments(segments, codec):
+    """
+    Encodes the segments of a transfer in the compression threads, a few segments ahead of the sender.
+
+    :param segments: iterator - segments of file data
+    :param codec: str - codec of the transfer. '' to send the segments as they are
+    :returns iterator - (file bytes, payload) of every segment
+    """
+    if not codec:
+        for segment in segments:
+            yield len(segment), segment
+        return
+
+    pending = deque()
+    for segment in segments:
+        pending.append((len(segment), executor.submit(encodeSegment, codec, segment)))
+        if len(pending) > COMPRESSION_WORKERS * 4:
+            size, future = pending.popleft()
+            yield size, future.result()
+
+    while pending:
+        size, future = pending.popleft()
+        yield size, future.result()
+
+
+def decodeSegment(codec, payload, maxSize):
+    """
+    :param codec: str - codec of the transfer. '' if it is sent raw
+    :param payload: bytes - payload of the segment
+    :param maxSize: int - most file bytes a segment holds
+    :returns bytes - file data
+    """
+    if not codec:
+        return payload
+
+    assert payload, "Expected the compression flag of the segment"
+    if payload[:1] == RAW:
+        return payload[1:]
+
+    decompressor = CODECS[codec][1]()
+    data = decompressor.decompress(payload[1:], maxSize)
+    assert decompressor.eof and len(data) <= maxSize, "Segment does not decompress to a segment"
+    return data
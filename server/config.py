@@ -4,3 +4,76 @@ ROOT_PATH = os.path.dirname(__file__)
 FILE_PATH = ROOT_PATH+"\\files"
 LIST_PATH = ROOT_PATH+"\\files.json"
 HOST_IP = '0.0.0.0'
+
+# files added since the last snapshot of LIST_PATH, one json entry per line.
+# the journal is merged into the snapshot once it holds CATALOG_COMPACT_EVERY entries
+JOURNAL_PATH = ROOT_PATH+"\\files.journal"
+CATALOG_COMPACT_EVERY = 1000
+# held by the server while it runs. only one server process may use the files and the catalog: the catalog is kept in
+# memory, so a second process would give out the same ids and interleave its entries in the journal
+LOCK_PATH = ROOT_PATH+"\\files.lock"
+
+# maximum number of control clients served at the same time
+MAX_SESSIONS = 16
+# seconds an FTP session waits for its client to connect to its data port (for UDP, to send its first message).
+# the session is closed after it, so a client that never comes does not keep a worker and a data port
+SESSION_ACCEPT_TIMEOUT = 30
+
+# server engine: 'thread' for the blocking sessions, 'asyncio' for the event loop sessions
+SERVER_ENGINE = 'thread'
+
+# ports of the FTP sessions. each blocking session gets its own port from DATA_PORT_RANGE = (first, last).
+# set DATA_PORT_RANGE to None to let the kernel choose the port.
+# the asyncio engine multiplexes all sessions on TCP_FTP_PORT and UDP_FTP_PORT.
+DATA_PORT_RANGE = (6002, 6202)
+TCP_FTP_PORT = 6001
+UDP_FTP_PORT = 6000
+
+# number of UDP segments sent before waiting for acknowledgments. 1 is stop-and-wait
+UDP_WINDOW_SIZE = 32
+
+# seconds a UDP message waits for its acknowledgment before it is sent again. the timeout follows the measured
+# round trip time between UDP_MIN_RTO and UDP_MAX_RTO, starting from UDP_INITIAL_RTO
+UDP_INITIAL_RTO = 0.5
+UDP_MIN_RTO = 0.01
+UDP_MAX_RTO = 5
+# retransmissions of a UDP message before the peer is given up
+UDP_MAX_RETRIES = 12
+
+# payload bytes per segment used when the client does not ask for a size, and the largest size granted
+SEGMENT_SIZE = 1012
+MAX_SEGMENT_SIZE = 65000
+
+# bytes of file data kept in memory for repeated downloads. files bigger than a quarter of it are not cached
+FILE_CACHE_SIZE = 64 * 1024 * 1024
+
+# uploads that stopped before the end are kept to be continued, up to MAX_PARTIAL_UPLOADS of them.
+# a UDP session gives up a file in transit after UDP_IDLE_TIMEOUT seconds without data from its client
+MAX_PARTIAL_UPLOADS = 16
+UDP_IDLE_TIMEOUT = 30
+# a UDP session is closed after UDP_SESSION_TIMEOUT seconds without any message from its client, in case its 600 was lost
+UDP_SESSION_TIMEOUT = 1800
+
+# codecs the server compresses transfers with when a client asks for them, and the threads compressing segments
+COMPRESSION_CODECS = ['zlib', 'lzma']
+COMPRESSION_WORKERS = 2
+
+# a new version of a file is accepted as a delta of at most MAX_DELTA_SIZE bytes. the block signatures of the last
+# DELTA_SIGNATURES files asked for are kept in memory until the files change
+MAX_DELTA_SIZE = 16 * 1024 * 1024
+DELTA_SIGNATURES = 8
+
+# how uploaded files are kept: 'files' keeps every file whole under FILE_PATH. 'chunks' splits files into chunks
+# stored once under CHUNK_PATH however many files hold them (see chunks.py). chunks are CHUNK_MIN_SIZE to
+# CHUNK_MAX_SIZE bytes and end on average CHUNK_AVERAGE_SIZE bytes past CHUNK_MIN_SIZE.
+# files kept before a change of STORAGE are still read
+STORAGE = 'files'
+CHUNK_PATH = ROOT_PATH+"\\chunks"
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_AVERAGE_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+
+# lowest level of the printed log messages: 'DEBUG', 'INFO', 'WARNING' or 'ERROR'
+LOG_LEVEL = 'INFO'
+# seconds between two progress messages of a transfer
+PROGRESS_INTERVAL = 0.5
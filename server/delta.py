@@ -0,0 +1,213 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import zlib
+
+# code for delta uploads by Saiid El Hajj Chehade
+# server/ and client/ have identical copies of this module. change both (see tests/test_shared.py)
+
+# A new version of a file the server has is sent as the changes to the copy of the server, like rsync does.
+# The server splits its copy into blocks and sends the signature of every block: a weak checksum that can be rolled
+# one byte at a time and a strong hash. The client looks for these blocks at every offset of its version and sends
+# a delta made of copies of blocks and literal data, from which the server builds the new version.
+
+# blocks are about the square root of the file size, between these bounds
+MIN_BLOCK_SIZE = 2048
+MAX_BLOCK_SIZE = 128 * 1024
+# signature of a block: adler32 and blake2b of its data
+SIGNATURE = struct.Struct('!I16s')
+# instructions of a delta
+COPY = b'C'  # followed by RUN: index of the first block and number of blocks copied
+LITERAL = b'L'  # followed by LENGTH and the data
+RUN = struct.Struct('!II')
+LENGTH = struct.Struct('!I')
+# modulus of adler32
+ADLER = 65521
+# after SCAN_EVERY blocks of data without a copy, the window jumps a block at a time and rolls through one block in
+# every SCAN_EVERY only. long changes cost about 1/SCAN_EVERY of the rolling, and copies start again at most
+# SCAN_EVERY blocks after their end
+SCAN_EVERY = 16
+
+
+def getBlockSize(size):
+    """
+    :param size: int - size of the file in bytes
+    :returns int - size of the blocks of its signature
+    """
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, math.isqrt(size)))
+
+
+def getStrong(data):
+    """
+    :param data: bytes - data of a block
+    :returns bytes - strong hash of the block
+    """
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def makeSignature(f, blockSize):
+    """
+    :param f: file - the file, opened for reading in binary
+    :param blockSize: int - size of the blocks. the last block can be shorter
+    :returns bytes - SIGNATURE of every block of the file, in order
+    """
+    signature = bytearray()
+    while True:
+        block = f.read(blockSize)
+        if not block:
+            break
+        signature += SIGNATURE.pack(zlib.adler32(block), getStrong(block))
+    return bytes(signature)
+
+
+def makeDelta(location, blockSize, signature, baseSize, limit=None):
+    """
+    Finds the blocks of the copy of the server in a file, at any offset.
+
+    :param location: str - full path of the file
+    :param blockSize: int - size of the blocks of the signature
+    :param signature: bytes - signature of the copy of the server (see makeSignature)
+    :param baseSize: int - size of the copy of the server in bytes
+    :param limit: int - optional - largest delta worth sending
+    :returns (bytes, str) - the delta, None if it is bigger than the limit, and the digest of the file
+    """
+    blocks = list(SIGNATURE.iter_unpack(signature))
+    # the last block of the copy is looked for at the end of the file only, when it is shorter than the others
+    tailSize = baseSize - (len(blocks) - 1) * blockSize if blocks else 0
+    full = len(blocks) if tailSize == blockSize else len(blocks) - 1
+
+    indexes = {}
+    for index in range(full):
+        indexes.setdefault(blocks[index][0], []).append(index)
+
+    delta = bytearray()
+    run = []  # [first block, number of blocks] of the copy being extended
+
+    def addLiteral(data):
+        if data:
+            endRun()
+            delta.extend(LITERAL + LENGTH.pack(len(data)))
+            delta.extend(data)
+
+    def addCopy(index):
+        if run and run[0] + run[1] == index:
+            run[1] += 1
+        else:
+            endRun()
+            run.extend((index, 1))
+
+    def endRun():
+        if run:
+            delta.extend(COPY + RUN.pack(*run))
+            run.clear()
+
+    with open(location, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        try:
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+
+            # start of the window, and start of the data not in the delta yet
+            pos = literal = 0
+            weak = None
+            last = size - blockSize
+            while pos <= last:
+                if weak is None:
+                    weak = zlib.adler32(data[pos:pos + blockSize])
+
+                index = None
+                if weak in indexes:
+                    strong = getStrong(data[pos:pos + blockSize])
+                    index = next((i for i in indexes[weak] if blocks[i][1] == strong), None)
+
+                if index is None:
+                    misses = (pos - literal) // blockSize
+                    if misses >= SCAN_EVERY and misses % SCAN_EVERY and pos + blockSize <= last:
+                        # jump a block
+                        pos += blockSize
+                        weak = None
+                    # roll the window one byte
+                    elif pos < last:
+                        out, new = data[pos], data[pos + blockSize]
+                        a = ((weak & 0xffff) - out + new) % ADLER
+                        b = ((weak >> 16) - blockSize * out + a - 1) % ADLER
+                        weak = b << 16 | a
+                        pos += 1
+                    else:
+                        pos += 1
+                    if limit is not None and len(delta) + pos - literal > limit:
+                        return None, digest
+                    continue
+
+                addLiteral(data[literal:pos])
+                addCopy(index)
+                pos += blockSize
+                literal = pos
+                weak = None
+
+            end = size
+            if 0 < tailSize < blockSize and size - literal >= tailSize and \
+                    getStrong(data[size - tailSize:]) == blocks[-1][1]:
+                end = size - tailSize
+            addLiteral(data[literal:end])
+            if end < size:
+                addCopy(len(blocks) - 1)
+            endRun()
+        finally:
+            if size:
+                data.close()
+
+    if limit is not None and len(delta) > limit:
+        return None, digest
+    return bytes(delta), digest
+
+
+def applyDelta(delta, base, out, blockSize):
+    """
+    Builds a new version of a file from a delta.
+
+    :param delta: bytes - the delta (see makeDelta)
+    :param base: file - the current version of the file, opened for reading in binary
+    :param out: file - where the new version is written
+    :param blockSize: int - size of the blocks the delta refers to
+    :returns str - digest of the new version
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    pos = 0
+    while pos < len(delta):
+        instruction = delta[pos:pos + 1]
+        pos += 1
+
+        if instruction == COPY:
+            assert pos + RUN.size <= len(delta), "Delta is cut"
+            first, count = RUN.unpack_from(delta, pos)
+            pos += RUN.size
+
+            base.seek(first * blockSize)
+            remaining = count * blockSize
+            while remaining > 0:
+                # the last block of the file can be shorter
+                data = base.read(min(remaining, 1024 * 1024))
+                if not data:
+                    break
+                remaining -= len(data)
+                out.write(data)
+                digest.update(data)
+
+        elif instruction == LITERAL:
+            assert pos + LENGTH.size <= len(delta), "Delta is cut"
+            (length,) = LENGTH.unpack_from(delta, pos)
+            pos += LENGTH.size
+
+            data = delta[pos:pos + length]
+            assert len(data) == length, "Delta is cut"
+            pos += length
+            out.write(data)
+            digest.update(data)
+
+        else:
+            assert False, "Invalid delta instruction"
+
+    return digest.hexdigest()
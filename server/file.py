@@ -1,5 +1,23 @@
+import hashlib
+import io
 import json
-from config import LIST_PATH, FILE_PATH
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict, Counter
+import uuid
+import zlib
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+    import msvcrt
+from config import LIST_PATH, FILE_PATH, JOURNAL_PATH, LOCK_PATH, CATALOG_COMPACT_EVERY, FILE_CACHE_SIZE, MAX_PARTIAL_UPLOADS, \
+    DELTA_SIGNATURES, STORAGE, CHUNK_PATH, CHUNK_MAX_SIZE
+from delta import getBlockSize, makeSignature, applyDelta
+from chunks import MANIFEST, splitChunks, writeChunk, getChunkLocation, readManifest, writeManifest, ChunkReader
 # Saiid El Hajj Chehade
 
 def readFile(fileName, fileType, directory):
@@ -7,7 +25,7 @@ def readFile(fileName, fileType, directory):
     location = directory + "\\" + fileName + "." + fileType
 
     # write the binary data
-    with open(location, 'rb') as f:
+    with openFile(location) as f:
         data =f.read()
 
     return data
@@ -27,12 +45,463 @@ def writeFile(fileName, fileType, directory, data):
     location = directory + "\\" + fileName + "." + fileType
 
     # write the binary data
-    with open(location, 'wb') as f:
+    tempLocation = location + "." + uuid.uuid4().hex + ".part"
+    with open(tempLocation, 'wb') as f:
         f.write(data)
 
+    storeFile(tempLocation, location)
+    uncacheFile(location)
     addFile(fileName, fileType)
 
 
+def openFile(location):
+    """
+    Opens a stored file for reading, whether it is kept whole or as chunks (see STORAGE in config.py).
+
+    :param location: str - full path of the file
+    :returns file - the file, opened for reading in binary
+    """
+    manifest = readManifest(location)
+    if manifest is None:
+        return open(location, 'rb')
+    return io.BufferedReader(ChunkReader(manifest), CHUNK_MAX_SIZE)
+
+
+def statFile(location):
+    """
+    :param location: str - full path of the file
+    :returns (int, int) - size in bytes and modification time in nanoseconds of a stored file
+    """
+    manifest = readManifest(location, header=True)
+    if manifest is None:
+        stat = os.stat(location)
+        return stat.st_size, stat.st_mtime_ns
+    return manifest['size'], os.stat(location + MANIFEST).st_mtime_ns
+
+
+def isStored(location):
+    """
+    :param location: str - full path of the file
+    :returns bool - whether the file is stored, whole or as chunks
+    """
+    return os.path.isfile(location) or os.path.isfile(location + MANIFEST)
+
+
+# number of times every chunk of the store is listed in the manifests of the catalog, by key.
+# counted from the manifests on first use
+chunkRefs = None
+chunkRefsLock = threading.Lock()
+
+
+def loadChunkRefs():
+    """
+    Gets the references to the chunks, counting them from the manifests the first time. Expects chunkRefsLock to be held.
+
+    :returns Counter - references by chunk key
+    """
+    global chunkRefs
+
+    if chunkRefs is None:
+        chunkRefs = Counter()
+        for file in getFileList():
+            manifest = readManifest(FILE_PATH + "\\" + file['file'])
+            if manifest:
+                chunkRefs.update(key for key, _ in manifest['chunks'])
+    return chunkRefs
+
+
+def releaseChunks(chunks):
+    """
+    Drops references to chunks, and deletes the chunks no file holds anymore. Expects chunkRefsLock to be held.
+
+    :param chunks: list - [key, size] of the chunks
+    """
+    refs = loadChunkRefs()
+    for key, _ in chunks:
+        refs[key] -= 1
+        if refs[key] <= 0:
+            del refs[key]
+            try:
+                os.remove(getChunkLocation(key))
+            except FileNotFoundError:
+                pass
+
+
+def storeFile(tempLocation, location):
+    """
+    Moves a complete file to its location in the storage (see STORAGE in config.py). With the 'chunks' storage only the
+    chunks missing from the store are written, and the chunks of the replaced version no file holds anymore are deleted.
+
+    :param tempLocation: str - full path of the complete file. it is moved or deleted
+    :param location: str - full path of the file
+    """
+    if STORAGE != 'chunks':
+        os.replace(tempLocation, location)
+        updateSize(location, os.path.getsize(location))
+
+        # a version kept as chunks before a change of STORAGE would be read instead
+        if os.path.exists(location + MANIFEST):
+            with chunkRefsLock:
+                old = readManifest(location)
+                os.remove(location + MANIFEST)
+                releaseChunks(old['chunks'])
+        return
+
+    os.makedirs(CHUNK_PATH, exist_ok=True)
+    with chunkRefsLock:
+        refs = loadChunkRefs()
+
+    chunks = []
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tempLocation, 'rb') as f:
+            for chunk in splitChunks(f):
+                key = hashlib.sha256(chunk).hexdigest()
+                # the chunk is referenced before it is written, so it is not deleted in between
+                with chunkRefsLock:
+                    refs[key] += 1
+                chunks.append([key, len(chunk)])
+                writeChunk(key, chunk)
+                digest.update(chunk)
+                size += len(chunk)
+    except Exception:
+        with chunkRefsLock:
+            releaseChunks(chunks)
+        raise
+    finally:
+        os.remove(tempLocation)
+
+    storeManifest(location, {'size': size, 'hash': digest.hexdigest(), 'chunks': chunks})
+
+
+def storeManifest(location, manifest):
+    """
+    Replaces a file with a file of the chunk store. The chunks of the manifest are expected to be referenced already.
+
+    :param location: str - full path of the file
+    :param manifest: dict - size, hash and chunks of the file (see chunks.readManifest)
+    """
+    try:
+        with chunkRefsLock:
+            old = readManifest(location)
+            writeManifest(location, manifest)
+    except Exception:
+        with chunkRefsLock:
+            releaseChunks(manifest['chunks'])
+        raise
+
+    updateSize(location, manifest['size'])
+    if old:
+        with chunkRefsLock:
+            releaseChunks(old['chunks'])
+
+    # the version kept whole before a change of STORAGE
+    if os.path.exists(location):
+        os.remove(location)
+
+
+class PartialFile:
+    """
+    A file being received. Data is written straight to a temporary file next to the destination, at the offset
+    of each segment, and the temporary file is renamed over the destination once the file is complete.
+    When the size of the file is known, an upload that stops before the end keeps the data received from the start
+    of the file, so a later upload of the same file can continue from there (see getPartialSize).
+    The crc32 of the data of this upload is computed as the data is written in order, to check it once it is complete.
+    """
+
+    def __init__(self, fileName, fileType, directory, size=None, offset=0):
+        """
+        :param fileName: str - name of file
+        :param fileType: str - type of file
+        :param directory: str - path to save in
+        :param size: int - optional - size of the file in bytes. the file is preallocated and kept if it is dropped
+        :param offset: int - optional - bytes kept from an earlier upload of the file to continue from
+        """
+        self.name = fileName
+        self.type = fileType
+        self.fileSize = size
+
+        # get the full path to destination
+        self.location = directory + "\\" + fileName + "." + fileType
+
+        if offset:
+            # continue the data kept from an earlier upload
+            self.tempLocation = takePartial(self.location, size, offset)
+            self.file = open(self.tempLocation, 'r+b')
+        else:
+            # a temporary path unique to this upload
+            self.tempLocation = self.location + "." + uuid.uuid4().hex + ".part"
+            self.file = open(self.tempLocation, 'wb')
+        if size:
+            self.file.truncate(size)
+
+        # data of this upload is written after the offset
+        self.base = offset
+        self.file.seek(offset)
+
+        # segment layout, learned from the segments: every segment but the last one has the same size
+        self.segmentSize = None
+        self.lastSegment = None  # (seqNum, data) of a last segment that arrived before its offset was known
+        self.size = None  # size of the file in bytes. known once the last segment is written
+
+        # bytes written from the start of the file without gaps, and data of the segments written after a gap
+        self.done = offset
+        self.nextSegment = 0
+        self.written = {}
+        # crc32 of the data of this upload written without gaps
+        self.crc = 0
+
+    def write(self, offset, data):
+        """
+        Writes data at the given offset of the data of this upload.
+        """
+        offset += self.base
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.file.fileno(), data, offset)
+        else:
+            self.file.seek(offset)
+            self.file.write(data)
+
+    def writeSegment(self, seqNum, numSegments, data):
+        """
+        Writes a segment at its offset. Segments may arrive in any order.
+
+        :param seqNum: int - index of the segment in the data of this upload
+        :param numSegments: int - number of segments of the upload
+        :param data: bytes - segment data
+        """
+        if seqNum < numSegments - 1:
+            if self.segmentSize is None:
+                self.segmentSize = len(data)
+            assert len(data) == self.segmentSize, "Segment size does not match the previous segments"
+
+            self.write(seqNum * self.segmentSize, data)
+            self.addWritten(seqNum, data)
+            seqNum, data = self.lastSegment or (None, None)
+            if seqNum is None:
+                return
+            self.lastSegment = None
+
+        # the last segment can be shorter. its offset is only known with the size of the other segments
+        elif numSegments > 1 and self.segmentSize is None:
+            self.lastSegment = (seqNum, data)
+            return
+
+        offset = seqNum * (self.segmentSize or 0)
+        self.write(offset, data)
+        self.addWritten(seqNum, data)
+        self.size = self.base + offset + len(data)
+
+    def addWritten(self, seqNum, data):
+        """
+        Moves the end of the data without gaps past the segments that are now written in order. Segments written
+        after a gap are kept until then, at most a window of them, to add them to the crc32 in order.
+        """
+        self.written[seqNum] = data
+        while self.nextSegment in self.written:
+            data = self.written.pop(self.nextSegment)
+            self.crc = zlib.crc32(data, self.crc)
+            self.done += len(data)
+            self.nextSegment += 1
+
+    def append(self, data):
+        """
+        Writes data after the data written so far.
+        """
+        self.file.write(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.done += len(data)
+        self.size = self.done
+
+    def verify(self, crc):
+        """
+        Checks the data of this upload against the crc32 sent with it. Corrupted data is dropped whole, so the next
+        upload of the file starts over.
+
+        :param crc: int - crc32 of the data of this upload. nothing is checked if None
+        :returns bool - False if the data did not match and was dropped
+        """
+        if crc is None or crc == self.crc:
+            return True
+
+        self.discard(keep=False)
+        return False
+
+    def commit(self):
+        """
+        Moves the complete file to its destination and adds it to the file list.
+        """
+        # cut the preallocated space after the data
+        if self.size is not None:
+            self.file.truncate(self.size)
+        self.file.close()
+
+        storeFile(self.tempLocation, self.location)
+        uncacheFile(self.location)
+        addFile(self.name, self.type)
+
+        # data kept from an earlier interrupted upload of the file is not needed anymore
+        if self.fileSize:
+            dropPartial(self.location, self.fileSize)
+
+    def discard(self, keep=True):
+        """
+        Drops an incomplete file. A file of known size keeps the data received from its start for a later upload.
+
+        :param keep: bool - optional - False to delete the data received
+        """
+        if keep and self.fileSize and self.done:
+            self.file.truncate(self.done)
+            self.file.close()
+            keepPartial(self.location, self.fileSize, self.tempLocation, self.done)
+            return
+
+        self.file.close()
+        os.remove(self.tempLocation)
+
+
+# uploads that stopped before the end, by (location, size): (kept location, bytes kept from the start).
+# the data is kept next to the location of the file in a file named after its size (see getPartialLocation), so it is
+# found again when the server restarts. the oldest are deleted once there are more than MAX_PARTIAL_UPLOADS
+PARTIAL = ".partial"
+partialUploads = OrderedDict()
+partialUploadsLock = threading.Lock()
+
+# temporary files of the uploads and updates in progress (see PartialFile)
+TEMPORARY = re.compile(r'\.[0-9a-f]{32}\.part$')
+
+
+def getPartialLocation(location, size):
+    """
+    :param location: str - full path of the file
+    :param size: int - size of the file in bytes
+    :returns str - full path of the data kept from an interrupted upload of the file
+    """
+    return location + "." + str(size) + PARTIAL
+
+
+def keepPartial(location, size, tempLocation, done):
+    """
+    Keeps the data of an interrupted upload to be continued.
+
+    :param location: str - full path of the file
+    :param size: int - size of the file in bytes
+    :param tempLocation: str - temporary file holding the data. it is moved to the kept location
+    :param done: int - bytes of data from the start of the file
+    """
+    keptLocation = getPartialLocation(location, size)
+
+    with partialUploadsLock:
+        # replaces the data kept from an earlier upload of the file
+        os.replace(tempLocation, keptLocation)
+        partialUploads.pop((location, size), None)
+        partialUploads[(location, size)] = (keptLocation, done)
+
+        dropped = []
+        while len(partialUploads) > MAX_PARTIAL_UPLOADS:
+            _, (oldest, _) = partialUploads.popitem(last=False)
+            dropped.append(oldest)
+
+    for keptLocation in dropped:
+        os.remove(keptLocation)
+
+
+def takePartial(location, size, offset):
+    """
+    Takes the data kept from an interrupted upload to continue it.
+
+    :param location: str - full path of the file
+    :param size: int - size of the file in bytes
+    :param offset: int - bytes the upload continues from
+    :returns str - temporary file holding the data, unique to this upload
+    """
+    tempLocation = location + "." + uuid.uuid4().hex + ".part"
+
+    with partialUploadsLock:
+        kept = partialUploads.get((location, size))
+        assert kept and kept[1] >= offset, "No partial upload to continue at this offset"
+        del partialUploads[(location, size)]
+        os.replace(kept[0], tempLocation)
+
+    return tempLocation
+
+
+def dropPartial(location, size):
+    """
+    Deletes the data kept from an interrupted upload.
+
+    :param location: str - full path of the file
+    :param size: int - size of the file in bytes
+    """
+    with partialUploadsLock:
+        kept = partialUploads.pop((location, size), None)
+
+    if kept:
+        os.remove(kept[0])
+
+
+def loadPartials():
+    """
+    Finds the data kept from interrupted uploads under FILE_PATH, oldest first, and deletes the temporary files of the
+    uploads that were in progress when the server stopped.
+    """
+    # paths are built with "\\" (see config.py). the directory holding them is found the same way
+    prefix = FILE_PATH + "\\"
+    directory = os.path.dirname(prefix + "x")
+
+    kept = []
+    for entry in os.scandir(directory) if os.path.isdir(directory) else []:
+        path = os.path.join(directory, entry.name)
+        if not path.startswith(prefix) or not entry.is_file():
+            continue
+
+        if TEMPORARY.search(path):
+            os.remove(path)
+            continue
+
+        location, _, size = path[:-len(PARTIAL)].rpartition(".")
+        if path.endswith(PARTIAL) and size.isdigit():
+            stat = entry.stat()
+            kept.append((stat.st_mtime_ns, location, int(size), path, stat.st_size))
+
+    dropped = []
+    with partialUploadsLock:
+        for _, location, size, path, done in sorted(kept):
+            partialUploads[(location, size)] = (path, done)
+        while len(partialUploads) > MAX_PARTIAL_UPLOADS:
+            _, (oldest, _) = partialUploads.popitem(last=False)
+            dropped.append(oldest)
+
+    for path in dropped:
+        os.remove(path)
+
+
+def getFileSize(fileName, fileType, directory):
+    """
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :returns int - size of the file in bytes
+    """
+    return statFile(directory + "\\" + fileName + "." + fileType)[0]
+
+
+def getPartialSize(fileName, fileType, directory, size):
+    """
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :param size: int - size of the file in bytes
+    :returns int - bytes kept from an interrupted upload of the file. 0 if there is none
+    """
+    location = directory + "\\" + fileName + "." + fileType
+
+    with partialUploadsLock:
+        kept = partialUploads.get((location, size))
+    return kept[1] if kept else 0
+
+
 # Saiid El Hajj Chehade
 def segmentData(maxSize, data):
     """
@@ -62,36 +531,637 @@ def segmentData(maxSize, data):
     return iter(segments), len(segments)
 
 
+# contents of recently downloaded files, by location: (size, modification time, data). least recently used first
+fileCache = OrderedDict()
+fileCacheStats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+fileCacheLock = threading.Lock()
+
+
+def getCachedFile(location, size):
+    """
+    Gets the contents of a file from the cache, reading the file into the cache on a miss.
+    Files bigger than a quarter of FILE_CACHE_SIZE are not cached.
+
+    :param location: str - full path of the file
+    :param size: int - size of the file in bytes
+    :returns bytes - the file data. None if the file is not cached
+    """
+    mtime = statFile(location)[1]
+
+    with fileCacheLock:
+        cached = fileCache.get(location)
+        if cached and cached[:2] == (size, mtime):
+            fileCache.move_to_end(location)
+            fileCacheStats['hits'] += 1
+            return cached[2]
+        fileCacheStats['misses'] += 1
+
+    if size > FILE_CACHE_SIZE // 4:
+        return None
+
+    with openFile(location) as f:
+        data = f.read()
+    # the file changed while it was read
+    if len(data) != size:
+        return None
+
+    with fileCacheLock:
+        old = fileCache.pop(location, None)
+        if old:
+            fileCacheStats['bytes'] -= len(old[2])
+
+        fileCache[location] = (size, mtime, data)
+        fileCacheStats['bytes'] += size
+
+        # evict the least recently used files until the cache fits its budget
+        while fileCacheStats['bytes'] > FILE_CACHE_SIZE:
+            _, (_, _, evicted) = fileCache.popitem(last=False)
+            fileCacheStats['bytes'] -= len(evicted)
+            fileCacheStats['evictions'] += 1
+
+    return data
+
+
+def uncacheFile(location):
+    """
+    Drops a file from the cache once it is replaced.
+
+    :param location: str - full path of the file
+    """
+    with fileCacheLock:
+        old = fileCache.pop(location, None)
+        if old:
+            fileCacheStats['bytes'] -= len(old[2])
+
+
+def getCacheStats():
+    """
+    :returns dict - hits, misses, evictions, bytes and files of the file cache
+    """
+    with fileCacheLock:
+        return dict(fileCacheStats, files=len(fileCache))
+
+
+def streamFile(maxSize, fileName, fileType, directory, offset=0, length=None):
+    """
+    Opens a file as a lazy segment iterator. Segments of files in the cache are slices of the cached data. Other
+    segments are read from disk only when they are asked for, so memory use does not grow with the size of the file.
+
+    :param maxSize: int - maximum number of bytes per segment
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :param offset: int - optional - bytes at the start of the file to skip, to continue an interrupted download
+    :param length: int - optional - bytes to segment from the offset, to send a range of the file. up to the end
+    of the file if not given
+
+    :returns (iterator, int, int) - segment iterator, number of segments, size of the file in bytes
+
+    """
+
+    # get the full path to destination
+    location = directory + "\\" + fileName + "." + fileType
+
+    size = statFile(location)[0]
+    end = size if length is None else offset + length
+    assert 0 <= offset <= end <= size, "Range not in file"
+
+    # same segmentation as segmentData: an empty file is one empty segment
+    numSegments = max(1, -(-(end - offset) // maxSize))
+
+    # hot files are segmented from memory without copying
+    data = getCachedFile(location, size)
+    if data is not None:
+        view = memoryview(data)[offset:end]
+        return (view[i * maxSize:(i + 1) * maxSize] for i in range(numSegments)), numSegments, size
+
+    def segments():
+        with openFile(location) as f:
+            f.seek(offset)
+            for i in range(numSegments):
+                yield f.read(min(maxSize, end - offset - i * maxSize))
+
+    return segments(), numSegments, size
+
+
+# crc32 of the files already checked, by location: (size, modification time, crc32)
+checksums = {}
+checksumsLock = threading.Lock()
+
+
+def getChecksum(fileName, fileType, directory, offset=0, length=None):
+    """
+    Gets the crc32 of a file. The result is kept until the file changes, so files sent without reading them
+    into memory are only read once to be checked.
+
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :param offset: int - optional - bytes at the start of the file left out. only whole files are kept
+    :param length: int - optional - bytes from the offset. up to the end of the file if not given
+    :returns int - crc32 of the file data
+    """
+
+    # get the full path to destination
+    location = directory + "\\" + fileName + "." + fileType
+
+    size, mtime = statFile(location)
+    with checksumsLock:
+        cached = checksums.get(location)
+    whole = not offset and length in (None, size)
+    if whole and cached and cached[:2] == (size, mtime):
+        return cached[2]
+
+    remaining = size - offset if length is None else length
+    crc = 0
+    with openFile(location) as f:
+        f.seek(offset)
+        while remaining > 0:
+            data = f.read(min(1024 * 1024, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            crc = zlib.crc32(data, crc)
+
+    if whole:
+        with checksumsLock:
+            checksums[location] = (size, mtime, crc)
+    return crc
+
+
+# block signatures of the last files asked for, by location: ((size, modification time), (block size, size, signature))
+signatures = OrderedDict()
+signaturesLock = threading.Lock()
+
+
+def getSignature(fileName, fileType, directory):
+    """
+    Gets the block signature of a file, for a delta upload of a new version of it (see delta.py).
+
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :returns (int, int, bytes) - block size, size of the file in bytes, signature of its blocks
+    """
+    location = directory + "\\" + fileName + "." + fileType
+    assert isStored(location), "Couldn't find file"
+
+    version = statFile(location)
+    with signaturesLock:
+        cached = signatures.get(location)
+        if cached and cached[0] == version:
+            signatures.move_to_end(location)
+            return cached[1]
+
+    blockSize = getBlockSize(version[0])
+    with openFile(location) as f:
+        signature = (blockSize, version[0], makeSignature(f, blockSize))
+
+    with signaturesLock:
+        signatures[location] = (version, signature)
+        signatures.move_to_end(location)
+        while len(signatures) > DELTA_SIGNATURES:
+            signatures.popitem(last=False)
+
+    return signature
+
+
+class DeltaUpload:
+    """
+    The delta of a new version of a file being received. Pieces of the delta arrive in order and a piece sent again
+    is ignored. The new version is built once the whole delta arrived.
+    """
+
+    def __init__(self, fileName, fileType, blockSize, digest, size):
+        """
+        :param fileName: str - name of file
+        :param fileType: str - type of file
+        :param blockSize: int - size of the blocks the delta refers to
+        :param digest: str - digest of the new version (see delta.py)
+        :param size: int - size of the delta in bytes
+        """
+        self.name = fileName
+        self.type = fileType
+        self.key = (fileName, fileType, blockSize, digest, size)
+        self.blockSize = blockSize
+        self.digest = digest
+        self.size = size
+        self.data = bytearray()
+        self.done = False  # the new version is built
+
+    def add(self, offset, data):
+        """
+        Adds a piece of the delta.
+
+        :param offset: int - where the piece starts in the delta
+        :param data: bytes - the piece
+        """
+        # sent again
+        if offset + len(data) <= len(self.data):
+            return
+
+        assert offset == len(self.data), "Delta pieces out of order"
+        assert offset + len(data) <= self.size, "Delta bigger than announced"
+        self.data += data
+
+    def commit(self, directory):
+        """
+        Builds the new version of the file next to it and replaces the file with it.
+
+        :param directory: str - path of the file
+        """
+        location = directory + "\\" + self.name + "." + self.type
+        assert isStored(location), "Couldn't find file"
+
+        tempLocation = location + "." + uuid.uuid4().hex + ".part"
+        try:
+            with open(tempLocation, 'wb') as f, openFile(location) as base:
+                digest = applyDelta(bytes(self.data), base, f, self.blockSize)
+            assert digest == self.digest, "File built from the delta does not match its digest"
+        except Exception:
+            os.remove(tempLocation)
+            raise
+
+        storeFile(tempLocation, location)
+        uncacheFile(location)
+        addFile(self.name, self.type)
+        self.done = True
+
+
+def receiveDelta(delta, fileName, fileType, directory, blockSize, digest, size, offset, data):
+    """
+    Adds a piece to the delta upload of a session, and builds the new version of the file once the delta is whole.
+
+    :param delta: DeltaUpload - the last delta upload of the session. None if there is none
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :param blockSize: int - size of the blocks the delta refers to
+    :param digest: str - digest of the new version
+    :param size: int - size of the delta in bytes
+    :param offset: int - where the piece starts in the delta
+    :param data: bytes - the piece
+    :returns DeltaUpload - the delta upload of the piece
+    """
+    key = (fileName, fileType, blockSize, digest, size)
+
+    # a first piece starts a new delta upload, unless it is the last piece of a finished one sent again
+    if delta is None or delta.key != key or offset == 0 and delta.done and len(data) < size:
+        assert offset == 0, "No delta upload to continue"
+        delta = DeltaUpload(fileName, fileType, blockSize, digest, size)
+
+    delta.add(offset, data)
+    if len(delta.data) == size and not delta.done:
+        delta.commit(directory)
+    return delta
+
+
+# sha256 of the files already hashed, by location: (size, modification time, sha256)
+contentHashes = {}
+contentHashesLock = threading.Lock()
+
+
+def getContentHash(location):
+    """
+    Gets the sha256 of a stored file. Files of the chunk store have it in their manifest. The hash of other files is
+    kept until they change, so they are only read once.
+
+    :param location: str - full path of the file
+    :returns (str, (int, int)) - sha256 of the file as hex, and the size and modification time it was taken at
+    """
+    manifest = readManifest(location, header=True)
+    if manifest:
+        return manifest['hash'], statFile(location)
+
+    version = statFile(location)
+    with contentHashesLock:
+        cached = contentHashes.get(location)
+    if cached and cached[:2] == version:
+        return cached[2], version
+
+    digest = hashlib.sha256()
+    with open(location, 'rb') as f:
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(data)
+
+    with contentHashesLock:
+        contentHashes[location] = version + (digest.hexdigest(),)
+    return digest.hexdigest(), version
+
+
+# locations of the stored files of the catalog by size, and the size of every location. built from the catalog on
+# first use and kept up to date as files are stored, so a 217 request only looks at the files of its size
+filesBySize = None
+fileSizes = {}
+filesBySizeLock = threading.Lock()
+
+
+def loadFilesBySize():
+    """
+    Gets the locations of the files by size, reading the sizes of the files of the catalog the first time. Expects
+    filesBySizeLock to be held.
+
+    :returns dict - set of the full paths of the files by size in bytes
+    """
+    global filesBySize, fileSizes
+
+    if filesBySize is None:
+        filesBySize, fileSizes = {}, {}
+        for file in getFileList():
+            location = FILE_PATH + "\\" + file['file']
+            try:
+                indexSize(location, statFile(location)[0])
+            except FileNotFoundError:
+                continue
+    return filesBySize
+
+
+def indexSize(location, size):
+    """
+    Records the size of a stored file. Expects filesBySizeLock to be held and the index to be loaded.
+
+    :param location: str - full path of the file
+    :param size: int - size of the file in bytes
+    """
+    old = fileSizes.get(location)
+    if old is not None:
+        filesBySize[old].discard(location)
+        if not filesBySize[old]:
+            del filesBySize[old]
+    fileSizes[location] = size
+    filesBySize.setdefault(size, set()).add(location)
+
+
+def updateSize(location, size):
+    """
+    Records the size of a new version of a stored file, once the index is loaded. Before that it is read with the
+    catalog.
+
+    :param location: str - full path of the file
+    :param size: int - size of the file in bytes
+    """
+    with filesBySizeLock:
+        if filesBySize is not None:
+            indexSize(location, size)
+
+
+def findContent(directory, size, digest):
+    """
+    Finds a file of the catalog with the given content. Only the files of the same size are hashed.
+
+    :param directory: str - path of the files
+    :param size: int - size of the content in bytes
+    :param digest: str - sha256 of the content as hex
+    :returns (str, (int, int)) - full path of the file and the size and modification time it was found at. None if
+    no file has this content
+    """
+    with filesBySizeLock:
+        locations = sorted(loadFilesBySize().get(size, ()))
+
+    for location in locations:
+        if not location.startswith(directory + "\\"):
+            continue
+        try:
+            # the file changed behind the back of the server
+            if statFile(location)[0] != size:
+                continue
+            found, version = getContentHash(location)
+        except FileNotFoundError:
+            continue
+        if found == digest:
+            return location, version
+    return None
+
+
+def linkFile(fileName, fileType, directory, size, digest):
+    """
+    Adds a file to the catalog as a copy of a file the server has with the same content, without receiving its data.
+    With the chunk store the file lists the chunks of the other file. Otherwise it is a hard link to the other file,
+    or a copy where the file system has no hard links.
+
+    :param fileName: str - name of file
+    :param fileType: str - type of file
+    :param directory: str - path of the file
+    :param size: int - size of the file in bytes
+    :param digest: str - sha256 of the file as hex
+    :returns bool - False if the server has no file with this content
+    """
+    location = directory + "\\" + fileName + "." + fileType
+
+    found = findContent(directory, size, digest)
+    if found is None:
+        return False
+    source, version = found
+
+    if source != location:
+        # the chunks are referenced with the manifest read, so they are not deleted if the other file is replaced
+        with chunkRefsLock:
+            manifest = readManifest(source)
+            if manifest and manifest['hash'] == digest:
+                loadChunkRefs().update(key for key, _ in manifest['chunks'])
+
+        if manifest:
+            # the other file changed since it was hashed
+            if manifest['hash'] != digest:
+                return False
+            storeManifest(location, manifest)
+        else:
+            tempLocation = location + "." + uuid.uuid4().hex + ".part"
+            try:
+                os.link(source, tempLocation)
+            except OSError:
+                shutil.copyfile(source, tempLocation)
+            # the other file changed since it was hashed
+            if statFile(source) != version:
+                os.remove(tempLocation)
+                return False
+            storeFile(tempLocation, location)
+        uncacheFile(location)
+
+    addFile(fileName, fileType)
+    return True
+
+
 def compileData(dataSegments):
     return b''.join(dataSegments)
 
 
+# the file list, loaded from LIST_PATH and JOURNAL_PATH on first use and kept in memory.
+# files are indexed by id and by (name, type)
+catalog = None
+catalogLock = threading.Lock()
+# LOCK_PATH, open and locked while the process uses the catalog
+storageLock = None
+
+
+class StorageInUseError(RuntimeError):
+    """
+    Raised when another server process uses the files and the catalog already.
+    """
+    pass
+
+
+def lockStorage():
+    """
+    Locks LOCK_PATH for the life of the process, so a second server started on the same files stops instead of
+    corrupting the catalog. The threads and the event loop of the process share the lock. Expects catalogLock to be
+    held.
+
+    :raises StorageInUseError - when another process holds the lock
+    """
+    global storageLock
+
+    if storageLock is not None:
+        return
+
+    f = open(LOCK_PATH, 'a+b')
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        raise StorageInUseError(f'{LOCK_PATH} is locked by another server process')
+    storageLock = f
+
+
+def loadCatalog():
+    """
+    Gets the file list, reading it from disk the first time. Files added since the last snapshot are
+    replayed from the journal, then merged into a new snapshot.
+
+    :returns dict - lastFileID, files (in order of addition), listing (as sent with 230), byId, byName, journal
+    """
+    global catalog
+
+    with catalogLock:
+        if catalog is None:
+            lockStorage()
+            with open(LIST_PATH, 'r') as f:
+                files = json.load(f)
+
+            catalog = {
+                'lastFileID': files['lastFileID'],
+                'files': [],
+                'listing': [],
+                'byId': {},
+                'byName': {},
+                'journal': None,  # journal file open for appending
+                'journaled': 0  # number of entries in the journal
+            }
+            for file in files['files']:
+                indexFile(file)
+
+            # entries already in the snapshot are skipped. they remain if the server stopped during a compaction
+            for file in readJournal():
+                if file['id'] > catalog['lastFileID']:
+                    catalog['lastFileID'] = file['id']
+                    indexFile(file)
+
+            compactCatalog()
+            loadPartials()
+
+    return catalog
+
+
+def readJournal():
+    """
+    Reads the entries of the journal. A last line cut by a crash is ignored.
+
+    :returns list - the journaled files
+    """
+    if not os.path.exists(JOURNAL_PATH):
+        return []
+
+    entries = []
+    with open(JOURNAL_PATH, 'r') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+    return entries
+
+
+def indexFile(file):
+    """
+    Adds a file to the catalog in memory. Expects catalogLock to be held.
+
+    :param file: dict - id, name and type of the file
+    """
+    catalog['files'].append(file)
+    catalog['listing'].append({'file': file['name'] + "." + file['type'], 'id': file['id']})
+    catalog['byId'][file['id']] = file
+    catalog['byName'][(file['name'], file['type'])] = file
+
+
+def compactCatalog():
+    """
+    Writes the whole catalog as the new snapshot and empties the journal. The snapshot is written to a temporary
+    file and renamed over the old one, so LIST_PATH is always a complete catalog. Expects catalogLock to be held.
+    """
+    tempLocation = LIST_PATH + ".tmp"
+    with open(tempLocation, 'w') as f:
+        json.dump({'lastFileID': catalog['lastFileID'], 'files': catalog['files']}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tempLocation, LIST_PATH)
+
+    if catalog['journal']:
+        catalog['journal'].close()
+    catalog['journal'] = open(JOURNAL_PATH, 'w')
+    catalog['journaled'] = 0
+
+
 def getFileList():
-    files = json.load(open(LIST_PATH, 'r'))
-    output = []
-    for file in files['files']:
-        output.append({'file': file['name']+"."+file['type'], 'id': file['id']})
-    return output
+    files = loadCatalog()
+    with catalogLock:
+        return list(files['listing'])
 
 def addFile(fileName,fileType):
-    files = json.load(open(LIST_PATH, 'r'))
+    files = loadCatalog()
 
-    matches = [i for i in range(len(files['files'])) if files['files'][i]['name']==fileName and files['files'][i]['type']==fileType]
-    if len(matches) >0: return
+    with catalogLock:
+        if (fileName, fileType) in files['byName']: return
 
-    files['lastFileID'] += 1
-    files['files'].append({
-        "id": files['lastFileID'],
-        "name": fileName,
-        "type": fileType
-    })
+        file = {
+            "id": files['lastFileID'] + 1,
+            "name": fileName,
+            "type": fileType
+        }
 
-    json.dump(files, open(LIST_PATH, 'w') )
+        # the entry is on disk before the file is listed
+        files['journal'].write(json.dumps(file) + '\n')
+        files['journal'].flush()
+        os.fsync(files['journal'].fileno())
+        files['journaled'] += 1
 
-def getFile(id, directory):
-    files = json.load(open(LIST_PATH, 'r'))
+        files['lastFileID'] = file['id']
+        indexFile(file)
+
+        if files['journaled'] >= CATALOG_COMPACT_EVERY:
+            compactCatalog()
+
+    # a file stored while the sizes were read from the catalog, before it was listed
+    location = FILE_PATH + "\\" + fileName + "." + fileType
+    with filesBySizeLock:
+        if filesBySize is not None and location not in fileSizes and isStored(location):
+            indexSize(location, statFile(location)[0])
+
+def getFileInfo(id):
+    """
+    Finds a file of the catalog.
 
-    matches = [i for i in range(len(files['files'])) if files['files'][i]['id']==id]
-    assert len(matches) > 0, "Couldn't find file with given id."
+    :param id: int - id of the file
+    :returns (str, str) - name and type of the file
+    """
+    file = loadCatalog()['byId'].get(id)
+    assert file is not None, "Couldn't find file with given id."
+
+    return file['name'], file['type']
+
+def getFile(id, directory):
+    fileName, fileType = getFileInfo(id)
 
-    return files['files'][matches[0]]['name'],files['files'][matches[0]]['type'], readFile(files['files'][matches[0]]['name'],files['files'][matches[0]]['type'], directory)
\ No newline at end of file
+    return fileName, fileType, readFile(fileName, fileType, directory)
\ No newline at end of file
@@ -0,0 +1,137 @@
+import struct
+import asyncio
+
+# code for TCP message framing by Saiid El Hajj Chehade
+
+# every TCP message is a fixed header [opcode (3 ascii digits) | payload length (uint32, big endian)] then the payload
+HEADER = struct.Struct('!3sI')
+
+# largest message read at once with readFrame. bigger payloads are read in chunks with readChunk
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def frameHeader(opcode, length):
+    """
+    Packs the header of a message.
+
+    :param opcode: bytes - 3 digit opcode
+    :param length: int - number of payload bytes following the header
+    :returns bytes - the header
+    """
+    return HEADER.pack(opcode, length)
+
+
+def frameSize(length):
+    """
+    :param length: int - bytes of the args of a message, after its opcode
+    :returns int - bytes the message takes on the wire, with its header
+    """
+    return HEADER.size + length
+
+
+def packFrame(message):
+    """
+    Frames a message in the format [opcode|args].
+
+    :param message: bytes - the message starting with its 3 digit opcode
+    :returns bytes - header followed by the args
+    """
+    return HEADER.pack(message[:3], len(message) - 3) + message[3:]
+
+
+class FrameReader:
+    """
+    Reassembles framed messages from a TCP socket.
+    recv may return parts of a message or several messages at once, so received bytes are buffered until
+    a whole frame is available.
+    """
+
+    def __init__(self, sock, bufferSize=65536):
+        """
+        :param sock: socket - connected TCP socket
+        :param bufferSize: int - maximum bytes asked from recv at once
+        """
+        self.socket = sock
+        self.bufferSize = bufferSize
+        self.buffer = bytearray()
+
+    def fill(self, size):
+        """
+        Receives until the buffer holds at least size bytes.
+        :returns bool - False if the connection was closed first
+        """
+        while len(self.buffer) < size:
+            data = self.socket.recv(max(self.bufferSize, size - len(self.buffer)))
+            if not data:
+                return False
+            self.buffer += data
+        return True
+
+    def readHeader(self):
+        """
+        Reads the header of the next message.
+        :returns (bytes, int) - opcode and payload length. None if the connection was closed
+        """
+        if not self.fill(HEADER.size):
+            return None
+
+        opcode, length = HEADER.unpack_from(self.buffer)
+        del self.buffer[:HEADER.size]
+        return opcode, length
+
+    def readChunk(self, maxSize):
+        """
+        Reads up to maxSize bytes of the current payload. Used to consume large payloads without holding them whole.
+        :returns bytes - the data. empty if the connection was closed
+        """
+        if self.buffer:
+            chunk = bytes(self.buffer[:maxSize])
+            del self.buffer[:maxSize]
+            return chunk
+
+        return self.socket.recv(maxSize)
+
+    def readPayload(self, length):
+        """
+        Reads a whole payload of the given length.
+        :returns bytes - the payload. None if the connection was closed first
+        """
+        if not self.fill(length):
+            return None
+
+        payload = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        return payload
+
+    def readFrame(self):
+        """
+        Reads the next whole message.
+        :returns bytes - the message in the format [opcode|args]. None if the connection was closed
+        """
+        header = self.readHeader()
+        if header is None:
+            return None
+
+        opcode, length = header
+        assert length <= MAX_FRAME_SIZE, f'Message too large ({length} bytes)'
+
+        payload = self.readPayload(length)
+        if payload is None:
+            return None
+
+        return opcode + payload
+
+
+async def readFrameAsync(reader):
+    """
+    Reads the next whole message from an asyncio stream.
+
+    :param reader: asyncio.StreamReader - the stream to read from
+    :returns bytes - the message in the format [opcode|args]. None if the connection was closed
+    """
+    try:
+        opcode, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+        assert length <= MAX_FRAME_SIZE, f'Message too large ({length} bytes)'
+        return opcode + await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
@@ -0,0 +1,46 @@
+import struct
+import zlib
+
+# code for the integrity checks by Saiid El Hajj Chehade
+# server/ and client/ have identical copies of this module. change both (see tests/test_shared.py)
+
+# With the 'check' option granted to a session, every UDP segment carries a crc32 of the segment after its index, so
+# segments damaged on the way are dropped and asked for again on their own. Every transfer is also checked whole:
+# the sender announces the crc32 of the data it sends and the receiver compares it with the crc32 of the data it
+# wrote, computed as the data arrives, before the file is kept.
+CHECKS = ['crc32']
+CRC = struct.Struct('!I')
+
+
+def packSegment(index, payload, check=''):
+    """
+    :param index: int - index of the segment
+    :param payload: bytes - data of the segment
+    :param check: str - optional - granted check. the segment carries no crc32 if empty
+    :returns bytes - the 212 message of the segment: 212, index, \x1c, crc32 of the rest of the message, payload
+    """
+    header = bytes(f'212{index}\x1c', 'utf-8')
+    if not check:
+        return header + payload
+    return header + CRC.pack(zlib.crc32(payload, zlib.crc32(header))) + payload
+
+
+def unpackSegment(args, check=''):
+    """
+    :param args: bytes - the 212 message without its opcode
+    :param check: str - optional - granted check. the segment carries no crc32 if empty
+    :returns (int, bytes, bool) - index of the segment (None if it cannot be read), payload, and False if the
+    segment was damaged on the way
+    """
+    separateAt = args.find(b'\x1c')
+    index = int(args[:separateAt]) if separateAt > 0 and args[:separateAt].isdigit() else None
+    if not check:
+        return index, args[separateAt + 1:], True
+
+    start = separateAt + 1 + CRC.size
+    if index is None or len(args) < start:
+        return index, b'', False
+    payload = args[start:]
+    crc = zlib.crc32(payload, zlib.crc32(b'212' + args[:separateAt + 1]))
+    return index, payload, CRC.unpack_from(args, separateAt + 1)[0] == crc
+
@@ -1,39 +1,310 @@
 from .session import Session
-from file import compileData, writeFile, getFileList, getFile, segmentData
+from file import PartialFile, getFileList, getFileInfo, streamFile, getChecksum, getCacheStats, getPartialSize, \
+    getSignature, receiveDelta, linkFile, \
+    getFileSize, openFile
+from stats import TransferStats, getBitrate
 import time
 import json
-from config import FILE_PATH
+from collections import deque
+import os
+import socket
+import zlib
+from config import FILE_PATH, UDP_WINDOW_SIZE, SEGMENT_SIZE, MAX_SEGMENT_SIZE, UDP_IDLE_TIMEOUT, COMPRESSION_CODECS, \
+    MAX_DELTA_SIZE, SESSION_ACCEPT_TIMEOUT, UDP_SESSION_TIMEOUT
+from framing import FrameReader, packFrame, frameHeader, frameSize
+from log import Progress
+from rto import RetransmitTimer, RetransmitLimitError
+from compression import CODECS, chooseCodec, encodeSegments, decodeSegment
+from delta import SIGNATURE
+from integrity import CHECKS, packSegment, unpackSegment
+
+
+class FTPSession(Session):
+    """
+        FTPSession holds the requests TcpFTPSession and UdpFTPSession handle the same way. The transfers themselves
+        and the options of a session are up to the transport.
+        Scope of requests include:
+        215 - getSignature
+        216 - receiveDelta
+        217 - linkFile
+        218 - getUploadOffset
+        219 - getFileDetails
+        230 - getFiles
+        250 - getStats
+        """
+
+    # timeout of unacknowledged messages, for the transports that acknowledge them. None over TCP
+    timer = None
+
+    def signaturePageBlocks(self, header):
+        """
+        :param header: bytes - the 215 header sent in front of the page
+        :returns int - number of block signatures sent in a page of the signature of a file
+        """
+        pass
+
+    def linkFile(self, args, timestamp=None):
+        """
+        OPCODE 217
+        Adds a file without receiving its data when the server has a file with the same content already.
+
+        :param args: byteArray:
+            number of fields: 4
+            index   length(chars)  name         values     description
+            0       -              fileName     str        the file name of file to be sent
+            1       -              fileType     str        the extension of the file
+            2       -              size         int>=0     size of the file in bytes
+            3       -              digest       str        sha256 of the file as hex
+        :sends
+        opcode  args
+        217     1 if the file was added, 0 if it has to be uploaded
+        """
+        argList = args.split(self.SEPERATOR)
+        assert len(argList) == 4, "Expected 4 arguments: fileName, fileType, size, digest"
+
+        fileName, fileType, digest = argList[0].decode('utf-8'), argList[1].decode('utf-8'), argList[3].decode('utf-8')
+        linked = linkFile(fileName, fileType, FILE_PATH, int(argList[2]), digest)
+        if linked:
+            self.log.info(f'file [{fileName}.{fileType}] Added from the content of a file already on the server')
+
+        self.sendMessage(f'217{int(linked)}')
+
+    def getUploadOffset(self, args, timestamp=None):
+        """
+        OPCODE 218
+        Finds where an interrupted upload of a file can continue from.
+
+        :param args: byteArray:
+            number of fields: 3
+            index   length(chars)  name         values     description
+            0       -              fileName     str        the file name of file to be sent
+            1       -              fileType     str        the extension of the file
+            2       -              size         int>=0     size of the file in bytes
+        :sends
+        opcode  args
+        218     bytes of the file kept by the server. 0 if the upload has to start over
+        """
+        argList = args.split(self.SEPERATOR)
+        assert len(argList) == 3, "Expected 3 arguments: fileName, fileType, size"
+
+        fileName, fileType, size = argList[0].decode('utf-8'), argList[1].decode('utf-8'), int(argList[2])
+        self.sendMessage(f'218{getPartialSize(fileName, fileType, FILE_PATH, size)}')
+
+    def getSignature(self, args, timestamp=None):
+        """
+        OPCODE 215
+        Sends the block signature of a file, for a delta upload of a new version of it (see delta.py).
+        The signature is sent in pages (see signaturePageBlocks).
+
+        :param args: byteArray:
+            number of fields: 3
+            index   length(chars)  name         values     description
+            0       -              fileName     str        the file name of file to be sent
+            1       -              fileType     str        the extension of the file
+            2       -              firstBlock   int>=0     index of the first block of the page
+        :sends
+        opcode  args
+        215     blockSize, size of the file, number of blocks, largest delta accepted, firstBlock, then the
+                SIGNATURE of the blocks of the page
+        """
+        argList = args.split(self.SEPERATOR)
+        assert len(argList) == 3, "Expected 3 arguments: fileName, fileType, firstBlock"
+
+        fileName, fileType, first = argList[0].decode('utf-8'), argList[1].decode('utf-8'), int(argList[2])
+        blockSize, size, signature = getSignature(fileName, fileType, FILE_PATH)
+        numBlocks = len(signature) // SIGNATURE.size
+
+        header = bytes(f'215{blockSize}\x1c{size}\x1c{numBlocks}\x1c{MAX_DELTA_SIZE}\x1c{first}\x1c', 'utf-8')
+        pageBlocks = self.signaturePageBlocks(header)
+        page = signature[first * SIGNATURE.size:(first + pageBlocks) * SIGNATURE.size]
+        self.sendMessage(header + page, isString=False)
+
+    def receiveDelta(self, args, timestamp=None):
+        """
+        OPCODE 216
+        Receives a piece of the delta of a new version of a file (see delta.py). The new version replaces the file
+        once the whole delta arrived.
+
+        :param args: byteArray:
+            number of fields: 7
+            index   length(chars)  name         values     description
+            0       -              fileName     str        the file name of file to be received
+            1       -              fileType     str        the extension of the file
+            2       -              blockSize    int>0      size of the blocks of the signature the delta refers to
+            3       -              digest       str        blake2b digest of the new version, 16 bytes as hex
+            4       -              size         int>=0     size of the delta in bytes
+            5       -              offset       int>=0     where the piece starts in the delta
+            6       -              data         bytes      the piece of the delta
+        :sends
+        opcode  args
+        216     bytes of the delta received. the file is replaced once it is the size of the delta
+        """
+        argList = args.split(self.SEPERATOR, 6)
+        assert len(argList) == 7, "Expected 7 arguments: fileName, fileType, blockSize, digest, size, offset, data"
+
+        fileName, fileType, digest = argList[0].decode('utf-8'), argList[1].decode('utf-8'), argList[3].decode('utf-8')
+        blockSize, size, offset = int(argList[2]), int(argList[4]), int(argList[5])
+        assert size <= MAX_DELTA_SIZE, f'Delta bigger than {MAX_DELTA_SIZE} bytes'
+
+        done = self.delta is not None and self.delta.done
+        self.delta = receiveDelta(self.delta, fileName, fileType, FILE_PATH, blockSize, digest, size, offset,
+                                  bytes(argList[6]))
+        if self.delta.done and not done:
+            self.log.info(f'file [{fileName}.{fileType}] Updated from a delta of {size} bytes')
+
+        self.sendMessage(f'216{len(self.delta.data)}')
+
+    def getFileDetails(self, args, timestamp=None):
+        """
+        OPCODE 219
+        Describes a file of the file list, so it can be downloaded in ranges.
+
+        :param args: byteArray:
+            number of fields: 1
+            index   length(chars)  name         values     description
+            0       -              fileID       int        id of the file in the file list
+        :sends
+        opcode  args
+        219     fileName, fileType, size in bytes
+        """
+        assert args, "Expected 1 argument: file id"
+
+        fileName, fileType = getFileInfo(int(args.decode('utf-8')))
+        self.sendMessage(f'219{fileName}\x1c{fileType}\x1c{getFileSize(fileName, fileType, FILE_PATH)}')
+
+    # display file list in the server
+    def getFiles(self, args, timestamp=None):
+        self.log.info('Sending File list')
+        files = json.dumps(getFileList())
+        self.sendMessage('230' + files)
+
+    def getStats(self, args, timestamp=None):
+        """
+        OPCODE 250
+        Sends the statistics of the transfers of the session.
+
+        :sends
+        opcode  args
+        250     json: transfers - last finished transfers, current - transfer in progress or null,
+                cache - counters of the server file cache, timer - round trip estimate and retransmission counters of
+                UDP sessions
+        """
+        self.log.info('Sending transfer statistics')
+        current = self.fileToReceive or self.fileToSend
+        stats = {
+            'transfers': list(self.transfers),
+            'current': current['stats'].summary() if current else None,
+            'cache': getCacheStats()
+        }
+        if self.timer is not None:
+            stats['timer'] = self.timer.summary()
+        self.sendMessage('250' + json.dumps(stats))
+
+    def finishTransfer(self, stats):
+        """
+        Adds the statistics of a finished transfer to the history of the session.
+        :param stats: TransferStats - statistics of the transfer
+        """
+        stats.finish()
+        self.transfers.append(stats.summary())
+
+    def verifyFile(self):
+        """
+        Checks the data of the file in transit against the crc32 sent by the client. A corrupted file is dropped.
+        """
+        fileToReceive = self.fileToReceive
+        intact = fileToReceive['file'].verify(fileToReceive['crc'])
+        if not intact:
+            self.fileToReceive = None
+        assert intact, f'File [{fileToReceive["name"]}.{fileToReceive["type"]}] was corrupted in transit'
+
+    def codecs(self):
+        """
+        :returns list - codecs granted to the client, by preference
+        """
+        return list(filter(None, self.options.get('compress', '').split(',')))
+
+    def check(self):
+        """
+        :returns str - integrity check granted to the client. '' if none
+        """
+        return self.options.get('check', '')
+
 
 # code for TCP FTP Session by Rim and Elie
 
-class TcpFTPSession(Session):
-    def __init__(self):
+class TcpFTPSession(FTPSession):
+    """
+        TcpFTPSession handles file transfer using the TCP protocol.
+        Messages are framed with a fixed [opcode|length] header (see framing.py).
+        In 'ack' mode every segment is acknowledged. In 'stream' mode the file data is written as one 212 message
+        and the receiver confirms it once at the end with a crc32 of the data.
+        With the 'check' option the sender also announces the crc32 of the data with the file, and the receiver keeps
+        the file only if the data it got matches (see integrity.py).
+        Scope of requests include:
+        211 - requestReceiveFile
+        212 - receiveSegment
+        215 - getSignature
+        216 - receiveDelta
+        217 - linkFile
+        218 - getUploadOffset
+        219 - getFileDetails
+        230 - getFiles
+        241 - startSendFile
+        250 - getStats
+        """
+
+    def __init__(self, options=None, onOpen=None):
 
         # Constants
         self.SEPERATOR = b'\x1c'  # used to separate argument list.
+        self.STREAM_SEGMENT = 65536  # bytes written or read at once in streaming mode
+        self.SENDFILE_SEGMENTS = 16  # stream segments handed to sendfile at once
+        self.SIGNATURE_PAGE = 1024 * 1024  # bytes of block signatures sent at once for a delta upload
+        # options negotiated with the client
+        self.options = options or TcpFTPSession.negotiate({})
         # data relevant to the file in transit if it exists
         self.fileToReceive = None
         self.fileToSend = None
+        # last delta upload of the session
+        self.delta = None
+        # statistics of the last transfers of the session
+        self.transfers = deque(maxlen=10)
         # Dictionary of available commands to be requested from Client Session
         self.commands = {
             b'211': self.requestReceiveFile,
             b'212': self.receiveSegment,
+            b'215': self.getSignature,
+            b'216': self.receiveDelta,
+            b'217': self.linkFile,
+            b'218': self.getUploadOffset,
+            b'219': self.getFileDetails,
             b'230': self.getFiles,
-            b'241': self.startSendFile
+            b'241': self.startSendFile,
+            b'250': self.getStats
         }
-        Session.__init__(self, 'TCP FTP Session', TcpFTPSession.port(), 'TCP')
+        Session.__init__(self, 'TCP FTP Session', None, 'TCP', onOpen=onOpen)
 
     def waitClientRequest(self):
-        print(f'[{self.name}]: Available for Clients')
+        self.log.info('Available for Clients')
 
         # tcp is not connectionless. But we want to handle one client per session.
         # We wait for the first message and save the user address that is contacting session.
-
-        conn, addr = self.socket.accept()
+        # a client that does not connect within SESSION_ACCEPT_TIMEOUT gives the session up
+        self.socket.settimeout(SESSION_ACCEPT_TIMEOUT)
+        try:
+            conn, addr = self.socket.accept()
+        except socket.timeout:
+            self.log.warning(f'No client connected within {SESSION_ACCEPT_TIMEOUT} s')
+            self.close()
+        # messages are written whole. a frame header written before its data, like in sendStream, is sent at once
+        # instead of waiting for the acknowledgment of the last data (Nagle)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
         self.client = {
             'connection': conn,
-            'address': addr
+            'address': addr,
+            'reader': FrameReader(conn)
         }
 
         # handle any subsequent requests by going to run()
@@ -55,23 +326,36 @@ class TcpFTPSession(Session):
 
             # send message to client
             ticSend = time.perf_counter_ns() / 1000.0
-            self.client['connection'].sendall(data)
+            self.client['connection'].sendall(packFrame(data))
             tocSend = time.perf_counter_ns() / 1000.0
             tocAll = tocSend
 
             if waitSuccess:
-                resp = self.client['connection'].recv(1024)
+                resp = self.client['reader'].readFrame()
+                if resp is None:
+                    raise ConnectionResetError()
+                tocAll = time.perf_counter_ns() / 1000.0
                 assert resp[:3] == b'100', 'Wrong response'
 
             return ticSend, tocSend, tocAll, tocSend - ticSend, tocAll - ticSend
 
+    def close(self, *args):
+        '''
+        Closes the session. A file still in transit is dropped.
+        '''
+        if self.fileToReceive:
+            self.fileToReceive['file'].discard()
+            self.fileToReceive = None
+
+        Session.close(self)
+
     def run(self):
 
         # infinite loop to read multiple requests
         while True:
             # save the received message in data
 
-            data = self.client['connection'].recv(1024)
+            data = self.client['reader'].readFrame()
             timestamp = time.perf_counter_ns() / 1000.0
             if not data:
                 # close on no data
@@ -81,10 +365,11 @@ class TcpFTPSession(Session):
                 self.onReceived(data, timestamp)
 
             except AssertionError as e:
-                print(f'[{self.name}]:', e)
+                self.log.warning(e)
                 self.sendMessage(f'400 ' + str(e))
 
         # if connection closed close it
+        self.client['connection'].close()
         return self.close()
 
     def onReceived(self, payload, timestamp=None):
@@ -116,7 +401,7 @@ class TcpFTPSession(Session):
             self.commands[opcode](args, timestamp)
 
         except AssertionError as e:
-            print(f'[{self.name}]:', e)
+            self.log.warning(e)
             self.sendMessage(f'400 ' + str(e))
 
     def requestReceiveFile(self, args, timestamp=None):
@@ -126,43 +411,145 @@ class TcpFTPSession(Session):
 
         :param timestamp: float - optional - time at which the data is received
         :param args: byteArray:
-            number of fields: 3
+            number of fields: 3 to 7, 4 to 7 in streaming mode
             index   length(chars)  name         values     description
             0       -              fileName     str        the file name of file to be received
             1       -              fileType     str        the extension of the file
-            2       -              numSegments  int>0      segmentation number
+            2       -              numSegments  int>0      segmentation number of the data sent from the offset
+            3       -              size         int>=0     optional - size of the file in bytes. needed in streaming mode
+                                                           and to keep the data if the upload stops
+            4       -              offset       int>=0     optional - bytes kept from an earlier upload to continue from
+            5       -              codec        str        optional - codec the segments are compressed with, one of
+                                                           the granted 'compress' option. raw if empty
+            6       8              crc          hex        optional - crc32 of the data sent from the offset. the file
+                                                           is dropped if the data received does not match
         :sends
         opcode  description
-        100     manual acknowledgment of request
+        100     streaming mode - manual acknowledgment of request
         """
 
         # example: 211mytext\x1ctxt\x1c400
         # args: mytext\x1ctxt -> split with \x1c -> [mytext, txt, 200]
 
+        streaming = self.options['mode'] == 'stream'
+
         # split args string
         argList = args.split(self.SEPERATOR)
 
-        # make sure the number of arguments is 3
-        assert len(argList) == 3, "Expected 3 arguments: fileName, fileType, segmentsNumber"
+        # make sure the number of arguments is right
+        if streaming:
+            assert 4 <= len(argList) <= 7, "Expected 4 arguments: fileName, fileType, segmentsNumber, size"
+        else:
+            assert 3 <= len(argList) <= 7, "Expected 3 arguments: fileName, fileType, segmentsNumber"
 
         # parse args
-        fileName, fileType, numSegments = argList
+        fileName, fileType, numSegments = argList[:3]
         fileName, fileType, numSegments = fileName.decode('utf-8'), fileType.decode('utf-8'), int(
             numSegments.decode('utf-8'))
+        size = int(argList[3].decode('utf-8')) if len(argList) > 3 else None
+        offset = int(argList[4].decode('utf-8')) if len(argList) > 4 else 0
+        codec = argList[5].decode('utf-8') if len(argList) > 5 else ''
+        assert not codec or codec in self.codecs(), f'Codec "{codec}" not granted'
+        crc = int(argList[6], 16) if len(argList) > 6 and argList[6] else None
 
-        print(f'[{self.name}]:', f'Receiving file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        self.log.info(f'Receiving file [{fileName}.{fileType}] - (0/{numSegments}) ' +
+                      (f'from byte {offset} ' if offset else '') + (f'compressed with {codec}' if codec else ''))
 
         # generate file data
         self.fileToReceive = {
             'name': fileName,
             'type': fileType,
-            'segments': [],  # list of arriving segments
+            'progress': Progress(self.log),  # samples the progress messages
+            # segments are appended to it as they arrive
+            'file': PartialFile(fileName, fileType, FILE_PATH, size=size, offset=offset),
             'received': 0,  # number of received segments
             'total': numSegments,  # total number of segments
-            'timestamps': [time.perf_counter_ns() / 1000.0],  # timestamps of arrival of segments
-            'rate': 0  # realtime average of bitrate
+            'codec': codec,  # codec of the segments. '' if raw
+            'crc': crc,  # crc32 of the data announced by the client. None if it is not checked
+            'stats': TransferStats('receive', fileName, fileType)
         }
 
+        if streaming:
+            # only the data after the offset is sent
+            self.fileToReceive['size'] = size - offset
+            self.sendMessage('100 file ready to be received')
+            self.receiveStream()
+
+    def receiveStream(self):
+        """
+        Receives the data of the file in transit in streaming mode. The whole file is the payload of one 212 message
+        and is read in chunks. The data is confirmed once all of it arrived.
+        A compressed file is sent as one 212 message per compressed chunk instead, and an empty 212 message ends it.
+
+        :sends
+        opcode  description                   args
+        100     confirmation of the file      crc32 of the received data as 8 hex digits
+        400     the data does not match the crc32 of the request. the file is dropped
+        """
+
+        reader = self.client['reader']
+        size = self.fileToReceive['size']
+        codec = self.fileToReceive['codec']
+        receivedBytes = 0
+        crc = 0
+
+        # the stream cannot be followed anymore if the data message is missing. the session is ended
+        if not codec:
+            header = reader.readHeader()
+            if header != (b'212', size):
+                self.log.warning('Expected the file data')
+                raise ConnectionResetError()
+            self.fileToReceive['stats'].addRaw(frameSize(0))
+
+        while receivedBytes < size or codec:
+            if codec:
+                payload = reader.readFrame()
+                if payload is None or payload[:3] != b'212':
+                    self.log.warning('Expected the file data')
+                    raise ConnectionResetError()
+                if len(payload) == 3:
+                    # end of the file
+                    self.fileToReceive['stats'].addRaw(frameSize(0))
+                    break
+                try:
+                    data = decodeSegment(codec, payload[3:], self.STREAM_SEGMENT)
+                except AssertionError as e:
+                    self.log.warning(e)
+                    raise ConnectionResetError()
+                rawSize = frameSize(len(payload) - 3)
+            else:
+                data = reader.readChunk(min(self.STREAM_SEGMENT, size - receivedBytes))
+                rawSize = len(data)
+            timestamp = time.perf_counter_ns() / 1000.0
+            if not data and receivedBytes < size:
+                # the client left in the middle of the file
+                raise ConnectionResetError()
+
+            receivedBytes += len(data)
+            crc = zlib.crc32(data, crc)
+
+            # save the data
+            self.fileToReceive['file'].append(data)
+            self.fileToReceive['received'] = receivedBytes * self.fileToReceive['total'] // max(size, 1)
+
+            self.fileToReceive['stats'].addSegment(len(data), timestamp=timestamp)
+            self.fileToReceive['stats'].addRaw(rawSize)
+
+            if self.fileToReceive['progress'].due(self.fileToReceive['received'], self.fileToReceive['total']):
+                self.log.info(f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["stats"].rate or 0)} bps ')
+
+        if receivedBytes != size:
+            self.log.warning(f'Expected {size} bytes of file data, received {receivedBytes}')
+            raise ConnectionResetError()
+
+        self.verifyFile()
+        self.fileToReceive['file'].commit()
+
+        self.sendMessage(f'100{crc:08x}')
+        self.finishTransfer(self.fileToReceive['stats'])
+        self.log.info(f'file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] Received successfully')
+
+        self.fileToReceive = None
 
     def receiveSegment(self, args, timestamp):
         """
@@ -178,6 +565,8 @@ class TcpFTPSession(Session):
         :sends
         opcode  description                        args
         100     manual acknowledgment of segment   segment index
+        400     the data does not match the crc32 of the request. the file is dropped instead of acknowledging its
+                last segment
         """
         # example: 212001\x1cDATASEGMENT
         # args: mytext\x1ctxt -> split with \x1c -> [mytext, txt, 200]
@@ -185,39 +574,52 @@ class TcpFTPSession(Session):
         assert self.fileToReceive is not None, "Server not expecting file"
         assert self.fileToReceive['received'] != self.fileToReceive['total'], "Received all segments"
 
-        data = args
+        data = decodeSegment(self.fileToReceive['codec'], args, int(self.options['segment']))
         # save the segment data
-        self.fileToReceive['segments'].append(data)
-        self.fileToReceive['timestamps'].append(timestamp)
+        self.fileToReceive['file'].append(data)
         self.fileToReceive['received']+=1
 
-        self.fileToReceive['rate'] = getAverageRate(
-            sampleNumber=self.fileToReceive['received'],
-            oldAverage=self.fileToReceive['rate'],
-            newSampleSize=len(data),
-            duration= timestamp - self.fileToReceive['timestamps'][-2]
-        )
+        self.fileToReceive['stats'].addSegment(len(data), timestamp=timestamp)
+        self.fileToReceive['stats'].addRaw(frameSize(len(args)))
 
-        print(f'[{self.name}]:',
-              f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["rate"])} bps ')
+        if self.fileToReceive['progress'].due(self.fileToReceive['received'], self.fileToReceive['total']):
+            self.log.info(f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["stats"].rate or 0)} bps ')
 
+        if self.fileToReceive['received'] == self.fileToReceive['total']:
+            self.verifyFile()
         self.sendMessage('100 received')
         if self.fileToReceive['received'] == self.fileToReceive['total']:
-            data = compileData(self.fileToReceive['segments'])
-            writeFile(self.fileToReceive['name'], self.fileToReceive['type'], FILE_PATH, data)
+            self.fileToReceive['file'].commit()
+            self.finishTransfer(self.fileToReceive['stats'])
 
-            print(f'[{self.name}]:',
-                  f'file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] Received successfully')
+            self.log.info(f'file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] Received successfully')
 
             self.fileToReceive = None
 
-    # display file list in the server
-    def getFiles(self, args, timestamp=None):
-        print(f'[{self.name}]:', 'Sending File list')
-        files = json.dumps(getFileList())
-        self.sendMessage('230' + files)
+    def signaturePageBlocks(self, header):
+        """
+        :param header: bytes - the 215 header sent in front of the page
+        :returns int - number of block signatures in SIGNATURE_PAGE bytes
+        """
+        return self.SIGNATURE_PAGE // SIGNATURE.size
 
     def startSendFile(self, args, timestamp=None):
+        """
+        OPCODE 241
+        Sends a file to the client.
+
+        :param args: byteArray:
+            number of fields: 1 to 3
+            index   length(chars)  name         values     description
+            0       -              fileID       int        id of the file in the file list
+            1       -              offset       int>=0     optional - bytes of the file the client already has
+            2       -              length       int>=0     optional - bytes to send from the offset, to download
+                                                           ranges of the file in parallel. up to the end if not given
+        :sends
+        opcode  args
+        241     fileName, fileType, numSegments, size of the data sent from the offset, codec. raw if empty,
+                then with the 'check' option the crc32 of the data sent as 8 hex digits
+        """
 
         # example: 2411
 
@@ -225,40 +627,56 @@ class TcpFTPSession(Session):
         assert args, "Expected 3 arguments: fileName, fileType, segmentsNumber"
 
         # parse args
-        fileID = int(args.decode('utf-8'))
+        argList = args.split(self.SEPERATOR)
+        fileID = int(argList[0].decode('utf-8'))
+        offset = int(argList[1].decode('utf-8')) if len(argList) > 1 else 0
+        length = int(argList[2].decode('utf-8')) if len(argList) > 2 else None
 
-        fileName, fileType, data = getFile(fileID, FILE_PATH)
+        fileName, fileType = getFileInfo(fileID)
 
-        segments, numSegments = segmentData(1012, data)
+        # files that are compressed already are sent raw
+        codec = chooseCodec(self.codecs(), fileName, fileType, FILE_PATH, offset, openFile)
 
-        print(f'[{self.name}]:', f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        if self.options['mode'] == 'stream':
+            return self.sendStream(fileName, fileType, offset, length, codec)
+
+        segments, numSegments, size = streamFile(int(self.options['segment']), fileName, fileType, FILE_PATH,
+                                                 offset, length)
+        size = size - offset if length is None else length
+
+        self.log.info(f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        progress = Progress(self.log)
 
         # generate file data
         self.fileToSend = {
             'name': fileName,
             'type': fileType,
-            'ACKS': [False] * numSegments,  # list of arriving segments
-            'sent': 0,  # number of received segments
             'total': numSegments,  # total number of segments
-            'bitrates': [time.perf_counter_ns() / 1000.0],  # timestamps of arrival of segments
+            'stats': TransferStats('send', fileName, fileType)
         }
+        stats = self.fileToSend['stats']
 
-        self.sendMessage(f'241{fileName}\x1c{fileType}\x1c{numSegments}')
+        checksum = f'\x1c{getChecksum(fileName, fileType, FILE_PATH, offset, size):08x}' if self.check() else ''
+        self.sendMessage(f'241{fileName}\x1c{fileType}\x1c{numSegments}\x1c{size}\x1c{codec}' + checksum)
 
         # generating average bitrate
         start = None
         end = None
-        for i, s in enumerate(segments):
+        for i, (fileBytes, s) in enumerate(encodeSegments(segments, codec)):
             startS, endS, bitrate = self.sendSegment(s)
-            print(f'[{self.name}]:',
-                  f'Sending file [{fileName}.{fileType}] - ({i + 1}/{numSegments}) - {round(bitrate)} bps')
+            stats.addSegment(fileBytes, latency=endS - startS, timestamp=endS)
+            stats.addRaw(frameSize(len(s)))
+            if progress.due(i + 1, numSegments):
+                self.log.info(f'Sending file [{fileName}.{fileType}] - ({i + 1}/{numSegments}) - {round(bitrate)} bps')
 
             if not start:
                 start = startS
             end = endS
 
-        throughput = len(data) * 8 / (end - start) * 1E6
-        print(f'[{self.name}]:', f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
+        throughput = size * 8 / (end - start) * 1E6
+        self.log.info(f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
+        self.finishTransfer(stats)
+        self.fileToSend = None
 
     def sendSegment(self,  segment):
         msg = f'212'
@@ -267,50 +685,212 @@ class TcpFTPSession(Session):
         bitrate = len(segment) * 8 / durationAll * 1E6
         return startSend, endAll, bitrate
 
+    def sendStream(self, fileName, fileType, offset=0, length=None, codec=''):
+        """
+        Sends a file in streaming mode. The header gives the size of the file, then the data is written
+        as one 212 message without waiting and the client confirms the whole file with its crc32.
+        The data goes from the file to the socket with sendfile, without being copied into the process.
+        A compressed file is written as one 212 message per compressed chunk, and an empty 212 message ends it.
+
+        :param fileName: str - name of file
+        :param fileType: str - type of file
+        :param offset: int - optional - bytes at the start of the file the client already has
+        :param length: int - optional - bytes to send from the offset. up to the end of the file if not given
+        :param codec: str - optional - codec of the chunks. raw if empty
+        :sends
+        opcode  args
+        241     fileName, fileType, numSegments, size of the data sent from the offset, codec, crc32 of the data
+                sent with the 'check' option
+        212     the file data from the offset
+        """
+
+        location = FILE_PATH + "\\" + fileName + "." + fileType
+        fileSize = getFileSize(fileName, fileType, FILE_PATH)
+        size = fileSize - offset if length is None else length
+        assert 0 <= offset <= offset + size <= fileSize, "Range not in file"
+        numSegments = max(1, -(-size // self.STREAM_SEGMENT))
+
+        self.log.info(f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        progress = Progress(self.log)
+
+        # with the 'check' option the client checks the data against its crc32 before keeping it
+        crc = getChecksum(fileName, fileType, FILE_PATH, offset, size) if self.check() else None
+        self.sendMessage(f'241{fileName}\x1c{fileType}\x1c{numSegments}\x1c{size}\x1c{codec}' +
+                         (f'\x1c{crc:08x}' if crc is not None else ''))
+
+        self.fileToSend = {'name': fileName, 'type': fileType, 'stats': TransferStats('send', fileName, fileType)}
+        stats = self.fileToSend['stats']
+
+        connection = self.client['connection']
+        sentBytes = 0
+        start = time.perf_counter_ns() / 1000.0
+        if codec:
+            # the chunks are compressed ahead of the socket. sendfile cannot be used
+            segments, _, _ = streamFile(self.STREAM_SEGMENT, fileName, fileType, FILE_PATH, offset, size)
+            for i, (fileBytes, chunk) in enumerate(encodeSegments(segments, codec)):
+                connection.sendall(packFrame(b'212' + chunk))
+                sentBytes += fileBytes
+                stats.addSegment(fileBytes)
+                stats.addRaw(frameSize(len(chunk)))
+
+                bitrate = getBitrate(sentBytes, time.perf_counter_ns() / 1000.0 - start)
+                if progress.due(i + 1, numSegments):
+                    self.log.info(f'Sending file [{fileName}.{fileType}] - ({i + 1}/{numSegments}) - {round(bitrate)} bps')
+            connection.sendall(packFrame(b'212'))
+            stats.addRaw(frameSize(0))
+        else:
+            connection.sendall(frameHeader(b'212', size))
+            stats.addRaw(frameSize(0))
+            with openFile(location) as f:
+                while sentBytes < size:
+                    # sent in parts of several segments to keep reporting progress
+                    sent = connection.sendfile(f, offset + sentBytes, min(self.SENDFILE_SEGMENTS * self.STREAM_SEGMENT,
+                                                                          size - sentBytes))
+                    if not sent:
+                        raise ConnectionResetError()
+                    sentBytes += sent
+                    stats.addSegment(sent)
+                    stats.addRaw(sent)
+
+                    bitrate = getBitrate(sentBytes, time.perf_counter_ns() / 1000.0 - start)
+                    if progress.due(sentBytes * numSegments // size, numSegments):
+                        self.log.info(f'Sending file [{fileName}.{fileType}] - ({sentBytes * numSegments // size}/{numSegments}) - {round(bitrate)} bps')
+
+        # the checksum of the file is found while the client confirms the data
+        if crc is None:
+            crc = getChecksum(fileName, fileType, FILE_PATH, offset, size)
+
+        # wait for the confirmation of the whole file
+        resp = self.client['reader'].readFrame()
+        if resp is None:
+            raise ConnectionResetError()
+        end = time.perf_counter_ns() / 1000.0
+        assert resp[:3] == b'100', 'Wrong response'
+        assert resp[3:11] == bytes(f'{crc:08x}', 'utf-8'), f'File [{fileName}.{fileType}] was corrupted in transit'
+
+        throughput = size * 8 / (end - start) * 1E6
+        self.log.info(f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
+        self.finishTransfer(stats)
+        self.fileToSend = None
+
     @staticmethod
-    def port():
-        return 6001   # TCP port
+    def negotiate(options):
+        """
+        Chooses the options granted to a client from the requested ones.
+
+        :param options: dict - requested options
+            name    values          description
+            mode    ack, stream     'ack' acknowledges every segment (default). 'stream' confirms the file once
+            segment int             payload bytes per segment in 'ack' mode
+            compress zlib,lzma      codecs the client can compress and decompress segments with, by preference
+            check   crc32           the crc32 of the data is sent with every file and checked before it is kept
+        :returns dict - granted options
+        """
+        granted = {
+            'mode': 'stream' if options.get('mode') == 'stream' else 'ack',
+            'segment': chooseSegmentSize(options.get('segment'))
+        }
+        codecs = chooseCodecs(options.get('compress'))
+        if codecs:
+            granted['compress'] = codecs
+        if options.get('check') in CHECKS:
+            granted['check'] = options['check']
+        return granted
 
 
 # code for udp session by Saiid El Hajj Chehade
-class UdpFTPSession(Session):
+class UdpFTPSession(FTPSession):
     """
         UdpFTPSession handles file transfer using the UDP protocol.
+        Downloads are sent with selective repeat: up to WINDOW_SIZE segments are in flight at once.
+        The segment size starts at the negotiated one and can be raised by the client after an MTU probe.
+        With the 'check' option segments carry their crc32, and a damaged segment is asked for again with a 101
+        message instead of waiting for its timeout (see integrity.py).
         Scope of requests include:
         211 - requestReceiveFile
         212 - receiveSegment
+        213 - probeReply
+        214 - setSegmentSize
+        215 - getSignature
+        216 - receiveDelta
+        217 - linkFile
+        218 - getUploadOffset
+        219 - getFileDetails
+        230 - getFiles
+        241 - startSendFile
+        250 - getStats
+        600 - close
         """
 
-    def __init__(self):
+    def __init__(self, options=None, onOpen=None):
 
         # Constants
         self.SEPERATOR = b'\x1c'  # used to separate argument list.
+        self.SEGMENT_HEADER = 20  # bytes in front of the data of a segment datagram, with its crc32
+        self.MAX_DATAGRAM = 65535  # largest datagram that can be received
+        # bytes asked from recvfrom at least. requests naming files, like 211 and 217, can be longer than a segment
+        self.CONTROL_BUFFER = 4096
+        # options negotiated with the client
+        self.options = options or UdpFTPSession.negotiate({})
+        self.SEGMENT_SIZE = int(self.options['segment'])  # payload bytes per segment
+        # bytes asked from recvfrom. probe datagrams can be of any size until the client settles the segment size
+        self.RECEIVE_BUFFER = self.MAX_DATAGRAM
+        self.WINDOW_SIZE = UDP_WINDOW_SIZE  # maximum number of segments in flight
+        # timeout of unacknowledged messages, adapted to the round trip time of the client
+        self.timer = RetransmitTimer()
         # data relevant to the file in transit if it exists
         self.fileToReceive = None
+        # sequence numbers of the segments of the last received file. used to acknowledge late duplicates again
+        self.lastReceived = range(0)
+        # sequence number of the first segment of the next file sent. segments are numbered on from one file to the
+        # next, so a late acknowledgment of a segment of an earlier file is never taken for one of the file in transit
+        self.nextSequence = 0
         self.fileToSend = None
+        # last delta upload of the session
+        self.delta = None
+        # statistics of the last transfers of the session
+        self.transfers = deque(maxlen=10)
         # Dictionary of available commands to be requested from Client Session
         self.commands = {
             b'211': self.requestReceiveFile,
             b'212': self.receiveSegment,
+            b'215': self.getSignature,
+            b'216': self.receiveDelta,
+            b'217': self.linkFile,
+            b'218': self.getUploadOffset,
+            b'219': self.getFileDetails,
             b'230': self.getFiles,
             b'241': self.startSendFile,
+            b'213': self.probeReply,
+            b'214': self.setSegmentSize,
+            b'250': self.getStats,
             b'600': self.close
         }
-        Session.__init__(self, 'UDP FTP Session', UdpFTPSession.port(), 'UDP')
+        Session.__init__(self, 'UDP FTP Session', None, 'UDP', onOpen=onOpen)
 
     def waitClientRequest(self):
-        print(f'[{self.name}]: Available for Clients')
+        self.log.info('Available for Clients')
 
         # udp is connectionless. But we want to handle one client per session.
         # We wait for the first message and save the user address that is contacting session.
-        data, addr = self.socket.recvfrom(1024)
+        # a client that sends nothing within SESSION_ACCEPT_TIMEOUT gives the session up
+        self.socket.settimeout(SESSION_ACCEPT_TIMEOUT)
+        try:
+            data, addr = self.socket.recvfrom(self.RECEIVE_BUFFER)
+        except socket.timeout:
+            self.log.warning(f'No client message within {SESSION_ACCEPT_TIMEOUT} s')
+            self.close()
+        self.socket.settimeout(None)
         self.client = {'address': addr}
         # handle the first request
         try:
             self.onReceived(data, time.perf_counter_ns() / 1000.0)
         except AssertionError as e:
-            print(f'[{self.name}]:', e)
+            self.log.warning(e)
             self.sendMessage(f'400 ' + str(e))
+        except RetransmitLimitError as e:
+            self.log.warning(e)
+            self.close()
         # handle any subsequent requests by going to run()
         super().waitClientRequest()
 
@@ -331,34 +911,73 @@ class UdpFTPSession(Session):
             tocSend = time.perf_counter_ns()/1000.0
             tocAll = tocSend
             if waitSuccess:
-                # wait message from client
-                try:
-                    self.socket.settimeout(5)
-                    rec, addr = self.socket.recvfrom(1024)
-                    self.socket.settimeout(1000)
-                    tocAll = time.perf_counter_ns() / 1000.0
-                    # ignore all messages if not from client
-                    while addr != self.client['address']:
-                        rec, addr = self.socket.recvfrom(1024)
-                        tocAll = time.perf_counter_ns() / 1000.0
-
-                    # verify acknowledgment message
-                    if rec and rec[:3] == b'100':
-                        return ticSend, tocSend,tocAll, tocSend-ticSend, tocAll-ticSend
-                    else:
-                        ticSend, tocSend, tocAll,_, _ = self.sendMessage(data, isString=False, waitSuccess=True)
-                except Exception:
-                    # catching timeouts
-                    ticSend, tocSend, tocAll, _, _ = self.sendMessage(data, isString=False, waitSuccess=True)
+                tocAll = self.waitAcknowledgment(data, ticSend)
 
             return ticSend, tocSend,tocAll, tocSend-ticSend, tocAll-ticSend
 
+    def waitAcknowledgment(self, data, sent):
+        """
+        Waits for the client to acknowledge a message and sends it again every time the timer expires.
+        :param data: byteArray - the message sent
+        :param sent: float - time of the first send in microseconds
+        :returns float - time of the acknowledgment in microseconds
+        :raises RetransmitLimitError - when the client does not answer
+        """
+        attempts = 1
+        deadline = time.perf_counter() + self.timer.timeout()
+        try:
+            while True:
+                self.socket.settimeout(max(deadline - time.perf_counter(), 0.001))
+                try:
+                    rec, addr = self.socket.recvfrom(self.RECEIVE_BUFFER)
+                except socket.timeout:
+                    self.timer.expire()
+                    self.timer.retransmit(attempts)
+                    self.socket.sendto(data, self.client['address'])
+                    attempts += 1
+                    deadline = time.perf_counter() + self.timer.timeout()
+                    continue
+
+                # ignore all messages if not an acknowledgment from client. late acknowledgments of segments carry
+                # their sequence number
+                if addr == self.client['address'] and rec[:3] == b'100' and not rec[3:4].isdigit():
+                    received = time.perf_counter_ns() / 1000.0
+                    if attempts == 1:
+                        self.timer.sample((received - sent) / 1E6)
+                    return received
+        finally:
+            self.socket.settimeout(None)
+
+    def close(self, *args):
+        '''
+        Closes the session. A file still in transit is dropped.
+        '''
+        if self.fileToReceive:
+            self.fileToReceive['file'].discard()
+            self.fileToReceive = None
+
+        Session.close(self)
+
     def run(self):
 
         # infinite loop to read multiple requests
         while True:
-            # save the received message in data
-            data, addr = self.socket.recvfrom(1024)
+            # save the received message in data. a client that stops sending a file is waited for UDP_IDLE_TIMEOUT,
+            # a silent client for UDP_SESSION_TIMEOUT in case its 600 was lost
+            self.socket.settimeout(UDP_IDLE_TIMEOUT if self.fileToReceive else UDP_SESSION_TIMEOUT)
+            try:
+                data, addr = self.socket.recvfrom(self.RECEIVE_BUFFER)
+            except socket.timeout:
+                if not self.fileToReceive:
+                    self.log.warning(f'No message from the client for {UDP_SESSION_TIMEOUT} s')
+                    self.close()
+
+                # drop the file so the client can continue it later
+                self.log.warning(f'Client stopped sending file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}]')
+                self.fileToReceive['file'].discard()
+                self.fileToReceive = None
+                continue
+            self.socket.settimeout(None)
             timestamp = time.perf_counter_ns() / 1000.0
             if not data:
                 # close on no data
@@ -371,13 +990,16 @@ class UdpFTPSession(Session):
                     self.onReceived(data, timestamp=timestamp)
 
                 except AssertionError as e:
-                    print(f'[{self.name}]:', e)
+                    self.log.warning(e)
                     self.sendMessage(f'400 ' + str(e))
 
+                except RetransmitLimitError as e:
+                    # the client is gone
+                    self.log.warning(e)
+                    self.close()
 
-        # if connection closed wait for a new one.
-
-        return self.waitClientRequest()
+        # if connection closed close it
+        return self.close()
 
     def onReceived(self, payload, timestamp=None):
 
@@ -394,22 +1016,33 @@ class UdpFTPSession(Session):
         # parse the incoming message into the format   [opcode|args] with opcode as a 3 digit integer
         opcode, args = payload[:3], payload[3:]
 
+        # late acknowledgments of messages that were sent again, and late requests for damaged segments
+        if opcode in (b'100', b'101'):
+            return
+
         # assert the opcode is available
         assert opcode in self.commands, f'Invalid request OPCODE = "{opcode}"'
 
-        # assert waiting for a file before receiving a segment
-        assert (not self.fileToReceive) or (
-                    self.fileToReceive and opcode == b'212'), "Cannot make another request while receiving a file"
+        # the acknowledgment of the file request was lost and the client asks again
+        if opcode == b'211' and self.fileToReceive and self.fileToReceive['request'] == args:
+            self.sendMessage(f'100 file ready to be received')
+            return
+
+        # the client makes no request but 600 while it sends a file. late copies of its earlier requests, sent again
+        # or duplicated on the way, are skipped rather than refused, as a refusal ends the upload
+        if self.fileToReceive and opcode not in (b'212', b'600'):
+            self.log.info(f'Skipped request {opcode} while receiving a file')
+            return
 
         #super().onReceived(payload)
 
 
         # executing the command requested by the client
         try:
-            back = self.commands[opcode](args, timestamp)
+            self.commands[opcode](args, timestamp)
 
         except AssertionError as e:
-            print(f'[{self.name}]:', e)
+            self.log.warning(e)
             self.sendMessage(f'400 ' + str(e))
 
     def requestReceiveFile(self, args, timestamp=None):
@@ -419,11 +1052,19 @@ class UdpFTPSession(Session):
 
         :param timestamp: float - optional - time at which the data is received
         :param args: byteArray:
-            number of fields: 3
+            number of fields: 3 to 8
             index   length(chars)  name         values     description
             0       -              fileName     str        the file name of file to be received
             1       -              fileType     str        the extension of the file
-            2       -              numSegments  int>0      segmentation number
+            2       -              numSegments  int>0      segmentation number of the data sent from the offset
+            3       -              size         int>=0     optional - size of the file in bytes. needed to keep the
+                                                           data if the upload stops
+            4       -              offset       int>=0     optional - bytes kept from an earlier upload to continue from
+            5       -              codec        str        optional - granted codec the segments are compressed with
+            6       8              crc          hex        optional - crc32 of the data sent from the offset. the file
+                                                           is dropped if the data received does not match
+            7       -              first        int>=0     optional - sequence number of the first segment. 0 if
+                                                           not given
         :sends
         opcode  description
         100     manual acknowledgment of request
@@ -435,25 +1076,38 @@ class UdpFTPSession(Session):
         # split args string
         argList = args.split(self.SEPERATOR)
 
-        # make sure the number of arguments is 3
-        assert len(argList) == 3, "Expected 3 arguments: fileName, fileType, segmentsNumber"
+        # make sure the number of arguments is right
+        assert 3 <= len(argList) <= 8, "Expected 3 arguments: fileName, fileType, segmentsNumber"
 
         # parse args
-        fileName, fileType, numSegments = argList
+        fileName, fileType, numSegments = argList[:3]
         fileName, fileType, numSegments = fileName.decode('utf-8'), fileType.decode('utf-8'), int(
             numSegments.decode('utf-8'))
+        size = int(argList[3].decode('utf-8')) if len(argList) > 3 else None
+        offset = int(argList[4].decode('utf-8')) if len(argList) > 4 else 0
+        codec = argList[5].decode('utf-8') if len(argList) > 5 else ''
+        assert not codec or codec in self.codecs(), f'Codec "{codec}" not granted'
+        crc = int(argList[6], 16) if len(argList) > 6 and argList[6] else None
+        first = int(argList[7].decode('utf-8')) if len(argList) > 7 else 0
 
-        print(f'[{self.name}]:', f'Receiving file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        self.log.info(f'Receiving file [{fileName}.{fileType}] - (0/{numSegments}) ' +
+                      (f'from byte {offset} ' if offset else '') + (f'compressed with {codec}' if codec else ''))
 
         # generate file data
         self.fileToReceive = {
             'name': fileName,
             'type': fileType,
-            'segments': [None] * numSegments,  # list of arriving segments
+            'progress': Progress(self.log),  # samples the progress messages
+            # segments are written at their offset in a file preallocated for the whole file
+            'file': PartialFile(fileName, fileType, FILE_PATH, size=size, offset=offset),
+            'codec': codec,  # codec the segments are compressed with. '' if they are sent raw
+            'crc': crc,  # crc32 of the data announced by the client. None if it is not checked
+            'first': first,  # sequence number of the first segment
+            'arrived': bytearray(numSegments),  # 1 for every segment already written
             'received': 0,  # number of received segments
             'total': numSegments,  # total number of segments
-            'timestamps': [time.perf_counter_ns() / 1000.0],  # timestamps of arrival of segments
-            'rate': 0  # realtime average of bitrate
+            'stats': TransferStats('receive', fileName, fileType),
+            'request': bytes(args)  # arguments of the request, to recognize it when it is sent again
         }
 
         # manual acknowledgment
@@ -466,68 +1120,119 @@ class UdpFTPSession(Session):
 
         :param timestamp: float - optional - time at which the data is received
         :param args: byteArray:
-            number of fields: 2
+            number of fields: 2, 3 with the 'check' option
             index   length(chars)  name         values     description
-            0       -              seqNum       str        index of segment in file
-            1       -              data         bytes      binary data
+            0       -              seqNum       str        sequence number of the segment. from the first sequence
+                                                           number of the 211 request of the file
+            1       4              crc          bytes      'check' option - crc32 of the segment (see integrity.py)
+            2       -              data         bytes      binary data
         :sends
         opcode  description                        args
-        100     manual acknowledgment of segment   segment index
+        100     manual acknowledgment of segment   sequence number
+        101     the segment was damaged on the way sequence number
+        400     the data does not match the crc32 of the request. the file is dropped instead of acknowledging its
+                last segment
         """
         # example: 212001\x1cDATASEGMENT
         # args: mytext\x1ctxt -> split with \x1c -> [mytext, txt, 200]
 
-        assert self.fileToReceive is not None, "Server not expecting file"
-        assert self.fileToReceive['received'] != self.fileToReceive['total'], "Received all segments"
+        sequence, data, intact = unpackSegment(args, self.check())
+        # index of the segment in the file
+        seqNum = sequence - self.fileToReceive['first'] if self.fileToReceive and sequence is not None else None
+
+        # a damaged segment is dropped. it is asked for again unless a copy of it arrived already
+        if not intact:
+            if self.fileToReceive is not None:
+                self.fileToReceive['stats'].addCorrupted()
+                self.fileToReceive['stats'].addRaw(3 + len(args))
+                if seqNum is not None and 0 <= seqNum < self.fileToReceive['total'] and \
+                        not self.fileToReceive['arrived'][seqNum]:
+                    self.sendMessage(f'101{sequence}')
+            return
+
+        assert sequence is not None, "Expected 2 arguments: sequence number, data"
 
-        # find index of first separator
-        separateAt = args.find(self.SEPERATOR)
-        assert separateAt != -1, "Expected 2 arguments: sequence number, data"
-        # split args
-        seqNum, data = [args[:separateAt], args[separateAt+1:]]
-        seqNum = int(seqNum.decode('utf-8'))
-
-        assert seqNum < self.fileToReceive['total'], "Sequence number not in range"
-        assert self.fileToReceive['segments'][seqNum] is None, "Segment already received"
-        if self.fileToReceive['segments'][seqNum] is not None:
-            self.sendMessage(f'100{seqNum}')
+        if self.fileToReceive is None or not 0 <= seqNum < self.fileToReceive['total']:
+            # a retransmission of the last file arrived after it was completed. its acknowledgment was lost
+            if sequence in self.lastReceived:
+                self.sendMessage(f'100{sequence}')
+                return
+
+            assert self.fileToReceive is not None, "Server not expecting file"
+            # retransmissions of an earlier file that was given up are skipped
+            assert seqNum < 0, "Sequence number not in range"
+            return
+
+        # acknowledge duplicates again without saving them
+        if self.fileToReceive['arrived'][seqNum]:
+            self.fileToReceive['stats'].addRetransmit(3 + len(args))
+            self.sendMessage(f'100{sequence}')
             return
 
+        # save the segment data
+        data = decodeSegment(self.fileToReceive['codec'], data, self.SEGMENT_SIZE)
+        self.fileToReceive['file'].writeSegment(seqNum, self.fileToReceive['total'], data)
+        self.fileToReceive['arrived'][seqNum] = 1
         # increment the number of segments received
         self.fileToReceive["received"] += 1
-        # save the segment data
-        self.fileToReceive['segments'][seqNum] = data
-        # add the timestamp of arrival of segment
-        self.fileToReceive['timestamps'].append(timestamp)
 
-        self.fileToReceive['rate'] = getAverageRate(
-            sampleNumber=self.fileToReceive['received'],
-            oldAverage=self.fileToReceive['rate'],
-            newSampleSize=len(data),
-            duration=timestamp - self.fileToReceive['timestamps'][-2]
-        )
+        self.fileToReceive['stats'].addSegment(len(data), timestamp=timestamp)
+        self.fileToReceive['stats'].addRaw(3 + len(args))
 
-        print(f'[{self.name}]:',
-              f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["rate"])} bps ')
+        if self.fileToReceive['progress'].due(self.fileToReceive['received'], self.fileToReceive['total']):
+            self.log.info(f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["stats"].rate or 0)} bps ')
 
-        self.sendMessage(f'100{seqNum}')
+        if self.fileToReceive['received'] == self.fileToReceive['total']:
+            self.verifyFile()
+        self.sendMessage(f'100{sequence}')
 
         if self.fileToReceive['received'] == self.fileToReceive['total']:
-            data = compileData(self.fileToReceive['segments'])
-            writeFile(self.fileToReceive['name'], self.fileToReceive['type'], FILE_PATH, data)
+            self.fileToReceive['file'].commit()
+            self.finishTransfer(self.fileToReceive['stats'])
 
             # self.sendMessage(f'100')
-            print(f'[{self.name}]:',
-                  f'file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] Received successfully')
+            self.log.info(f'file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] Received successfully')
 
+            first = self.fileToReceive['first']
+            self.lastReceived = range(first, first + self.fileToReceive['total'])
             self.fileToReceive = None
 
-    def getFiles(self, args, timestamp = None):
-        print(f'[{self.name}]:', 'Sending File list')
-        files = json.dumps(getFileList())
-        self.sendMessage('230'+files)
+    def signaturePageBlocks(self, header):
+        """
+        :param header: bytes - the 215 header sent in front of the page
+        :returns int - number of block signatures that fit in a segment datagram with the header
+        """
+        return max(1, (self.SEGMENT_SIZE + self.SEGMENT_HEADER - len(header)) // SIGNATURE.size)
+
+    def verifyFile(self):
+        """
+        Checks the data of the file in transit against the crc32 sent by the client. A corrupted file is dropped.
+        """
+        try:
+            FTPSession.verifyFile(self)
+        except AssertionError:
+            # retransmissions of its last segment are refused too, in case the client does not get this refusal
+            self.lastReceived = range(0)
+            raise
 
     def startSendFile(self, args, timestamp = None):
+        """
+        OPCODE 241
+        Sends a file to the client.
+
+        :param args: byteArray:
+            number of fields: 1 to 3
+            index   length(chars)  name         values     description
+            0       -              fileID       int        id of the file in the file list
+            1       -              offset       int>=0     optional - bytes of the file the client already has
+            2       -              length       int>=0     optional - bytes to send from the offset, to download
+                                                           ranges of the file in parallel. up to the end if not given
+        :sends
+        opcode  args
+        241     fileName, fileType, numSegments, size of the data sent from the offset, codec. raw if empty,
+                crc32 of the data sent as 8 hex digits with the 'check' option. empty without,
+                sequence number of the first segment
+        """
 
         # example: 2411
 
@@ -535,56 +1240,223 @@ class UdpFTPSession(Session):
         assert args, "Expected 1 argument: file id"
 
         # parse args
-        fileID = int(args.decode('utf-8'))
+        argList = args.split(self.SEPERATOR)
+        fileID = int(argList[0].decode('utf-8'))
+        offset = int(argList[1].decode('utf-8')) if len(argList) > 1 else 0
+        length = int(argList[2].decode('utf-8')) if len(argList) > 2 else None
+
+        fileName, fileType = getFileInfo(fileID)
 
-        fileName, fileType, data= getFile(fileID, FILE_PATH)
+        # a compressed segment has a flag byte, so it carries one byte less of the file to fit in a datagram
+        codec = chooseCodec(self.codecs(), fileName, fileType, FILE_PATH, offset, openFile) if self.SEGMENT_SIZE > 1 else ''
+        segmentSize = self.SEGMENT_SIZE - 1 if codec else self.SEGMENT_SIZE
 
-        segments, numSegments= segmentData(1012, data)
+        segments, numSegments, size = streamFile(segmentSize, fileName, fileType, FILE_PATH, offset, length)
+        size = size - offset if length is None else length
 
-        print(f'[{self.name}]:', f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        self.log.info(f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+        progress = Progress(self.log)
 
         # generate file data
         self.fileToSend = {
             'name': fileName,
             'type': fileType,
-            'ACKS': [False] * numSegments,  # list of arriving segments
-            'sent': 0,  # number of received segments
             'total': numSegments,  # total number of segments
-            'bitrates': [time.perf_counter_ns() / 1000.0],  # timestamps of arrival of segments
+            'stats': TransferStats('send', fileName, fileType)
         }
 
-        self.sendMessage(f'241{fileName}\x1c{fileType}\x1c{numSegments}', waitSuccess=True)
+        checksum = f'{getChecksum(fileName, fileType, FILE_PATH, offset, size):08x}' if self.check() else ''
+        first = self.nextSequence
+        self.nextSequence += numSegments
+        self.sendMessage(f'241{fileName}\x1c{fileType}\x1c{numSegments}\x1c{size}\x1c{codec}' +
+                         f'\x1c{checksum}\x1c{first}', waitSuccess=True)
 
-        start = None
-        end = None
-        for i, s in enumerate(segments):
-            startS, endS, bitrate = self.sendSegment(i, s)
-            print(f'[{self.name}]:', f'Sending file [{fileName}.{fileType}] - ({i+1}/{numSegments}) - {round(bitrate)} bps')
+        def onAcknowledged(index, done, bitrate):
+            if progress.due(done, numSegments):
+                self.log.info(f'Sending file [{fileName}.{fileType}] - ({done}/{numSegments}) - {round(bitrate)} bps')
 
-            if not start:
-                start = startS
-            end = endS
+        start, end = self.sendWindow(encodeSegments(segments, codec), numSegments, first, onAcknowledged,
+                                     self.fileToSend['stats'])
 
-        throughput = len(data)*8/(end-start)*1E6
-        print(f'[{self.name}]:', f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
+        throughput = size*8/(end-start)*1E6
+        self.log.info(f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
+        self.finishTransfer(self.fileToSend['stats'])
+        self.fileToSend = None
 
-    def sendSegment(self,index, segment):
-        msg = f'212{index}\x1c'
-        startSend, endSend, endAll, durationSend, durationAll = self.sendMessage(bytes(msg,'utf-8')+segment,isString=False, waitSuccess=True)
-        bitrate = len(segment)*8/durationAll*1E6
-        return startSend, endAll, bitrate
+    def sendWindow(self, segments, numSegments, first, onAcknowledged, stats):
+        """
+        Sends the segments with selective repeat.
+        Up to WINDOW_SIZE segments are in flight and each one is sent again on its own when its acknowledgment times out,
+        or right away when the client got it damaged.
+        The timeout follows the round trip times of the segments sent once.
+        Segments carry their sequence number, and so do their acknowledgments. Acknowledgments of segments that are
+        not in flight, like the other copies of a segment sent again or segments of an earlier file, are skipped.
+
+        :param segments: iterator - (file bytes, payload) of every segment of the file
+        :param numSegments: int - number of segments in the iterator
+        :param first: int - sequence number of the first segment
+        :param onAcknowledged: function(index, done, bitrate) - called for every newly acknowledged segment
+        :param stats: TransferStats - statistics of the transfer
+        :returns (float, float) - time of the first send and of the last acknowledgment in microseconds
+        """
 
+        # sequence number -> [message, time of first send, time of last send, segment size, attempts]
+        inFlight = {}
+        nextIndex = 0
+        done = 0
+        start = end = time.perf_counter_ns() / 1000.0
+
+        try:
+            while done < numSegments:
+                # fill the window
+                while len(inFlight) < self.WINDOW_SIZE and nextIndex < numSegments:
+                    size, segment = next(segments)
+                    message = packSegment(first + nextIndex, segment, self.check())
+                    self.socket.sendto(message, self.client['address'])
+                    stats.addRaw(len(message))
+                    sent = time.perf_counter_ns() / 1000.0
+                    inFlight[first + nextIndex] = [message, sent, sent, size, 1]
+                    nextIndex += 1
+
+                # wait for an acknowledgment until the oldest segment in flight times out
+                timeout = self.timer.timeout() * 1E6
+                oldest = min(entry[2] for entry in inFlight.values())
+                remaining = oldest + timeout - time.perf_counter_ns() / 1000.0
+                self.socket.settimeout(max(remaining / 1E6, 0.001))
+
+                try:
+                    rec, addr = self.socket.recvfrom(self.RECEIVE_BUFFER)
+                except socket.timeout:
+                    self.timer.expire()
+                    stats.addTimeout()
+                    # send again only the segments that timed out
+                    now = time.perf_counter_ns() / 1000.0
+                    for entry in inFlight.values():
+                        if now - entry[2] >= timeout:
+                            self.timer.retransmit(entry[4])
+                            self.socket.sendto(entry[0], self.client['address'])
+                            stats.addRetransmit(len(entry[0]))
+                            entry[2] = now
+                            entry[4] += 1
+                    continue
+
+                now = time.perf_counter_ns() / 1000.0
+
+                # ignore all messages that are not segment acknowledgments from the client
+                if addr != self.client['address'] or rec[:3] not in (b'100', b'101'):
+                    continue
+                try:
+                    sequence = int(rec[3:].decode('utf-8'))
+                except ValueError:
+                    continue
+
+                # already acknowledged, or a segment of an earlier file
+                entry = inFlight.get(sequence)
+                if entry is None:
+                    continue
+
+                if rec[:3] == b'101':
+                    # the segment was damaged on the way. only this segment is sent again, the timer keeps running
+                    self.timer.retransmit(entry[4])
+                    self.socket.sendto(entry[0], self.client['address'])
+                    stats.addRetransmit(len(entry[0]))
+                    stats.addCorrupted()
+                    entry[2] = now
+                    entry[4] += 1
+                    continue
+
+                _, sent, _, size, attempts = inFlight.pop(sequence)
+                done += 1
+                end = now
+                if attempts == 1:
+                    self.timer.sample((now - sent) / 1E6)
+                stats.addSegment(size, latency=now - sent, timestamp=now)
+                onAcknowledged(sequence - first, done, getBitrate(size, now - sent))
+        finally:
+            self.socket.settimeout(None)
+
+        return start, end
+
+    def probeReply(self, args, timestamp=None):
+        """
+        OPCODE 213
+        Answers an MTU probe of the client. The probe is padded to the datagram size being tested.
+
+        :param args: byteArray:
+            number of fields: 2
+            index   length(chars)  name         values     description
+            0       -              size         int        size of the probe datagram
+            1       -              padding      bytes      filler up to the size
+        :sends
+        opcode  args
+        213     size of the probe that arrived
+        """
+        size = args.split(self.SEPERATOR, 1)[0]
+        self.sendMessage(b'213' + size, isString=False)
+
+    def setSegmentSize(self, args, timestamp=None):
+        """
+        OPCODE 214
+        Sets the segment size of the session, usually after the client found the largest datagram with MTU probes.
+        Receive buffers are sized to match.
+
+        :param args: byteArray:
+            number of fields: 1
+            index   length(chars)  name         values     description
+            0       -              segmentSize  int>0      requested payload bytes per segment
+        :sends
+        opcode  args
+        214     granted segment size
+        """
+        assert args, "Expected 1 argument: segment size"
+
+        self.SEGMENT_SIZE = chooseSegmentSize(args.decode('utf-8'))
+        self.RECEIVE_BUFFER = max(self.CONTROL_BUFFER, self.SEGMENT_SIZE + self.SEGMENT_HEADER)
+
+        # let the kernel hold a whole window of segments
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.WINDOW_SIZE * self.RECEIVE_BUFFER)
+
+        self.log.info(f'Segment size set to {self.SEGMENT_SIZE} bytes')
+        self.sendMessage(f'214{self.SEGMENT_SIZE}')
 
     @staticmethod
-    def port():
-        return 6000   # UDP port
+    def negotiate(options):
+        """
+        Chooses the options granted to a client from the requested ones.
+
+        :param options: dict - requested options
+            name    values          description
+            segment int             payload bytes per segment
+            compress zlib,lzma      codecs the client can compress and decompress segments with, by preference
+            check   crc32           every segment carries its crc32 and the crc32 of the data is sent with every
+                                    file and checked before it is kept
+        :returns dict - granted options
+        """
+        granted = {'segment': chooseSegmentSize(options.get('segment'))}
+        codecs = chooseCodecs(options.get('compress'))
+        if codecs:
+            granted['compress'] = codecs
+        if options.get('check') in CHECKS:
+            granted['check'] = options['check']
+        return granted
 
 
-def getBitrate(dataSize, duration):
-    bits = dataSize * 8
-    return bits / duration * 1E6
+def chooseSegmentSize(requested):
+    """
+    Grants a segment size to a client.
+    :param requested: str - requested payload bytes per segment. None for the default
+    :returns int - SEGMENT_SIZE if nothing valid was requested, else the request capped to MAX_SEGMENT_SIZE
+    """
+    try:
+        return max(1, min(int(requested), MAX_SEGMENT_SIZE))
+    except (TypeError, ValueError):
+        return SEGMENT_SIZE
 
-def getAverageRate(sampleNumber, oldAverage, newSampleSize, duration):
-        newRate = getBitrate(newSampleSize, duration )
-        #return (sampleNumber - 1) * 1.0 / sampleNumber * oldAverage + newRate / sampleNumber
-        return newRate
+
+def chooseCodecs(requested):
+    """
+    Grants compression codecs to a client.
+    :param requested: str - comma separated codecs asked by the client, by preference. None for none
+    :returns str - the requested codecs the server compresses with, in the same order
+    """
+    return ','.join(codec for codec in (requested or '').split(',') if codec in CODECS and codec in COMPRESSION_CODECS)
@@ -0,0 +1,818 @@
+import asyncio
+import json
+import time
+from collections import deque
+from file import PartialFile, getFileList, getFileInfo, streamFile, getCacheStats, getPartialSize, \
+    getFileSize, getSignature, receiveDelta, linkFile
+from config import FILE_PATH, HOST_IP, TCP_FTP_PORT, UDP_FTP_PORT, SEGMENT_SIZE, UDP_IDLE_TIMEOUT, MAX_DELTA_SIZE, \
+    UDP_SESSION_TIMEOUT
+from .session import parseOptions, formatOptions
+from .FTP import chooseSegmentSize
+from delta import SIGNATURE
+from framing import packFrame, readFrameAsync
+from log import getLogger, Progress
+from stats import TransferStats
+from rto import RetransmitTimer, RetransmitLimitError
+
+
+# code for the asyncio server engine by Saiid El Hajj Chehade
+
+class AsyncSession:
+    '''
+    AsyncSession is the base class for the sessions of the asyncio engine.
+    It runs the opcodes of the blocking sessions as coroutines so a single thread can multiplex all clients.
+    Its FTP sessions implement fewer options: they send in 'ack' mode, raw and unchecked, one segment at a time. The
+    210 reply lists the options granted, so clients asking for more know they were not granted.
+    Children:
+    [AsyncClientSession]
+    [AsyncTcpFTPSession]
+    [AsyncUdpFTPSession]
+    '''
+
+    def __init__(self, name, address):
+        '''
+        :param name: str - name of the session object.
+        :param address: tuple - address of the serviced client
+        '''
+        self.name = name
+        self.log = getLogger(name)
+        self.client = {'address': address}
+        self.SEPERATOR = b'\x1c'  # used to separate argument list.
+        self.commands = {}
+
+    async def onReceived(self, payload, timestamp=None):
+        """
+        Handle the received message from the client.
+        Parses the received message and runs the coroutine of its opcode.
+        :param timestamp: float - optional - the time of arrival of message
+        :param payload: byteArray - the received request
+        """
+
+        try:
+            # assert payload contains 3 digit opcode
+            assert len(payload) >= 3, "Invalid request length"
+
+            # parse the incoming message into the format   [opcode|args] with opcode as a 3 digit integer
+            opcode, args = payload[:3], payload[3:]
+
+            # assert the opcode is available
+            assert opcode in self.commands, f'Invalid request OPCODE = "{opcode}"'
+
+            await self.commands[opcode](args, timestamp)
+
+        except (AssertionError, ValueError) as e:
+            # ValueError: a number field of the request is not a number
+            self.log.warning(e)
+            await self.sendMessage(f'400 ' + str(e))
+
+    async def sendMessage(self, message, isString=True, waitSuccess=False):
+        pass
+
+
+class AsyncClientSession(AsyncSession):
+    """
+    Asyncio version of ClientSession. One object per control connection.
+    Scope of requests include:
+    210 - startFTPSession
+    222 - keepAlive
+    """
+
+    def __init__(self, reader, writer):
+        AsyncSession.__init__(self, 'Client Session', writer.get_extra_info('peername'))
+        self.reader = reader
+        self.writer = writer
+        self.commands = {
+            b'210': self.startFTPSession,
+            b'222': self.keepAlive
+        }
+
+    async def sendMessage(self, message, isString=True, waitSuccess=False):
+        """
+        Sends a message to the client.
+        :param waitSuccess: bool - wait for client for acknowledgment on message
+        :param message: str - the payload of the message to be sent
+        """
+        self.writer.write(packFrame(bytes(message, 'utf-8')))
+        await self.writer.drain()
+
+        if waitSuccess:
+            data = await readFrameAsync(self.reader)
+            if data is None:
+                raise ConnectionResetError()
+            assert data[:3] == b'100', 'Wrong response'
+
+    async def run(self):
+        self.log.info(f'Connected - Client = {self.client["address"]}')
+
+        try:
+            while True:
+                data = await readFrameAsync(self.reader)
+                if not data:
+                    # close on no data
+                    break
+
+                await self.onReceived(data)
+
+        except ConnectionResetError:
+            # is triggered if the connection is closed remotely
+            pass
+
+        finally:
+            self.writer.close()
+
+        self.log.info(f'Client Ended Connection - {self.client["address"]}')
+
+    # OPCODE 210
+    async def startFTPSession(self, args, timestamp=None):
+        """
+        OPCODE 210
+        Points the client to the shared FTP endpoint of the requested type.
+        All FTP sessions of the asyncio engine are multiplexed on the same endpoint.
+
+        :param args: byteArray:
+            number of fields: 1 or more
+            index   length(chars)  name      values                  description
+            0       1              connType  0 for TCP, 1 for UDP    specifies the type of the FTPSession to be opened
+            1..     -              options   key=value               optional - requested session options
+
+        :sends
+        opcode  args
+        210     port number of FTP server followed by the granted options
+        400     error in fetching FTP server type
+        """
+
+        # definitions
+        FTPSession = {
+            b'0': AsyncTcpFTPSession,
+            b'1': AsyncUdpFTPSession
+        }
+
+        # extracting args
+        typeCode = args[0:1]
+
+        if typeCode not in FTPSession:
+            await self.sendMessage(f'400 Session Type invalid. possible values 0 -> TCP, 1 ->UDP.')
+            return
+
+        # the options of the engine are granted whatever was asked, so the client knows what it gets
+        options = FTPSession[typeCode].negotiate(parseOptions(args[2:]))
+        await self.sendMessage(f'210{FTPSession[typeCode].port()}' + formatOptions(options), waitSuccess=True)
+
+    # OPCODE 222
+    async def keepAlive(self, args, timestamp=None):
+        """
+        OPCODE 222
+        :sends
+        opcode  description
+        222     connection still available
+        """
+        await self.sendMessage(f'222 Connection Available')
+
+
+class AsyncFTPSession(AsyncSession):
+    """
+    Shared file operations of the asyncio FTP sessions.
+    Scope of requests include:
+    211 - requestReceiveFile
+    212 - receiveSegment
+    215 - getSignature
+    216 - receiveDelta
+    217 - linkFile
+    218 - getUploadOffset
+    219 - getFileDetails
+    230 - getFiles
+    241 - startSendFile
+    250 - getStats
+    """
+
+    def __init__(self, name, address):
+        AsyncSession.__init__(self, name, address)
+
+        # data relevant to the file in transit if it exists
+        self.fileToReceive = None
+        self.fileToSend = None
+        # last delta upload of the session
+        self.delta = None
+        # bytes of block signatures sent at once for a delta upload
+        self.SIGNATURE_PAGE = 1024 * 1024
+        # statistics of the last transfers of the session
+        self.transfers = deque(maxlen=10)
+        # timeout of unacknowledged messages. only UDP sessions retransmit
+        self.timer = None
+        # payload bytes per segment of the files sent
+        self.SEGMENT_SIZE = SEGMENT_SIZE
+        # sequence numbers of the segments of the last received file. used to acknowledge late duplicates again
+        self.lastReceived = range(0)
+        # sequence number of the first segment of the next file sent (see UdpFTPSession)
+        self.nextSequence = 0
+        self.commands = {
+            b'211': self.requestReceiveFile,
+            b'212': self.receiveSegment,
+            b'215': self.getSignature,
+            b'216': self.receiveDelta,
+            b'217': self.linkFile,
+            b'218': self.getUploadOffset,
+            b'219': self.getFileDetails,
+            b'230': self.getFiles,
+            b'241': self.startSendFile,
+            b'250': self.getStats
+        }
+
+    async def onReceived(self, payload, timestamp=None):
+        # only segments are accepted while a file is being received
+        if self.fileToReceive and payload[:3] != b'212':
+            self.log.info("Cannot make another request while receiving a file")
+            await self.sendMessage('400 Cannot make another request while receiving a file')
+            return
+
+        await AsyncSession.onReceived(self, payload, timestamp)
+
+    async def requestReceiveFile(self, args, timestamp=None):
+        """
+        OPCODE 211
+        Initiates receiving a new file procedure. Same arguments as TcpFTPSession.requestReceiveFile
+        """
+
+        # split args string
+        argList = args.split(self.SEPERATOR)
+
+        # make sure the number of arguments is right
+        assert 3 <= len(argList) <= 8, "Expected 3 arguments: fileName, fileType, segmentsNumber"
+        # no compression or check option is granted by this engine
+        assert len(argList) < 6 or not argList[5], "Compression not granted"
+        assert len(argList) < 7 or not argList[6], "Check not granted"
+
+        # parse args
+        fileName, fileType, numSegments = argList[:3]
+        fileName, fileType, numSegments = fileName.decode('utf-8'), fileType.decode('utf-8'), int(
+            numSegments.decode('utf-8'))
+        size = int(argList[3].decode('utf-8')) if len(argList) > 3 else None
+        offset = int(argList[4].decode('utf-8')) if len(argList) > 4 else 0
+        first = int(argList[7].decode('utf-8')) if len(argList) > 7 else 0
+
+        self.log.info(f'Receiving file [{fileName}.{fileType}] - (0/{numSegments}) ' +
+                      (f'from byte {offset} ' if offset else ''))
+
+        # generate file data
+        self.fileToReceive = {
+            'name': fileName,
+            'type': fileType,
+            'progress': Progress(self.log),  # samples the progress messages
+            # segments are written at their offset in a file preallocated for the whole file
+            'file': await asyncio.to_thread(PartialFile, fileName, fileType, FILE_PATH, size, offset),
+            'first': first,  # sequence number of the first segment
+            'arrived': bytearray(numSegments),  # 1 for every segment already written
+            'received': 0,  # number of received segments
+            'total': numSegments,  # total number of segments
+            'stats': TransferStats('receive', fileName, fileType),
+            'request': bytes(args)  # arguments of the request, to recognize it when it is sent again
+        }
+
+    async def storeSegment(self, seqNum, data, timestamp):
+        """
+        Saves a received segment and writes the file once all segments arrived.
+        :param seqNum: int - index of the segment in the file
+        :param data: bytes - the segment data
+        :param timestamp: float - time at which the segment was received
+        """
+
+        # save the segment data. disk work is done off the event loop
+        self.fileToReceive['arrived'][seqNum] = 1
+        await asyncio.to_thread(self.fileToReceive['file'].writeSegment, seqNum, self.fileToReceive['total'], data)
+        # increment the number of segments received
+        self.fileToReceive['received'] += 1
+
+        self.fileToReceive['stats'].addSegment(len(data), timestamp=timestamp)
+        self.fileToReceive['stats'].addRaw(len(data))
+
+        if self.fileToReceive['progress'].due(self.fileToReceive['received'], self.fileToReceive['total']):
+            self.log.info(f'Receiving file [{self.fileToReceive["name"]}.{self.fileToReceive["type"]}] - ({self.fileToReceive["received"]}/{self.fileToReceive["total"]}) - {round(self.fileToReceive["stats"].rate or 0)} bps ')
+
+        if self.fileToReceive['received'] == self.fileToReceive['total']:
+            fileToReceive, self.fileToReceive = self.fileToReceive, None
+            first = fileToReceive['first']
+            self.lastReceived = range(first, first + fileToReceive['total'])
+
+            await asyncio.to_thread(fileToReceive['file'].commit)
+            self.finishTransfer(fileToReceive['stats'])
+
+            self.log.info(f'file [{fileToReceive["name"]}.{fileToReceive["type"]}] Received successfully')
+
+    async def dropFile(self):
+        """
+        Drops the file in transit if the client left in the middle of it.
+        """
+        if self.fileToReceive:
+            fileToReceive, self.fileToReceive = self.fileToReceive, None
+            await asyncio.to_thread(fileToReceive['file'].discard)
+
+    async def linkFile(self, args, timestamp=None):
+        """
+        OPCODE 217
+        Adds a file without receiving its data when the server has a file with the same content already. Same
+        arguments as TcpFTPSession.linkFile
+        """
+        argList = args.split(self.SEPERATOR)
+        assert len(argList) == 4, "Expected 4 arguments: fileName, fileType, size, digest"
+
+        fileName, fileType, digest = argList[0].decode('utf-8'), argList[1].decode('utf-8'), argList[3].decode('utf-8')
+        # files of the same size are hashed off the event loop
+        linked = await asyncio.to_thread(linkFile, fileName, fileType, FILE_PATH, int(argList[2]), digest)
+        if linked:
+            self.log.info(f'file [{fileName}.{fileType}] Added from the content of a file already on the server')
+
+        await self.sendMessage(f'217{int(linked)}')
+
+    async def getUploadOffset(self, args, timestamp=None):
+        """
+        OPCODE 218
+        Finds where an interrupted upload of a file can continue from. Same arguments as
+        TcpFTPSession.getUploadOffset
+        """
+        argList = args.split(self.SEPERATOR)
+        assert len(argList) == 3, "Expected 3 arguments: fileName, fileType, size"
+
+        fileName, fileType, size = argList[0].decode('utf-8'), argList[1].decode('utf-8'), int(argList[2])
+        await self.sendMessage(f'218{getPartialSize(fileName, fileType, FILE_PATH, size)}')
+
+    async def getSignature(self, args, timestamp=None):
+        """
+        OPCODE 215
+        Sends the block signature of a file in pages of SIGNATURE_PAGE bytes. Same arguments as
+        TcpFTPSession.getSignature
+        """
+        argList = args.split(self.SEPERATOR)
+        assert len(argList) == 3, "Expected 3 arguments: fileName, fileType, firstBlock"
+
+        fileName, fileType, first = argList[0].decode('utf-8'), argList[1].decode('utf-8'), int(argList[2])
+        # the signature is computed off the event loop
+        blockSize, size, signature = await asyncio.to_thread(getSignature, fileName, fileType, FILE_PATH)
+        numBlocks = len(signature) // SIGNATURE.size
+
+        header = bytes(f'215{blockSize}\x1c{size}\x1c{numBlocks}\x1c{MAX_DELTA_SIZE}\x1c{first}\x1c', 'utf-8')
+        pageBlocks = max(1, (self.SIGNATURE_PAGE - len(header)) // SIGNATURE.size)
+        page = signature[first * SIGNATURE.size:(first + pageBlocks) * SIGNATURE.size]
+        await self.sendMessage(header + page, isString=False)
+
+    async def receiveDelta(self, args, timestamp=None):
+        """
+        OPCODE 216
+        Receives a piece of the delta of a new version of a file. Same arguments as TcpFTPSession.receiveDelta
+        """
+        argList = args.split(self.SEPERATOR, 6)
+        assert len(argList) == 7, "Expected 7 arguments: fileName, fileType, blockSize, digest, size, offset, data"
+
+        fileName, fileType, digest = argList[0].decode('utf-8'), argList[1].decode('utf-8'), argList[3].decode('utf-8')
+        blockSize, size, offset = int(argList[2]), int(argList[4]), int(argList[5])
+        assert size <= MAX_DELTA_SIZE, f'Delta bigger than {MAX_DELTA_SIZE} bytes'
+
+        # the new version is built off the event loop
+        done = self.delta is not None and self.delta.done
+        self.delta = await asyncio.to_thread(receiveDelta, self.delta, fileName, fileType, FILE_PATH, blockSize,
+                                             digest, size, offset, bytes(argList[6]))
+        if self.delta.done and not done:
+            self.log.info(f'file [{fileName}.{fileType}] Updated from a delta of {size} bytes')
+
+        await self.sendMessage(f'216{len(self.delta.data)}')
+
+    async def getFileDetails(self, args, timestamp=None):
+        """
+        OPCODE 219
+        Describes a file of the file list. Same arguments as TcpFTPSession.getFileDetails
+        """
+        assert args, "Expected 1 argument: file id"
+
+        fileName, fileType = await asyncio.to_thread(getFileInfo, int(args.decode('utf-8')))
+        size = await asyncio.to_thread(getFileSize, fileName, fileType, FILE_PATH)
+        await self.sendMessage(f'219{fileName}\x1c{fileType}\x1c{size}')
+
+    async def getFiles(self, args, timestamp=None):
+        self.log.info('Sending File list')
+        files = json.dumps(await asyncio.to_thread(getFileList))
+        await self.sendMessage('230' + files)
+
+    async def getStats(self, args, timestamp=None):
+        """
+        OPCODE 250
+        Sends the statistics of the transfers of the session. Same reply as TcpFTPSession.getStats, and as
+        UdpFTPSession.getStats for UDP sessions
+        """
+        self.log.info('Sending transfer statistics')
+        current = self.fileToReceive or self.fileToSend
+        stats = {
+            'transfers': list(self.transfers),
+            'current': current['stats'].summary() if current else None,
+            'cache': getCacheStats()
+        }
+        if self.timer:
+            stats['timer'] = self.timer.summary()
+        await self.sendMessage('250' + json.dumps(stats))
+
+    def finishTransfer(self, stats):
+        """
+        Adds the statistics of a finished transfer to the history of the session.
+        :param stats: TransferStats - statistics of the transfer
+        """
+        stats.finish()
+        self.transfers.append(stats.summary())
+
+    async def startSendFile(self, args, timestamp=None):
+        """
+        OPCODE 241
+        Sends a file to the client. Same arguments as TcpFTPSession.startSendFile
+        """
+
+        # make sure args exist
+        assert args, "Expected 1 argument: file id"
+
+        # parse args
+        argList = args.split(self.SEPERATOR)
+        fileID = int(argList[0].decode('utf-8'))
+        offset = int(argList[1].decode('utf-8')) if len(argList) > 1 else 0
+        length = int(argList[2].decode('utf-8')) if len(argList) > 2 else None
+
+        fileName, fileType = await asyncio.to_thread(getFileInfo, fileID)
+
+        segments, numSegments, size = await asyncio.to_thread(streamFile, self.SEGMENT_SIZE, fileName, fileType,
+                                                              FILE_PATH, offset, length)
+        size = size - offset if length is None else length
+
+        self.log.info(f'Sending file [{fileName}.{fileType}] - (0/{numSegments}) ')
+
+        # files are always sent raw. no compression option is granted by this engine
+        first = await self.sendHeader(f'241{fileName}\x1c{fileType}\x1c{numSegments}\x1c{size}\x1c', numSegments)
+
+        self.fileToSend = {'name': fileName, 'type': fileType, 'stats': TransferStats('send', fileName, fileType)}
+        stats = self.fileToSend['stats']
+
+        start = time.perf_counter_ns() / 1000.0
+        for i in range(numSegments):
+            # segments are read from disk off the event loop
+            segment = await asyncio.to_thread(next, segments)
+            sent = time.perf_counter_ns() / 1000.0
+            await self.sendSegment(first + i, segment)
+            acknowledged = time.perf_counter_ns() / 1000.0
+            stats.addSegment(len(segment), latency=acknowledged - sent, timestamp=acknowledged)
+            stats.addRaw(len(segment))
+
+        throughput = size * 8 / (time.perf_counter_ns() / 1000.0 - start) * 1E6
+        self.log.info(f'Finished Sending file [{fileName}.{fileType}] - throughput: {throughput} bps')
+        self.finishTransfer(stats)
+        self.fileToSend = None
+
+    async def sendHeader(self, message, numSegments):
+        """
+        Sends the 241 reply of a file.
+        :returns int - sequence number of the first segment
+        """
+        pass
+
+    async def sendSegment(self, sequence, segment):
+        pass
+
+
+class AsyncTcpFTPSession(AsyncFTPSession):
+    """
+    Asyncio version of TcpFTPSession. One object per connection on the shared TCP endpoint.
+    Messages are framed like the blocking sessions (see framing.py).
+    """
+
+    def __init__(self, reader, writer):
+        AsyncFTPSession.__init__(self, 'TCP FTP Session', writer.get_extra_info('peername'))
+        self.reader = reader
+        self.writer = writer
+
+    async def sendMessage(self, message, isString=True, waitSuccess=False):
+        """
+        Sends a message to the client.
+        :param waitSuccess: bool - wait for client for acknowledgment on message
+        :param message: byteArray - the payload of the message to be sent
+        :param isString: bool - specify if message is utf-8 encoded
+        """
+        data = message.encode('utf-8') if isString else message
+
+        self.writer.write(packFrame(data))
+        await self.writer.drain()
+
+        if waitSuccess:
+            resp = await readFrameAsync(self.reader)
+            if resp is None:
+                raise ConnectionResetError()
+            assert resp[:3] == b'100', 'Wrong response'
+
+    async def run(self):
+        self.log.info(f'Connected - Client = {self.client["address"]}')
+
+        try:
+            while True:
+                data = await readFrameAsync(self.reader)
+                timestamp = time.perf_counter_ns() / 1000.0
+                if not data:
+                    # close on no data
+                    break
+
+                await self.onReceived(data, timestamp)
+
+        except ConnectionResetError:
+            pass
+
+        finally:
+            self.writer.close()
+            await self.dropFile()
+
+        self.log.info(f'Client Ended Connection - {self.client["address"]}')
+
+    async def receiveSegment(self, args, timestamp=None):
+        """
+        OPCODE 212
+        Receives the next segment of file data. Same arguments as TcpFTPSession.receiveSegment
+        """
+        assert self.fileToReceive is not None, "Server not expecting file"
+        assert self.fileToReceive['received'] != self.fileToReceive['total'], "Received all segments"
+
+        # the segment is on disk before it is acknowledged
+        await self.storeSegment(self.fileToReceive['received'], args, timestamp)
+        await self.sendMessage('100 received')
+
+    async def sendHeader(self, message, numSegments):
+        await self.sendMessage(message)
+        return 0
+
+    async def sendSegment(self, sequence, segment):
+        await self.sendMessage(b'212' + segment, isString=False, waitSuccess=True)
+
+    @staticmethod
+    def port():
+        return TCP_FTP_PORT
+
+    @staticmethod
+    def negotiate(options):
+        """
+        Grants the options of the engine to a client. Unlike TcpFTPSession.negotiate the requested options are not
+        looked at: files are sent in 'ack' mode, raw and unchecked, in segments of SEGMENT_SIZE bytes.
+
+        :param options: dict - requested options
+        :returns dict - granted options
+        """
+        return {'mode': 'ack', 'segment': SEGMENT_SIZE}
+
+
+class AsyncUdpFTPSession(AsyncFTPSession):
+    """
+    Asyncio version of UdpFTPSession. One object per client address on the shared UDP endpoint.
+    Datagrams of the client are queued by the endpoint and consumed by the run coroutine.
+    Scope of requests include the FTP requests and:
+    213 - probeReply
+    214 - setSegmentSize
+    600 - close
+    """
+
+    def __init__(self, endpoint, address):
+        AsyncFTPSession.__init__(self, 'UDP FTP Session', address)
+        self.endpoint = endpoint
+        self.inbox = asyncio.Queue()
+        self.commands[b'213'] = self.probeReply
+        self.commands[b'214'] = self.setSegmentSize
+        self.commands[b'600'] = self.close
+        self.closed = False
+        self.timer = RetransmitTimer()
+        # a page of signatures fits in a segment datagram, with its header
+        self.SIGNATURE_PAGE = SEGMENT_SIZE + 16
+
+    async def sendMessage(self, message, isString=True, waitSuccess=False, sequence=None):
+        """
+        Sends a message to the client. Retransmits until acknowledged when waitSuccess is set, with the timeout of
+        the session timer.
+        :param waitSuccess: bool - wait for client for acknowledgment on message
+        :param message: byteArray - the payload of the message to be sent
+        :param isString: bool - specify if message is utf-8 encoded
+        :param sequence: int - optional - sequence number of the segment in the message. its acknowledgment carries it
+        """
+        ack = bytes(f'100{sequence}', 'utf-8') if sequence is not None else None
+        data = message.encode('utf-8') if isString else message
+
+        self.endpoint.transport.sendto(data, self.client['address'])
+        if not waitSuccess:
+            return
+
+        sent = time.perf_counter()
+        deadline = sent + self.timer.timeout()
+        attempts = 1
+        while True:
+            try:
+                rec, _ = await asyncio.wait_for(self.inbox.get(), timeout=max(deadline - time.perf_counter(), 0))
+            except asyncio.TimeoutError:
+                self.timer.expire()
+                self.timer.retransmit(attempts)
+                if self.fileToSend:
+                    self.fileToSend['stats'].addTimeout()
+                    self.fileToSend['stats'].addRetransmit(len(data))
+
+                self.endpoint.transport.sendto(data, self.client['address'])
+                attempts += 1
+                deadline = time.perf_counter() + self.timer.timeout()
+                continue
+
+            if rec[:3] != b'100':
+                continue
+
+            # segments are acknowledged with their sequence number, other messages with a text. late acknowledgments
+            # of earlier segments are skipped
+            acknowledged = rec == ack if ack is not None else not rec[3:].isdigit()
+            if not acknowledged:
+                continue
+
+            if attempts == 1:
+                self.timer.sample(time.perf_counter() - sent)
+            return
+
+    async def run(self):
+        self.log.info(f'Connected - Client = {self.client["address"]}')
+
+        try:
+            while not self.closed:
+                # a client that stops sending a file is waited for UDP_IDLE_TIMEOUT, a silent client for
+                # UDP_SESSION_TIMEOUT
+                try:
+                    data, timestamp = await asyncio.wait_for(
+                        self.inbox.get(), timeout=UDP_IDLE_TIMEOUT if self.fileToReceive else UDP_SESSION_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if not self.fileToReceive:
+                        # the client left without its 600 reaching the server, or never was a client
+                        self.log.warning(f'No message from the client for {UDP_SESSION_TIMEOUT} s')
+                        await self.close()
+                        break
+
+                    # drop the file so the client can continue it later
+                    self.log.warning(f'Client stopped sending file '
+                                     f'[{self.fileToReceive["name"]}.{self.fileToReceive["type"]}]')
+                    await self.dropFile()
+                    continue
+                try:
+                    await self.onReceived(data, timestamp)
+                except RetransmitLimitError as e:
+                    # the client is gone
+                    self.log.warning(e)
+                    await self.close()
+        finally:
+            # the address is freed however the session ended, so a later datagram of the client opens a new session
+            # instead of waiting in this inbox
+            if self.endpoint.sessions.get(self.client['address']) is self:
+                del self.endpoint.sessions[self.client['address']]
+            await self.dropFile()
+
+        self.log.info(f'Client Ended Connection - {self.client["address"]}')
+
+    async def close(self, *args):
+        self.closed = True
+        await self.dropFile()
+        self.endpoint.sessions.pop(self.client['address'], None)
+
+    async def onReceived(self, payload, timestamp=None):
+        # late acknowledgments of messages that were sent again
+        if payload[:3] == b'100':
+            return
+
+        # the acknowledgment of the file request was lost and the client asks again
+        if payload[:3] == b'211' and self.fileToReceive and self.fileToReceive['request'] == payload[3:]:
+            await self.sendMessage(f'100 file ready to be received')
+            return
+
+        # late copies of earlier requests of the client are skipped rather than refused (see UdpFTPSession)
+        if self.fileToReceive and payload[:3] not in (b'212', b'600'):
+            self.log.info(f'Skipped request {payload[:3]} while receiving a file')
+            return
+
+        await AsyncFTPSession.onReceived(self, payload, timestamp)
+
+    async def requestReceiveFile(self, args, timestamp=None):
+        await AsyncFTPSession.requestReceiveFile(self, args, timestamp)
+
+        # manual acknowledgment
+        await self.sendMessage(f'100 file ready to be received')
+
+    async def receiveSegment(self, args, timestamp=None):
+        """
+        OPCODE 212
+        Receives a segment of file data. Same arguments as UdpFTPSession.receiveSegment
+        """
+        # find index of first separator
+        separateAt = args.find(self.SEPERATOR)
+        assert separateAt != -1, "Expected 2 arguments: sequence number, data"
+        # split args
+        sequence, data = int(args[:separateAt].decode('utf-8')), args[separateAt + 1:]
+        # index of the segment in the file
+        seqNum = sequence - self.fileToReceive['first'] if self.fileToReceive else None
+
+        if self.fileToReceive is None or not 0 <= seqNum < self.fileToReceive['total']:
+            # a retransmission of the last file arrived after it was completed. its acknowledgment was lost
+            if sequence in self.lastReceived:
+                await self.sendMessage(f'100{sequence}')
+                return
+
+            assert self.fileToReceive is not None, "Server not expecting file"
+            # retransmissions of an earlier file that was given up are skipped
+            assert seqNum < 0, "Sequence number not in range"
+            return
+
+        # acknowledge duplicates again without saving them. a new segment is on disk before it is acknowledged
+        if not self.fileToReceive['arrived'][seqNum]:
+            await self.storeSegment(seqNum, data, timestamp)
+        else:
+            self.fileToReceive['stats'].addRetransmit(len(data))
+        await self.sendMessage(f'100{sequence}')
+
+    async def sendHeader(self, message, numSegments):
+        # the empty crc32 field, as the check option is not granted, then the sequence number of the first segment
+        first = self.nextSequence
+        self.nextSequence += numSegments
+        await self.sendMessage(message + f'\x1c\x1c{first}', waitSuccess=True)
+        return first
+
+    async def sendSegment(self, sequence, segment):
+        await self.sendMessage(bytes(f'212{sequence}\x1c', 'utf-8') + segment, isString=False, waitSuccess=True,
+                               sequence=sequence)
+
+    async def probeReply(self, args, timestamp=None):
+        """
+        OPCODE 213
+        Answers an MTU probe of the client. Same arguments as UdpFTPSession.probeReply
+        """
+        size = args.split(self.SEPERATOR, 1)[0]
+        await self.sendMessage(b'213' + size, isString=False)
+
+    async def setSegmentSize(self, args, timestamp=None):
+        """
+        OPCODE 214
+        Sets the segment size of the files sent to the client. Same arguments as UdpFTPSession.setSegmentSize
+        """
+        assert args, "Expected 1 argument: segment size"
+
+        self.SEGMENT_SIZE = chooseSegmentSize(args.decode('utf-8'))
+        self.SIGNATURE_PAGE = self.SEGMENT_SIZE + 16
+
+        self.log.info(f'Segment size set to {self.SEGMENT_SIZE} bytes')
+        await self.sendMessage(f'214{self.SEGMENT_SIZE}')
+
+    @staticmethod
+    def port():
+        return UDP_FTP_PORT
+
+    @staticmethod
+    def negotiate(options):
+        """
+        Grants the options of the engine to a client. Unlike UdpFTPSession.negotiate the requested options are not
+        looked at: files are sent raw and unchecked, in segments of SEGMENT_SIZE bytes until the client sets another
+        size with 214.
+
+        :param options: dict - requested options
+        :returns dict - granted options
+        """
+        return {'segment': SEGMENT_SIZE}
+
+
+class AsyncUdpEndpoint(asyncio.DatagramProtocol):
+    """
+    Shared UDP endpoint of the asyncio engine. Routes every datagram to the session of its sender.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.sessions = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        timestamp = time.perf_counter_ns() / 1000.0
+
+        session = self.sessions.get(addr)
+        if session is None:
+            # first message of a new client opens its session
+            session = self.sessions[addr] = AsyncUdpFTPSession(self, addr)
+            asyncio.get_running_loop().create_task(session.run())
+
+        session.inbox.put_nowait((data, timestamp))
+
+
+async def serve():
+    """
+    Starts the control endpoint and the shared FTP endpoints and serves them forever on one event loop.
+    """
+
+    async def onClient(reader, writer):
+        await AsyncClientSession(reader, writer).run()
+
+    async def onTcpFTP(reader, writer):
+        await AsyncTcpFTPSession(reader, writer).run()
+
+    loop = asyncio.get_running_loop()
+
+    clientServer = await asyncio.start_server(onClient, HOST_IP, 5000)
+    tcpServer = await asyncio.start_server(onTcpFTP, HOST_IP, AsyncTcpFTPSession.port())
+    await loop.create_datagram_endpoint(AsyncUdpEndpoint, local_addr=(HOST_IP, AsyncUdpFTPSession.port()))
+
+    getLogger('Async Engine').info('Available for connection')
+
+    async with clientServer, tcpServer:
+        await asyncio.gather(clientServer.serve_forever(), tcpServer.serve_forever())
@@ -1,35 +1,86 @@
-from .session import Session, SessionClosedException
+from .session import Session, SessionClosedException, parseOptions, formatOptions
 from .FTP import TcpFTPSession, UdpFTPSession
+from concurrent.futures import ThreadPoolExecutor
+from config import MAX_SESSIONS
+from framing import FrameReader, packFrame
+import threading
 
 # code for client session by Saiid El Hajj Chehade
 
 class ClientSession(Session):
     """
     ClientSession is the session that handles user entry and main operations.
+    Every accepted connection is handed to a worker of a bounded pool so many clients can be served at once.
     Scope of requests include:
     210 - startFTPSession
     222 - keepAlive
     """
 
-    def __init__(self):
+    def __init__(self, maxSessions=MAX_SESSIONS):
+        """
+        :param maxSessions: int - maximum number of clients served at the same time
+        """
 
         # Dictionary of available commands to be requested from Client Session
         self.commands = {
             b'210': self.startFTPSession,
             b'222': self.keepAlive
         }
+
+        # each worker thread keeps its own serviced client
+        self.local = threading.local()
+
+        # bounded pool of workers. a slot is taken before accepting so extra clients wait in the listen backlog
+        self.maxSessions = maxSessions
+        self.slots = threading.BoundedSemaphore(maxSessions)
+        self.workers = ThreadPoolExecutor(max_workers=maxSessions, thread_name_prefix='ClientSession')
+
         Session.__init__(self, 'Client Session', 5000, 'TCP')
 
+    @property
+    def client(self):
+        return getattr(self.local, 'client', None)
+
+    @client.setter
+    def client(self, value):
+        self.local.client = value
+
     def waitClientRequest(self):
-        print(f'[{self.name}]: Available for connection')
+        self.log.info(f'Available for connection - up to {self.maxSessions} sessions')
 
-        # wait for TCP connection to be sent from a client
-        conn, addr = self.socket.accept()
+        while True:
+            # wait for a free worker before accepting a new client
+            self.slots.acquire()
+
+            try:
+                # wait for TCP connection to be sent from a client
+                conn, addr = self.socket.accept()
+            except OSError:
+                # the listening socket was closed
+                self.slots.release()
+                break
 
-        # update the serviced client of the session
-        self.client = {'connection': conn, 'address': addr}
+            self.workers.submit(self.serveClient, conn, addr)
 
-        super().waitClientRequest()
+        self.workers.shutdown(wait=True)
+
+    def serveClient(self, conn, addr):
+        """
+        Runs a single client connection to completion on a worker thread.
+        :param conn: socket - the accepted connection
+        :param addr: tuple - the address of the client
+        """
+
+        # update the serviced client of the worker
+        self.client = {'connection': conn, 'address': addr, 'reader': FrameReader(conn)}
+
+        try:
+            self.onConnection()
+        except Exception as e:
+            self.log.error(f'Client {addr} failed - {e}')
+        finally:
+            self.client = None
+            self.slots.release()
 
     def sendMessage(self, message, waitSuccess=False):
         """
@@ -38,15 +89,14 @@ class ClientSession(Session):
         :param message: str - the payload of the message to be sent
         """
         if self.client is not None:
-            raw = bytes(message + "\n\r", 'utf-8')
+            raw = packFrame(bytes(message, 'utf-8'))
             self.client['connection'].sendall(raw)
 
             if waitSuccess:
-                data = self.client['connection'].recv(1024)
-                if data and data[:3] == b'100':
-                    return
-                else:
-                    self.sendMessage(message, waitSuccess = True)
+                data = self.client['reader'].readFrame()
+                if data is None:
+                    raise ConnectionResetError()
+                assert data[:3] == b'100', 'Wrong response'
 
     def run(self):
 
@@ -56,7 +106,7 @@ class ClientSession(Session):
                 # infinite loop to read multiple requests
                 while True:
                     # save the received message in data
-                    data = connection.recv(1024)
+                    data = self.client['reader'].readFrame()
                     if not data:
                         # close on no data
                         break
@@ -66,18 +116,14 @@ class ClientSession(Session):
                         self.onReceived(data)
 
                     except AssertionError as e:
-                        print(f'[{self.name}]:', e)
+                        self.log.warning(e)
                         self.sendMessage(f'400 '+str(e))
 
             except ConnectionResetError:
                 # is triggered if the connection is closed remotely
-                print(f'[{self.name}]: Client Ended Connection')
+                pass
 
-                # if connection closed wait for a new one.
-                return self.waitClientRequest()
-
-        print(f'[{self.name}]: Client Ended Connection')
-        return self.waitClientRequest()
+        self.log.info(f'Client Ended Connection - {self.client["address"]}')
 
     def onReceived(self, payload):
         """
@@ -106,13 +152,14 @@ class ClientSession(Session):
         Starts an FTP Session to handle user file operations.
 
         :param args: byteArray:
-            number of fields: 1
+            number of fields: 1 or more
             index   length(chars)  name      values                  description
             0       1              connType  0 for TCP, 1 for UDP    specifies the type of the FTPSession to be opened
+            1..     -              options   key=value               optional - requested session options
 
         :sends
         opcode  args
-        210     port number of FTP server
+        210     port number of FTP server followed by the granted options
         400     error in fetching FTP server type
         """
 
@@ -129,12 +176,16 @@ class ClientSession(Session):
             self.sendMessage(f'400 Session Type invalid. possible values 0 -> TCP, 1 ->UDP.')
             return
 
-        # send a message about the port of FTP Server
-        self.sendMessage(f'210{FTPSession[typeCode].port()}', waitSuccess=True)
+        # choose the options the session will use
+        options = FTPSession[typeCode].negotiate(parseOptions(args[2:]))
+
+        # send a message about the port of FTP Server once it is bound
+        def announcePort(port):
+            self.sendMessage(f'210{port}' + formatOptions(options), waitSuccess=True)
 
         # opens the FTPSession
         try:
-            FTPSession[typeCode]()
+            FTPSession[typeCode](options=options, onOpen=announcePort)
         except SessionClosedException:
             return
 
@@ -1,7 +1,31 @@
-from sockets import openPort
+from sockets import openPort, openSessionPort, releasePort
+from log import getLogger
 
 
 # Saiid EL Hajj Chehade
+def parseOptions(args):
+    '''
+    Parses the options requested for a session.
+    :param args: byteArray - key=value fields separated by \x1c
+    :returns dict - option name to value
+    '''
+    options = {}
+    for field in args.strip().split(b'\x1c'):
+        if b'=' in field:
+            key, value = field.split(b'=', 1)
+            options[key.decode('utf-8')] = value.decode('utf-8')
+    return options
+
+
+def formatOptions(options):
+    '''
+    Formats the options granted for a session as \x1c separated key=value fields.
+    :param options: dict - option name to value
+    :returns str - the fields, each preceded by a separator
+    '''
+    return ''.join(f'\x1c{key}={value}' for key, value in options.items())
+
+
 class SessionClosedException(Exception):
     def str(self):
         return "Closed Session"
@@ -12,28 +36,40 @@ class Session:
     Session is a base class for the possible socket sessions on the server.
     Children:
     [ClientSession]
-    [TcpFTPSession]
-    [UdpFTPSession]
+    [FTPSession]
+        [TcpFTPSession]
+        [UdpFTPSession]
 
     The session handles application logic APIs
     '''
 
-    def __init__(self, name, port, conType):
+    def __init__(self, name, port, conType, onOpen=None):
         '''
         Initializes the Session Object
         :param name: str -optional name of the session object.
-        :param port: int - Port number to bind the session to.
+        :param port: int - Port number to bind the session to. None to allocate a free data port.
         :param conType: str - Connection Type. "TCP" or "UDP"
+        :param onOpen: function(port) - optional - called once the socket is bound, before waiting for clients
         '''
         # definitions
         self.name = name
+        self.log = getLogger(name)
         self.client = None  # the client address connecting
 
         # opening the socket for the session
-        self.socket = openPort(port, conType)
+        self.socket = openPort(port, conType) if port is not None else openSessionPort(conType)
+        self.port = self.socket.getsockname()[1]
 
-        # wait for clients
-        self.waitClientRequest()
+        try:
+            if onOpen:
+                onOpen(self.port)
+
+            # wait for clients
+            self.waitClientRequest()
+        finally:
+            # recycle the port of the session
+            self.socket.close()
+            releasePort(self.port)
 
     # gets called and runned when the session is created
     def run(self):
@@ -65,7 +101,7 @@ class Session:
         # decode received message into string
         text = payload.decode('utf-8')
 
-        print("[" + self.name + "]:", self.client["address"][0] + ":" + str(self.client['address'][1]), 'sent: ', text)
+        self.log.debug(f'{self.client["address"][0]}:{self.client["address"][1]} sent: {text}')
 
         # send optional acknowledgment
         if acknowledge:
@@ -77,7 +113,7 @@ class Session:
 
     def onConnection(self):
         # for the base class we just want to run on connection
-        print(f'[{self.name}]: Connected - Client = {self.client["address"]}')
+        self.log.info(f'Connected - Client = {self.client["address"]}')
 
         self.run()
 
@@ -1,5 +1,6 @@
 import socket
-from config import HOST_IP
+import threading
+from config import HOST_IP, DATA_PORT_RANGE
 #defining custom exceptions
 
 # code by Saiid El Hajj Chehade
@@ -11,6 +12,10 @@ class InvalidConnectionTypeException(Exception):
     def str(self):
         return "Type "+self.type+" is not valid. Valid types are [TCP, UDP]."
 
+class NoFreePortException(Exception):
+    def str(self):
+        return "No free port in the data port range."
+
 def openPort(port,conType):
     #constants
     HOST = HOST_IP
@@ -34,3 +39,41 @@ def openPort(port,conType):
     else:
         raise InvalidConnectionTypeException(conType)
 
+
+
+# ports of DATA_PORT_RANGE held by open sessions
+usedPorts = set()
+portsLock = threading.Lock()
+
+def openSessionPort(conType):
+    """
+    Opens a socket for a session on a free port of DATA_PORT_RANGE.
+    If no range is configured the kernel chooses the port.
+
+    :param conType: str - Connection Type. "TCP" or "UDP"
+    :returns socket - the bound socket. Its port is released with releasePort when the session closes.
+    """
+
+    if DATA_PORT_RANGE is None:
+        return openPort(0, conType)
+
+    first, last = DATA_PORT_RANGE
+    with portsLock:
+        for port in range(first, last + 1):
+            if port in usedPorts:
+                continue
+
+            # skip ports taken by other programs
+            try:
+                sock = openPort(port, conType)
+            except OSError:
+                continue
+
+            usedPorts.add(port)
+            return sock
+
+    raise NoFreePortException()
+
+def releasePort(port):
+    with portsLock:
+        usedPorts.discard(port)
@@ -0,0 +1,169 @@
+import random
+import time
+
+# code for transfer statistics by Saiid El Hajj Chehade
+
+
+class TransferStats:
+    """
+    Statistics of one file transfer.
+    Rates are sampled per segment and smoothed with an exponentially weighted moving average. Segment latencies are
+    the time from sending a segment to its acknowledgment for the sender, and the time between two segments for
+    the receiver. Goodput only counts the file data, raw bytes also count headers, retransmissions, duplicates and
+    corrupted segments.
+    """
+
+    ALPHA = 0.125  # weight of the newest sample in the moving average
+    LATENCY_SAMPLES = 1024  # latencies kept for the percentiles
+
+    def __init__(self, direction, fileName, fileType):
+        """
+        :param direction: str - 'send' or 'receive'
+        :param fileName: str - name of file
+        :param fileType: str - type of file
+        """
+        self.direction = direction
+        self.file = fileName + "." + fileType
+        self.start = time.perf_counter_ns() / 1000.0
+        self.end = None
+        # cpu time of the thread running the transfer
+        self.cpuStart = time.thread_time()
+        self.cpu = None
+        self.lastSegment = self.start
+
+        self.segments = 0  # segments delivered
+        self.bytes = 0  # file bytes delivered
+        self.rawBytes = 0  # all bytes that went through the socket for the transfer
+        self.retransmits = 0  # segments sent again, or duplicates received
+        self.timeouts = 0  # expiries of the retransmission timer
+        self.corrupted = 0  # segments that failed their check, received or reported by the receiver
+        self.rate = None  # moving average of the rate in bits/s
+        self.minRate = None
+        self.maxRate = None
+        self.latencies = []  # uniform sample of the segment latencies in µs, for the percentiles
+        self.latencyCount = 0
+        self.minLatency = None  # over all segments, not only the sample
+        self.maxLatency = None
+
+    def addSegment(self, size, latency=None, timestamp=None):
+        """
+        Records a delivered segment.
+
+        :param size: int - file bytes in the segment
+        :param latency: float - optional - µs from sending to acknowledgment. the time since the last segment if not given
+        :param timestamp: float - optional - µs time of delivery
+        """
+        timestamp = timestamp if timestamp is not None else time.perf_counter_ns() / 1000.0
+        interval = timestamp - self.lastSegment
+        self.lastSegment = timestamp
+
+        self.segments += 1
+        self.bytes += size
+
+        # instantaneous rate of the segment
+        duration = latency if latency is not None else interval
+        if duration > 0:
+            rate = getBitrate(size, duration)
+            self.rate = rate if self.rate is None else self.rate + self.ALPHA * (rate - self.rate)
+            self.minRate = rate if self.minRate is None else min(self.minRate, rate)
+            self.maxRate = rate if self.maxRate is None else max(self.maxRate, rate)
+
+        self.addLatency(latency if latency is not None else interval)
+
+    def addLatency(self, latency):
+        """
+        Keeps a uniform sample of at most LATENCY_SAMPLES latencies (reservoir sampling), and the extremes of all of
+        them.
+        """
+        self.latencyCount += 1
+        self.minLatency = latency if self.minLatency is None else min(self.minLatency, latency)
+        self.maxLatency = latency if self.maxLatency is None else max(self.maxLatency, latency)
+        if len(self.latencies) < self.LATENCY_SAMPLES:
+            self.latencies.append(latency)
+        else:
+            i = random.randrange(self.latencyCount)
+            if i < self.LATENCY_SAMPLES:
+                self.latencies[i] = latency
+
+    def addRaw(self, size):
+        """
+        Records bytes that went through the socket.
+        """
+        self.rawBytes += size
+
+    def addRetransmit(self, size):
+        """
+        Records a segment sent again or received twice.
+        """
+        self.retransmits += 1
+        self.rawBytes += size
+
+    def addTimeout(self):
+        """
+        Records an expiry of the retransmission timer.
+        """
+        self.timeouts += 1
+
+    def addCorrupted(self):
+        """
+        Records a segment that failed its check.
+        """
+        self.corrupted += 1
+
+    def finish(self):
+        self.end = time.perf_counter_ns() / 1000.0
+        self.cpu = time.thread_time() - self.cpuStart
+
+    def summary(self):
+        """
+        :returns dict - the statistics, rates in bits/s, times in µs and cpu time in seconds
+        """
+        end = self.end if self.end is not None else time.perf_counter_ns() / 1000.0
+        duration = end - self.start
+        latencies = sorted(self.latencies)
+
+        return {
+            'file': self.file,
+            'direction': self.direction,
+            'finished': self.end is not None,
+            'segments': self.segments,
+            'bytes': self.bytes,
+            'rawBytes': self.rawBytes,
+            'retransmits': self.retransmits,
+            'timeouts': self.timeouts,
+            'corrupted': self.corrupted,
+            'duration': duration,
+            'cpu': self.cpu if self.cpu is not None else time.thread_time() - self.cpuStart,
+            'goodput': getBitrate(self.bytes, duration) if duration > 0 else 0,
+            'rawRate': getBitrate(self.rawBytes, duration) if duration > 0 else 0,
+            'rate': self.rate or 0,
+            'minRate': self.minRate or 0,
+            'maxRate': self.maxRate or 0,
+            'latency': {
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'min': self.minLatency or 0,
+                'max': self.maxLatency or 0
+            }
+        }
+
+
+def percentile(values, p):
+    """
+    :param values: list - sorted values
+    :param p: float - percentile between 0 and 100
+    :returns float - nearest rank percentile. 0 for no values
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, -(-len(values) * p // 100) - 1))]
+
+
+def getBitrate(dataSize, duration):
+    """
+    :param dataSize: int - bytes
+    :param duration: float - µs
+    :returns float - bits/s
+    """
+    return dataSize * 8 / duration * 1E6
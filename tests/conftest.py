@@ -0,0 +1,82 @@
+import importlib
+import json
+import os
+import sys
+from collections import OrderedDict
+
+import pytest
+
+# the server modules import each other by name, as when the server runs from server\app.py
+SERVER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server')
+sys.path.insert(0, SERVER_PATH)
+CLIENT_PATH = os.path.join(os.path.dirname(SERVER_PATH), 'client')
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """
+    Points the file storage of the server at an empty catalog under a temporary directory, and clears what file.py
+    keeps in memory. Paths are built with "\\" like in config.py, so every file lands in tmp_path.
+
+    :returns str - the directory of the files, as FILE_PATH
+    """
+    import chunks
+    import file
+
+    root = str(tmp_path / 'server')
+    monkeypatch.setattr(file, 'FILE_PATH', root + "\\files")
+    monkeypatch.setattr(file, 'LIST_PATH', root + "\\files.json")
+    monkeypatch.setattr(file, 'JOURNAL_PATH', root + "\\files.journal")
+    monkeypatch.setattr(file, 'LOCK_PATH', root + "\\files.lock")
+    monkeypatch.setattr(file, 'storageLock', None)
+    monkeypatch.setattr(file, 'CHUNK_PATH', root + "\\chunks")
+    monkeypatch.setattr(chunks, 'CHUNK_PATH', root + "\\chunks")
+
+    monkeypatch.setattr(file, 'catalog', None)
+    monkeypatch.setattr(file, 'chunkRefs', None)
+    monkeypatch.setattr(file, 'partialUploads', OrderedDict())
+    monkeypatch.setattr(file, 'fileCache', OrderedDict())
+    monkeypatch.setattr(file, 'fileCacheStats', {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0})
+    monkeypatch.setattr(file, 'checksums', {})
+    monkeypatch.setattr(file, 'signatures', OrderedDict())
+    monkeypatch.setattr(file, 'contentHashes', {})
+    monkeypatch.setattr(file, 'filesBySize', None)
+    monkeypatch.setattr(file, 'fileSizes', {})
+
+    with open(file.LIST_PATH, 'w') as f:
+        json.dump({'lastFileID': 0, 'files': []}, f)
+    # read once before serving clients, like in app.py
+    file.loadCatalog()
+
+    yield file.FILE_PATH
+
+    if file.catalog and file.catalog['journal']:
+        file.catalog['journal'].close()
+    if file.storageLock:
+        file.storageLock.close()
+
+
+@pytest.fixture
+def client():
+    """
+    Lets a test import the client modules. They have the names of server modules (file, config, ...), so the server
+    modules are put aside while the test runs, and put back afterwards.
+
+    :returns function - imports a client module by name
+    """
+    names = {name[:-3] for name in os.listdir(CLIENT_PATH) if name.endswith('.py')} | {'connections'}
+
+    def isClient(module):
+        return module.split('.')[0] in names
+
+    server = {module: sys.modules.pop(module) for module in list(sys.modules) if isClient(module)}
+    # client scripts, like the benchmark, add paths of their own
+    path = list(sys.path)
+    sys.path.insert(0, CLIENT_PATH)
+
+    yield importlib.import_module
+
+    sys.path[:] = path
+    for module in [module for module in sys.modules if isClient(module)]:
+        del sys.modules[module]
+    sys.modules.update(server)
@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import pytest
+
+from file import readFile
+from sessions import asyncSessions
+from sessions.asyncSessions import AsyncUdpEndpoint, AsyncUdpFTPSession
+
+CLIENT = ('127.0.0.1', 40000)
+DATA = bytes(range(250))
+
+
+class Transport:
+    """
+    Stands for the socket of the shared UDP endpoint. Keeps what the sessions send.
+    """
+
+    def __init__(self):
+        self.sent = asyncio.Queue()
+
+    def sendto(self, data, address):
+        self.sent.put_nowait(data)
+
+
+def serve(test):
+    """
+    Runs a test coroutine against a UDP endpoint of the asyncio engine.
+
+    :param test: coroutine function(endpoint, send, reply)
+    """
+    async def main():
+        endpoint = AsyncUdpEndpoint()
+        transport = Transport()
+        endpoint.connection_made(transport)
+
+        def send(data):
+            endpoint.datagram_received(data, CLIENT)
+
+        async def reply():
+            return await asyncio.wait_for(transport.sent.get(), 5)
+
+        await test(endpoint, send, reply)
+
+    asyncio.run(main())
+
+
+def testRequestsAreAnsweredByOpcode(storage):
+    async def test(endpoint, send, reply):
+        send(b'230')
+        assert json.loads((await reply())[3:]) == []
+
+        send(b'250')
+        stats = await reply()
+        assert stats[:3] == b'250'
+        assert set(json.loads(stats[3:])) == {'transfers', 'current', 'cache', 'timer'}
+
+        send(b'999')
+        assert (await reply()).startswith(b'400 Invalid request OPCODE')
+        send(b'2')
+        assert (await reply()).startswith(b'400 Invalid request length')
+
+        # late acknowledgments are skipped without an answer
+        send(b'100')
+        send(b'222')
+        assert (await reply()).startswith(b'400')
+
+    serve(test)
+
+
+def testMalformedNumberIsRefused(storage):
+    async def test(endpoint, send, reply):
+        send(b'219abc')
+        assert (await reply()).startswith(b'400')
+        send(b'212x\x1cdata')
+        assert (await reply()).startswith(b'400')
+
+        # the session goes on, and is closed by 600
+        send(b'230')
+        assert (await reply())[:3] == b'230'
+        session = endpoint.sessions[CLIENT]
+        send(b'600')
+        await asyncio.sleep(0.05)
+        assert session.closed
+        assert CLIENT not in endpoint.sessions
+
+    serve(test)
+
+
+def testSegmentsAreStoredBeforeTheirAck(storage, monkeypatch):
+    monkeypatch.setattr(asyncSessions, 'FILE_PATH', storage)
+
+    async def test(endpoint, send, reply):
+        send(b'211report\x1cbin\x1c3\x1c250\x1c0\x1c\x1c\x1c7')
+        assert await reply() == b'100 file ready to be received'
+
+        for index in (2, 0):
+            send(b'212%d\x1c' % (7 + index) + DATA[index * 100:(index + 1) * 100])
+            assert await reply() == b'100%d' % (7 + index)
+        # a copy of a segment is acknowledged again and not written twice
+        send(b'2127\x1c' + DATA[:100])
+        assert await reply() == b'1007'
+
+        send(b'2128\x1c' + DATA[100:200])
+        assert await reply() == b'1008'
+        # the file is complete once its last segment is acknowledged
+        assert readFile('report', 'bin', storage) == DATA
+
+        # a late copy of the last segment is acknowledged again
+        send(b'2128\x1c' + DATA[100:200])
+        assert await reply() == b'1008'
+
+        send(b'250')
+        transfer = json.loads((await reply())[3:])['transfers'][-1]
+        assert (transfer['bytes'], transfer['retransmits']) == (250, 1)
+
+    serve(test)
+
+
+def testSessionIsFreedWhenItFails(storage, monkeypatch):
+    async def fail(self, payload, timestamp=None):
+        raise RuntimeError('broken')
+
+    monkeypatch.setattr(AsyncUdpFTPSession, 'onReceived', fail)
+
+    async def test(endpoint, send, reply):
+        send(b'230')
+        session = endpoint.sessions[CLIENT]
+        await asyncio.sleep(0.05)
+        # the next datagram of the client opens a new session instead of waiting in the inbox of the failed one
+        assert CLIENT not in endpoint.sessions
+        send(b'230')
+        assert endpoint.sessions[CLIENT] is not session
+
+    serve(test)
@@ -0,0 +1,51 @@
+import os
+import zlib
+
+import pytest
+
+BENCHMARK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmark')
+
+
+@pytest.fixture
+def bench(client, monkeypatch):
+    # the benchmark drives the client, so it runs with the client modules
+    monkeypatch.syspath_prepend(BENCHMARK_PATH)
+    return client('bench')
+
+
+def result(case, throughput, p50):
+    return {'case': case, 'throughput': throughput, 'latency': {'p50': p50}}
+
+
+def testParseSize(bench):
+    assert [bench.parseSize(text) for text in ('100', '64K', '1m', ' 2G')] == [100, 65536, 1 << 20, 2 << 30]
+    with pytest.raises(AssertionError):
+        bench.parseSize('1.5M')
+
+
+def testContentOfTheFiles(bench):
+    noise = bench.makeContent(10000, 'random')
+    text = bench.makeContent(10000, 'text')
+    assert len(noise) == len(text) == 10000
+    # text is the same from one run to the next, so runs compare, and it compresses
+    assert bench.makeContent(10000, 'text') == text
+    assert len(zlib.compress(text)) < len(text) * 0.75
+    assert len(zlib.compress(noise)) > len(noise)
+
+
+def testRegressionsAgainstBaseline(bench):
+    baseline = {'results': [result('udp/size=1M/download', 100E6, 500), result('udp/size=1M/upload', 100E6, 500),
+                            result('tcp/size=1M/download', 100E6, 500)]}
+    results = [
+        # within the threshold
+        result('udp/size=1M/download', 85E6, 590),
+        # slower, and later segments
+        result('udp/size=1M/upload', 70E6, 700),
+        # cases missing from the baseline are not compared
+        result('udp/size=16M/download', 1E6, 1E6)
+    ]
+
+    regressions = bench.compare(results, baseline, 0.2)
+    assert regressions == ['udp/size=1M/upload: throughput 70.0 Mbps, baseline 100.0 Mbps',
+                           'udp/size=1M/upload: p50 latency 700 µs, baseline 500 µs']
+    assert bench.compare(results, baseline, 0.5) == []
@@ -0,0 +1,99 @@
+import hashlib
+import os
+import random
+
+import chunks
+import file
+from chunks import splitChunks, writeChunk, readManifest, writeManifest, ChunkReader, getChunkLocation
+from config import CHUNK_MIN_SIZE, CHUNK_MAX_SIZE
+
+DATA = random.Random(0).randbytes(1024 * 1024)
+
+
+def storeChunks(location, data):
+    """
+    Stores data as chunks with a manifest, like file.storeFile does.
+
+    :returns list - [key, size] of the chunks
+    """
+    os.makedirs(chunks.CHUNK_PATH, exist_ok=True)
+    manifest = []
+    with open(location, 'wb') as f:
+        f.write(data)
+    with open(location, 'rb') as f:
+        for chunk in splitChunks(f):
+            key = hashlib.sha256(chunk).hexdigest()
+            writeChunk(key, chunk)
+            manifest.append([key, len(chunk)])
+    os.remove(location)
+    writeManifest(location, {'size': len(data), 'hash': hashlib.sha256(data).hexdigest(), 'chunks': manifest})
+    return manifest
+
+
+def testChunksRoundTrip(storage):
+    location = storage + "\\data.bin"
+    stored = storeChunks(location, DATA)
+
+    assert all(CHUNK_MIN_SIZE <= size <= CHUNK_MAX_SIZE for _, size in stored[:-1])
+    manifest = readManifest(location)
+    assert manifest == {'size': len(DATA), 'hash': hashlib.sha256(DATA).hexdigest(), 'chunks': stored}
+    assert readManifest(location, header=True) == {'size': len(DATA), 'hash': hashlib.sha256(DATA).hexdigest()}
+
+    with ChunkReader(manifest) as reader:
+        assert reader.read() == DATA
+        # reads across the end of a chunk
+        start = stored[0][1] - 10
+        reader.seek(start)
+        assert reader.read(100) == DATA[start:start + 100][:10]
+        reader.seek(start)
+        assert reader.readall() == DATA[start:]
+        reader.seek(-5, 2)
+        assert reader.read() == DATA[-5:]
+
+
+def testInsertionKeepsOtherChunks(storage):
+    before = storeChunks(storage + "\\a.bin", DATA)
+    after = storeChunks(storage + "\\b.bin", DATA[:300_000] + b'inserted' + DATA[300_000:])
+
+    # only the chunks around the inserted data change
+    shared = {key for key, _ in before} & {key for key, _ in after}
+    assert len(shared) >= len(before) - 2
+    assert readManifest(storage + "\\missing.bin") is None
+
+
+def testChunkRefsAfterRelease(storage, monkeypatch):
+    monkeypatch.setattr(file, 'STORAGE', 'chunks')
+    file.writeFile('first', 'bin', storage, DATA)
+    file.writeFile('second', 'bin', storage, DATA[:600_000])
+    firstChunks = readManifest(storage + "\\first.bin")['chunks']
+    secondChunks = readManifest(storage + "\\second.bin")['chunks']
+    shared = {key for key, _ in secondChunks} & {key for key, _ in firstChunks}
+    assert shared
+    # only the manifest is kept next to the location
+    assert not os.path.exists(storage + "\\first.bin")
+
+    with file.chunkRefsLock:
+        refs = file.loadChunkRefs()
+        assert all(refs[key] == 2 for key in shared)
+        assert sum(refs.values()) == len(firstChunks) + len(secondChunks)
+
+    # a new version of the first file drops its chunks, but keeps the ones the second file holds
+    file.writeFile('first', 'bin', storage, b'small')
+    with file.chunkRefsLock:
+        refs = file.loadChunkRefs()
+        for key, _ in firstChunks:
+            if key in shared:
+                assert refs[key] == 1
+                assert os.path.exists(getChunkLocation(key))
+            else:
+                assert key not in refs
+                assert not os.path.exists(getChunkLocation(key))
+
+        # the counts read again from the manifests agree
+        file.chunkRefs = None
+        assert file.loadChunkRefs() == refs
+
+    with file.openFile(storage + "\\second.bin") as f:
+        assert f.read() == DATA[:600_000]
+    with file.openFile(storage + "\\first.bin") as f:
+        assert f.read() == b'small'
@@ -0,0 +1,70 @@
+import os
+import zlib
+
+import pytest
+
+DATA = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def clientFile(client):
+    return client('file')
+
+
+def read(location):
+    with open(location, 'rb') as f:
+        return f.read()
+
+
+def testDownloadWrittenInOrder(clientFile, tmp_path):
+    directory = str(tmp_path)
+    download = clientFile.PartialFile('report', 'bin', directory)
+    for seqNum in (2, 0, 3, 1):
+        download.writeSegment(seqNum, DATA[seqNum * 256:(seqNum + 1) * 256])
+    assert download.verify(zlib.crc32(DATA))
+    download.commit()
+
+    assert read(directory + "\\report.bin") == DATA
+    assert not os.path.exists(directory + "\\report.bin.part")
+
+
+def testInterruptedDownloadResumes(clientFile, tmp_path):
+    directory = str(tmp_path)
+    download = clientFile.PartialFile('report', 'bin', directory)
+    download.writeSegment(0, DATA[:256])
+    download.writeSegment(1, DATA[256:512])
+    # a segment beyond a gap is not kept
+    download.writeSegment(3, DATA[768:])
+    download.close()
+    assert clientFile.getPartialSize('report', 'bin', directory) == 512
+
+    # the continuation counts its segments and its crc32 from the offset
+    download = clientFile.PartialFile('report', 'bin', directory, offset=512)
+    download.writeSegment(1, DATA[768:])
+    download.writeSegment(0, DATA[512:768])
+    assert download.verify(zlib.crc32(DATA[512:]))
+    download.commit()
+
+    assert read(directory + "\\report.bin") == DATA
+    assert clientFile.getPartialSize('report', 'bin', directory) == 0
+
+
+def testResumeDropsDataPastTheOffset(clientFile, tmp_path):
+    directory = str(tmp_path)
+    with open(directory + "\\report.bin.part", 'wb') as f:
+        f.write(DATA[:300] + b'garbage')
+
+    download = clientFile.PartialFile('report', 'bin', directory, offset=300)
+    download.append(DATA[300:])
+    download.commit()
+    assert read(directory + "\\report.bin") == DATA
+
+
+def testCorruptedDownloadStartsOver(clientFile, tmp_path):
+    directory = str(tmp_path)
+    download = clientFile.PartialFile('report', 'bin', directory)
+    download.append(DATA)
+    assert not download.verify(zlib.crc32(DATA) ^ 1)
+
+    assert clientFile.getPartialSize('report', 'bin', directory) == 0
+    assert not os.path.exists(directory + "\\report.bin")
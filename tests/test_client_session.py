@@ -0,0 +1,97 @@
+import socket
+import threading
+
+import pytest
+
+import sockets
+from framing import FrameReader, packFrame
+from sessions import session
+from sessions.client import ClientSession
+
+
+@pytest.fixture
+def startServer(monkeypatch):
+    """
+    Starts a ClientSession on a free port instead of 5000, in a background thread.
+
+    :returns function(maxSessions) - starts the server and gives the address it listens on
+    """
+    listening = []
+    opened = threading.Event()
+
+    def openPort(port, conType):
+        sock = sockets.openPort(0, conType)
+        listening.append(sock)
+        opened.set()
+        return sock
+
+    monkeypatch.setattr(session, 'openPort', openPort)
+    servers = []
+
+    def start(maxSessions):
+        server = threading.Thread(target=ClientSession, args=(maxSessions,), daemon=True)
+        server.start()
+        servers.append(server)
+        assert opened.wait(5)
+        return '127.0.0.1', listening[0].getsockname()[1]
+
+    yield start
+
+    # closing the listening socket ends the accept loop, once the clients left
+    for sock in listening:
+        # wakes the accept of the server thread up
+        sock.shutdown(socket.SHUT_RDWR)
+    for server in servers:
+        server.join(5)
+        assert not server.is_alive()
+
+
+def connect(address):
+    client = socket.create_connection(address, timeout=5)
+    return client, FrameReader(client)
+
+
+def keepAlive(client, reader):
+    client.sendall(packFrame(b'222'))
+    return reader.readFrame()
+
+
+def testClientsAreServedAtTheSameTime(startServer):
+    address = startServer(4)
+    first = connect(address)
+    second = connect(address)
+
+    # the first client stays connected while the second one is served
+    assert keepAlive(*second) == b'222 Connection Available'
+    assert keepAlive(*first) == b'222 Connection Available'
+    assert keepAlive(*second) == b'222 Connection Available'
+
+    for client, _ in (first, second):
+        client.close()
+
+
+def testExtraClientsWaitForAFreeWorker(startServer):
+    address = startServer(1)
+    first = connect(address)
+    assert keepAlive(*first) == b'222 Connection Available'
+
+    # the only worker serves the first client. the second one waits in the listen backlog
+    second = connect(address)
+    second[0].sendall(packFrame(b'222'))
+    second[0].settimeout(0.3)
+    with pytest.raises(socket.timeout):
+        second[1].readFrame()
+
+    first[0].close()
+    second[0].settimeout(5)
+    assert second[1].readFrame() == b'222 Connection Available'
+    second[0].close()
+
+
+def testInvalidRequestIsRefused(startServer):
+    client, reader = connect(startServer(2))
+    client.sendall(packFrame(b'999'))
+    assert reader.readFrame().startswith(b'400')
+    # the session goes on after a refused request
+    assert keepAlive(client, reader) == b'222 Connection Available'
+    client.close()
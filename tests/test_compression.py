@@ -0,0 +1,83 @@
+import os
+import random
+
+import pytest
+
+import sessions.FTP
+from compression import COMPRESSED, RAW, chooseCodec, decodeSegment, encodeSegment, encodeSegments, getEntropy
+from sessions.FTP import chooseCodecs
+
+SEGMENT = 1000
+TEXT = b'the quick brown fox jumps over the lazy dog. ' * 100
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+def testSegmentsRoundTrip(codec):
+    payload = encodeSegment(codec, TEXT[:SEGMENT])
+    assert payload[:1] == COMPRESSED
+    assert len(payload) < SEGMENT
+    assert decodeSegment(codec, payload, SEGMENT) == TEXT[:SEGMENT]
+
+    # a segment that would grow is sent raw
+    noise = os.urandom(SEGMENT)
+    payload = encodeSegment(codec, noise)
+    assert payload == RAW + noise
+    assert decodeSegment(codec, payload, SEGMENT) == noise
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+def testSegmentsAreEncodedInOrder(codec):
+    data = TEXT + os.urandom(3000) + TEXT
+    segments = [data[i:i + SEGMENT] for i in range(0, len(data), SEGMENT)]
+
+    encoded = list(encodeSegments(iter(segments), codec))
+    assert [size for size, _ in encoded] == [len(segment) for segment in segments]
+    assert b''.join(decodeSegment(codec, payload, SEGMENT) for _, payload in encoded) == data
+
+
+def testRawTransfersAreNotEncoded():
+    segments = [b'abc', b'de']
+    assert list(encodeSegments(iter(segments), '')) == [(3, b'abc'), (2, b'de')]
+    assert decodeSegment('', b'\x01abc', SEGMENT) == b'\x01abc'
+
+
+def testSegmentsThatDecompressTooFarAreRefused():
+    payload = encodeSegment('zlib', bytes(4 * SEGMENT))
+    with pytest.raises(AssertionError):
+        decodeSegment('zlib', payload, SEGMENT)
+    with pytest.raises(AssertionError):
+        decodeSegment('zlib', b'', SEGMENT)
+
+
+def testEntropy():
+    assert getEntropy(b'') == 0
+    assert getEntropy(b'a' * 100) == 0
+    assert getEntropy(bytes(range(256)) * 4) == 8
+
+
+def testCodecIsChosenByFileContent(tmp_path):
+    directory = str(tmp_path)
+
+    def write(name, data):
+        with open(directory + "\\" + name, 'wb') as f:
+            f.write(data)
+
+    write('notes.txt', TEXT)
+    write('noise.bin', random.Random(1).randbytes(100000))
+    write('photo.jpg', TEXT)
+
+    assert chooseCodec(['lzma', 'zlib'], 'notes', 'txt', directory) == 'lzma'
+    assert chooseCodec([], 'notes', 'txt', directory) == ''
+    assert chooseCodec(['zlib'], 'noise', 'bin', directory) == ''
+    # the sample starts at the offset of the transfer
+    assert chooseCodec(['zlib'], 'notes', 'txt', directory, offset=len(TEXT)) == 'zlib'
+    # compressed types are not even read
+    assert chooseCodec(['zlib'], 'photo', 'JPG', directory) == ''
+
+
+def testServerGrantsTheCodecsItKnows(monkeypatch):
+    assert chooseCodecs('lzma,brotli,zlib') == 'lzma,zlib'
+    assert chooseCodecs(None) == ''
+
+    monkeypatch.setattr(sessions.FTP, 'COMPRESSION_CODECS', ['zlib'])
+    assert chooseCodecs('lzma,zlib') == 'zlib'
@@ -0,0 +1,83 @@
+import io
+import os
+import random
+
+import delta
+
+
+def makeFiles(tmp_path, base, new):
+    """
+    Writes both versions and returns the delta of the new one against the base, with the digest of the new one.
+    """
+    (tmp_path / 'base').write_bytes(base)
+    (tmp_path / 'new').write_bytes(new)
+    blockSize = delta.getBlockSize(len(base))
+    with open(tmp_path / 'base', 'rb') as f:
+        signature = delta.makeSignature(f, blockSize)
+    return blockSize, delta.makeDelta(str(tmp_path / 'new'), blockSize, signature, len(base))
+
+
+def roundTrip(tmp_path, base, new):
+    """
+    :returns int - size of the delta of the new version, after checking it builds the new version from the base
+    """
+    blockSize, (changes, digest) = makeFiles(tmp_path, base, new)
+    out = io.BytesIO()
+    with open(tmp_path / 'base', 'rb') as f:
+        assert delta.applyDelta(changes, f, out, blockSize) == digest
+    assert out.getvalue() == new
+    return len(changes)
+
+
+def randomBytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def testSameFileIsCopied(tmp_path):
+    base = randomBytes(200_000)
+    assert roundTrip(tmp_path, base, base) < 100
+
+
+def testInsertionIsFoundAtAnyOffset(tmp_path):
+    base = randomBytes(200_000)
+    new = base[:1001] + randomBytes(77, 1) + base[1001:]
+    assert roundTrip(tmp_path, base, new) < 2 * delta.getBlockSize(len(base))
+
+
+def testLongInsertionFindsCopiesAgain(tmp_path):
+    base = randomBytes(1_000_000)
+    blockSize = delta.getBlockSize(len(base))
+    inserted = randomBytes(5 * blockSize + 123, 1)
+    new = base[:300_000] + inserted + base[300_000:]
+    # the copies start again at most SCAN_EVERY blocks after the inserted data
+    assert roundTrip(tmp_path, base, new) < len(inserted) + (delta.SCAN_EVERY + 2) * blockSize
+
+
+def testChangedMiddle(tmp_path):
+    base = randomBytes(300_000)
+    new = base[:100_000] + randomBytes(50_000, 1) + base[150_000:]
+    assert roundTrip(tmp_path, base, new) < 50_000 + (delta.SCAN_EVERY + 2) * delta.getBlockSize(len(base))
+
+
+def testShortTailBlockIsCopied(tmp_path):
+    base = randomBytes(100_000 + 17)
+    new = randomBytes(3000, 1) + base
+    assert roundTrip(tmp_path, base, new) < 3100
+
+
+def testUnrelatedAndEmptyFiles(tmp_path):
+    roundTrip(tmp_path, randomBytes(50_000), randomBytes(60_000, 1))
+    roundTrip(tmp_path, randomBytes(50_000), b'')
+    roundTrip(tmp_path, b'', randomBytes(5000, 1))
+
+
+def testLimit(tmp_path):
+    base = randomBytes(100_000)
+    new = randomBytes(100_000, 1)
+    _, (changes, digest) = makeFiles(tmp_path, base, new)
+    blockSize = delta.getBlockSize(len(base))
+    with open(tmp_path / 'base', 'rb') as f:
+        signature = delta.makeSignature(f, blockSize)
+    limited, limitedDigest = delta.makeDelta(str(tmp_path / 'new'), blockSize, signature, len(base), limit=50_000)
+    assert limited is None
+    assert limitedDigest == digest
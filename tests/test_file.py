@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import pytest
+
+import file
+from file import PartialFile, getPartialSize, getFileList, readFile
+
+DATA = bytes(range(256)) * 4 + b'end'  # 1027 bytes: 10 segments of 100 bytes and a last one of 27
+
+
+def segments(data, size=100):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def testWriteSegmentsOutOfOrder(storage):
+    parts = segments(DATA)
+    upload = PartialFile('report', 'bin', storage, size=len(DATA))
+
+    # the last segment first, before the segment size is known, then the rest shuffled
+    for seqNum in [10, 3, 0, 1, 7, 2, 9, 4, 6, 5, 8]:
+        upload.writeSegment(seqNum, len(parts), parts[seqNum])
+
+    assert upload.done == len(DATA)
+    assert upload.size == len(DATA)
+    assert upload.verify(zlib.crc32(DATA))
+
+    upload.commit()
+    assert readFile('report', 'bin', storage) == DATA
+    assert getFileList() == [{'file': 'report.bin', 'id': 1}]
+    assert not os.path.exists(upload.tempLocation)
+
+
+def testDiscardKeepsDataBeforeGap(storage):
+    parts = segments(DATA)
+    upload = PartialFile('report', 'bin', storage, size=len(DATA))
+    for seqNum in [0, 1, 2, 4, 5]:
+        upload.writeSegment(seqNum, len(parts), parts[seqNum])
+    upload.discard()
+
+    # only the data from the start of the file without gaps is kept
+    assert getPartialSize('report', 'bin', storage, len(DATA)) == 300
+    with open(file.getPartialLocation(upload.location, len(DATA)), 'rb') as f:
+        assert f.read() == DATA[:300]
+
+    # a later upload continues from there, its segments counted from the offset
+    rest = segments(DATA[300:])
+    upload = PartialFile('report', 'bin', storage, size=len(DATA), offset=300)
+    for seqNum in reversed(range(len(rest))):
+        upload.writeSegment(seqNum, len(rest), rest[seqNum])
+    assert upload.verify(zlib.crc32(DATA[300:]))
+    upload.commit()
+
+    assert readFile('report', 'bin', storage) == DATA
+    assert getPartialSize('report', 'bin', storage, len(DATA)) == 0
+
+
+def testPartialUploadsSurviveRestart(storage, monkeypatch):
+    upload = PartialFile('report', 'bin', storage, size=len(DATA))
+    upload.append(DATA[:500])
+    upload.discard()
+    # an upload in progress when the server stopped
+    crashed = PartialFile('other', 'bin', storage, size=len(DATA))
+    crashed.append(DATA)
+    crashed.file.close()
+
+    monkeypatch.setattr(file, 'partialUploads', OrderedDict())
+    reloadCatalog()
+
+    assert getPartialSize('report', 'bin', storage, len(DATA)) == 500
+    assert getPartialSize('other', 'bin', storage, len(DATA)) == 0
+    assert not os.path.exists(crashed.tempLocation)
+
+    upload = PartialFile('report', 'bin', storage, size=len(DATA), offset=500)
+    upload.append(DATA[500:])
+    upload.commit()
+    assert readFile('report', 'bin', storage) == DATA
+
+
+def testDiscardWithoutKeeping(storage):
+    upload = PartialFile('report', 'bin', storage, size=len(DATA))
+    upload.writeSegment(0, 11, DATA[:100])
+    upload.discard(keep=False)
+
+    assert not os.path.exists(upload.tempLocation)
+    assert getPartialSize('report', 'bin', storage, len(DATA)) == 0
+
+
+def testVerifyDropsCorruptedData(storage):
+    upload = PartialFile('report', 'bin', storage, size=len(DATA))
+    upload.append(DATA)
+
+    assert not upload.verify(zlib.crc32(DATA) ^ 1)
+    assert not os.path.exists(upload.tempLocation)
+    assert getPartialSize('report', 'bin', storage, len(DATA)) == 0
+    assert not file.isStored(upload.location)
+
+
+def reloadCatalog():
+    # what a restart of the server does: the catalog is read again from disk
+    file.catalog['journal'].close()
+    file.catalog = None
+    return file.loadCatalog()
+
+
+def readSnapshot():
+    with open(file.LIST_PATH) as f:
+        return json.load(f)
+
+
+def testCatalogIsIndexedByIdAndName(storage):
+    with open(file.LIST_PATH, 'w') as f:
+        json.dump({'lastFileID': 7, 'files': [{'id': 2, 'name': 'a', 'type': 'txt'},
+                                              {'id': 7, 'name': 'b', 'type': 'bin'}]}, f)
+    catalog = reloadCatalog()
+    assert (file.getFileInfo(2), file.getFileInfo(7)) == (('a', 'txt'), ('b', 'bin'))
+    with pytest.raises(AssertionError):
+        file.getFileInfo(3)
+
+    # ids go on from the highest one, and a name already listed keeps its id
+    file.addFile('c', 'txt')
+    file.addFile('b', 'bin')
+    assert catalog['byName'][('c', 'txt')]['id'] == 8
+    assert [entry['id'] for entry in getFileList()] == [2, 7, 8]
+
+    # the list sent to clients is a copy
+    getFileList().clear()
+    assert len(getFileList()) == 3
+
+
+def testConcurrentAdditionsGetDistinctIds(storage):
+    threads = [threading.Thread(target=file.addFile, args=(f'f{i}', 'txt')) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = sorted(entry['id'] for entry in getFileList())
+    assert ids == list(range(1, 21))
+    assert {file.getFileInfo(i)[0] for i in ids} == {f'f{i}' for i in range(20)}
+
+
+def testJournalReplayIgnoresCutLine(storage):
+    file.addFile('a', 'txt')
+    file.addFile('b', 'txt')
+    # a crash while the third entry was written
+    with open(file.JOURNAL_PATH, 'a') as f:
+        f.write('{"id": 3, "name": "c", "ty')
+
+    catalog = reloadCatalog()
+
+    assert getFileList() == [{'file': 'a.txt', 'id': 1}, {'file': 'b.txt', 'id': 2}]
+    assert catalog['lastFileID'] == 2
+    # the replayed entries are merged into the snapshot and the journal starts over
+    assert readSnapshot()['files'] == [{'id': 1, 'name': 'a', 'type': 'txt'}, {'id': 2, 'name': 'b', 'type': 'txt'}]
+    assert os.path.getsize(file.JOURNAL_PATH) == 0
+
+    file.addFile('c', 'txt')
+    assert file.getFileInfo(3) == ('c', 'txt')
+
+
+def testJournalReplaySkipsEntriesOfSnapshot(storage):
+    file.addFile('a', 'txt')
+    with open(file.JOURNAL_PATH) as f:
+        journal = f.read()
+    file.compactCatalog()
+    # the server stopped after the snapshot was written and before the journal was emptied
+    with open(file.JOURNAL_PATH, 'w') as f:
+        f.write(journal)
+
+    reloadCatalog()
+    assert getFileList() == [{'file': 'a.txt', 'id': 1}]
+
+
+def testCompactCatalog(storage, monkeypatch):
+    monkeypatch.setattr(file, 'CATALOG_COMPACT_EVERY', 2)
+    for name in 'abc':
+        file.addFile(name, 'txt')
+    # adding a file twice does not list it twice
+    file.addFile('a', 'txt')
+
+    # the first two entries were merged into the snapshot, the third is in the journal
+    assert [entry['name'] for entry in readSnapshot()['files']] == ['a', 'b']
+    with open(file.JOURNAL_PATH) as f:
+        assert [json.loads(line)['name'] for line in f] == ['c']
+
+    reloadCatalog()
+    assert [entry['file'] for entry in getFileList()] == ['a.txt', 'b.txt', 'c.txt']
+    assert readSnapshot()['lastFileID'] == 3
+
+
+def storeTestFile(directory, name, data):
+    file.writeFile(name, 'bin', directory, data)
+    return directory + "\\" + name + ".bin"
+
+
+def testCacheEvictsLeastRecentlyUsed(storage, monkeypatch):
+    monkeypatch.setattr(file, 'FILE_CACHE_SIZE', 1000)
+    locations = [storeTestFile(storage, f'f{i}', bytes([i]) * 200) for i in range(6)]
+
+    for location in locations[:5]:
+        assert file.getCachedFile(location, 200) is not None
+    # f0 is used again, so f1 is the least recently used when f5 needs room
+    assert file.getCachedFile(locations[0], 200) == bytes([0]) * 200
+    assert file.getCachedFile(locations[5], 200) == bytes([5]) * 200
+
+    assert list(file.fileCache) == [locations[i] for i in (2, 3, 4, 0, 5)]
+    assert file.getCacheStats() == {'hits': 1, 'misses': 6, 'evictions': 1, 'bytes': 1000, 'files': 5}
+
+
+def testCacheSkipsLargeFiles(storage, monkeypatch):
+    monkeypatch.setattr(file, 'FILE_CACHE_SIZE', 1000)
+    location = storeTestFile(storage, 'large', b'x' * 251)
+
+    assert file.getCachedFile(location, 251) is None
+    assert file.getCacheStats()['files'] == 0
+
+
+def testCacheNoticesChangedFiles(storage):
+    location = storeTestFile(storage, 'f', b'old')
+    assert file.getCachedFile(location, 3) == b'old'
+
+    # a new version of the same size, written behind the back of the server
+    with open(location, 'wb') as f:
+        f.write(b'new')
+    stat = os.stat(location)
+    os.utime(location, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert file.getCachedFile(location, 3) == b'new'
+
+    # a new size
+    with open(location, 'wb') as f:
+        f.write(b'newer')
+    assert file.getCachedFile(location, 5) == b'newer'
+
+    # files replaced through the server are dropped from the cache
+    storeTestFile(storage, 'f', b'newest')
+    assert location not in file.fileCache
+    assert file.getCacheStats()['misses'] == 3
+
+
+def testLinkFileFindsContentBySize(storage):
+    data = b'shared content'
+    storeTestFile(storage, 'other', b'x' * len(data) + b'longer')
+    storeTestFile(storage, 'same size', b'y' * len(data))
+    source = storeTestFile(storage, 'source', data)
+    digest = hashlib.sha256(data).hexdigest()
+
+    assert file.linkFile('copy', 'bin', storage, len(data), digest)
+    assert readFile('copy', 'bin', storage) == data
+    # only the files of the same size were hashed
+    assert set(file.contentHashes) == {storage + "\\same size.bin", source}
+
+    # a new version of the source changes its size, so it is looked for at the new size
+    file.writeFile('source', 'bin', storage, data + b'!')
+    assert file.findContent(storage, len(data) + 1, hashlib.sha256(data + b'!').hexdigest())[0] == source
+    assert file.findContent(storage, len(data), digest)[0] == storage + "\\copy.bin"
+    assert not file.linkFile('missing', 'bin', storage, 3, hashlib.sha256(b'abc').hexdigest())
+
+
+def testSecondProcessCannotUseStorage(storage, monkeypatch):
+    # what a second server process started on the same files sees: the lock is held by another open file
+    held = file.storageLock
+    monkeypatch.setattr(file, 'storageLock', None)
+    with pytest.raises(file.StorageInUseError):
+        file.lockStorage()
+
+    held.close()
+    file.lockStorage()
+    assert file.storageLock is not None
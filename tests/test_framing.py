@@ -0,0 +1,78 @@
+import socket
+
+from framing import FrameReader, HEADER, frameSize, packFrame
+
+
+class ChunkedSocket:
+    """
+    Gives the bytes it holds back in the given recv sizes, like a TCP stream splitting and joining messages.
+    """
+
+    def __init__(self, data, sizes):
+        self.data = data
+        self.sizes = list(sizes)
+
+    def recv(self, size):
+        size = min(size, self.sizes.pop(0) if self.sizes else len(self.data))
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+def testPackFrame():
+    frame = packFrame(b'230hello')
+    assert frame[:HEADER.size] == HEADER.pack(b'230', 5)
+    assert frame[HEADER.size:] == b'hello'
+
+
+def testReadSplitFrame():
+    # a message arriving one byte at a time, header included
+    frame = packFrame(b'212' + bytes(range(200)))
+    reader = FrameReader(ChunkedSocket(frame, [1] * len(frame)))
+
+    assert reader.readFrame() == b'212' + bytes(range(200))
+    assert reader.readFrame() is None
+
+
+def testReadCoalescedFrames():
+    # several messages in a single recv, the last one cut in the middle of its header
+    messages = [b'100 received', b'241file\x1cbin\x1c3', b'222', b'212' + b'x' * 1000]
+    data = b''.join(packFrame(message) for message in messages)
+    cut = len(data) - 1000 - HEADER.size + 2
+    reader = FrameReader(ChunkedSocket(data, [cut, len(data) - cut]))
+
+    assert [reader.readFrame() for _ in messages] == messages
+    assert reader.readFrame() is None
+
+
+def testReadChunkTakesBufferedBytesFirst():
+    data = packFrame(b'212' + b'a' * 10) + packFrame(b'100')
+    reader = FrameReader(ChunkedSocket(data, [len(data)]))
+
+    assert reader.readHeader() == (b'212', 10)
+    assert reader.readChunk(4) == b'aaaa'
+    assert reader.readChunk(6) == b'aaaaaa'
+    assert reader.readFrame() == b'100'
+
+
+def testReadFrameOverSocket():
+    left, right = socket.socketpair()
+    with left, right:
+        reader = FrameReader(right, bufferSize=7)
+        left.sendall(packFrame(b'210') + packFrame(b'2106002\x1csegment=1012'))
+        left.shutdown(socket.SHUT_WR)
+
+        assert reader.readFrame() == b'210'
+        assert reader.readFrame() == b'2106002\x1csegment=1012'
+        assert reader.readFrame() is None
+
+
+def testConnectionClosedInsidePayload():
+    frame = packFrame(b'212' + b'z' * 50)
+    reader = FrameReader(ChunkedSocket(frame[:-10], [20, 20]))
+
+    assert reader.readFrame() is None
+
+
+def testFrameSize():
+    for message in [b'212', b'212' + b'x' * 1000]:
+        assert frameSize(len(message) - 3) == len(packFrame(message))
@@ -0,0 +1,159 @@
+import os
+import socket
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmark'))
+from impair import Impairment, UdpImpairmentRelay
+
+
+@pytest.fixture
+def echo():
+    """
+    A UDP server that sends every datagram back.
+
+    :returns (socket, function) - the server socket, and a function answering the datagrams it received
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(0.2)
+
+    def answer():
+        received = []
+        try:
+            while True:
+                data, addr = server.recvfrom(65535)
+                received.append(data)
+                server.sendto(data, addr)
+        except socket.timeout:
+            return received
+
+    yield server, answer
+    server.close()
+
+
+@pytest.fixture
+def relays():
+    started = []
+
+    def start(*args, **kwargs):
+        started.append(UdpImpairmentRelay(*args, **kwargs).start())
+        return started[-1]
+
+    yield start
+    for relay in started:
+        relay.stop()
+
+
+def receiveAll(client):
+    received = []
+    client.settimeout(0.2)
+    try:
+        while True:
+            received.append(client.recv(65535))
+    except socket.timeout:
+        return received
+
+
+def testParse():
+    impairment = Impairment.parse('loss=0.01,delay=20,jitter=5,bandwidth=10M')
+    assert (impairment.loss, impairment.delay, impairment.jitter, impairment.bandwidth) == (0.01, 20, 5, 10E6)
+    assert vars(Impairment.parse('')) == vars(Impairment())
+    with pytest.raises(AssertionError):
+        Impairment.parse('lag=10')
+    with pytest.raises(AssertionError):
+        Impairment.parse('loss=often')
+
+
+def testRelayWithoutImpairments(echo, relays):
+    server, answer = echo
+    relay = relays(server.getsockname())
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        messages = [b'%d' % i for i in range(50)]
+        for message in messages:
+            client.sendto(message, relay.address)
+        assert answer() == messages
+        assert receiveAll(client) == messages
+
+    assert relay.stats['up']['sent'] == relay.stats['down']['sent'] == 50
+
+
+def testLossAndDuplicatesAreRepeatable(echo, relays):
+    # nothing is sent back: both directions draw from the random generator of the relay
+    server, _ = echo
+    impairment = Impairment(loss=0.3, duplicate=0.3)
+    runs = []
+    for _ in range(2):
+        relay = relays(server.getsockname(), up=impairment, down=Impairment(), seed=7)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+            for i in range(100):
+                client.sendto(b'%d' % i, relay.address)
+            runs.append(sorted(receiveAll(server)))
+
+        stats = relay.stats['up']
+        assert stats['received'] == 100
+        assert len(runs[-1]) == 100 - stats['lost'] + stats['duplicated']
+        assert 10 < stats['lost'] < 50 and 5 < stats['duplicated'] < 50
+
+    # the same seed impairs the same datagrams
+    assert runs[0] == runs[1]
+
+
+def testDelayAndReorder(echo, relays):
+    server, answer = echo
+    relay = relays(server.getsockname(), up=Impairment(delay=50), down=Impairment())
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        start = time.monotonic()
+        client.sendto(b'late', relay.address)
+        server.settimeout(1)
+        data, addr = server.recvfrom(100)
+        assert data == b'late'
+        assert time.monotonic() - start >= 0.05
+
+    # a datagram held back is overtaken by the ones sent after it
+    relay = relays(server.getsockname(), up=Impairment(reorder=0.5, reorderDelay=30), seed=3)
+    server.settimeout(0.2)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        messages = [b'%02d' % i for i in range(40)]
+        for message in messages:
+            client.sendto(message, relay.address)
+        received = answer()
+    assert sorted(received) == messages
+    assert received != messages
+    assert relay.stats['up']['reordered'] > 0
+
+
+def testCorruptionOnlyHitsSegments(echo, relays):
+    server, answer = echo
+    relay = relays(server.getsockname(), up=Impairment(corrupt=1), down=Impairment())
+    segment = b'2120\x1c' + bytes(100)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        client.sendto(segment, relay.address)
+        client.sendto(b'230', relay.address)
+        received = answer()
+
+    assert received[1] == b'230'
+    # one bit flipped after the opcode
+    assert received[0][:3] == b'212' and len(received[0]) == len(segment)
+    assert sum(bin(a ^ b).count('1') for a, b in zip(received[0], segment)) == 1
+    assert relay.stats['up']['corrupted'] == 1
+
+
+def testBandwidthPacesAndDrops(echo, relays):
+    server, answer = echo
+    # 80 kbit/s carry 1000 bytes in 100 ms. the queue holds 250 ms of data
+    relay = relays(server.getsockname(), up=Impairment(bandwidth=80E3, queue=250), down=Impairment())
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        start = time.monotonic()
+        for i in range(6):
+            client.sendto(bytes([i]) * 1000, relay.address)
+        server.settimeout(1)
+        received = answer()
+        elapsed = time.monotonic() - start
+
+    assert len(received) == 6 - relay.stats['up']['overflowed']
+    assert relay.stats['up']['overflowed'] >= 2
+    assert elapsed >= 0.3
@@ -0,0 +1,98 @@
+import json
+import socket
+import threading
+import zlib
+
+import pytest
+
+from integrity import packSegment, unpackSegment
+
+DATA = bytes(range(256)) * 4 + b'end'  # 1027 bytes: 10 segments of 100 bytes and a last one of 27
+
+
+def flipBit(message, pos):
+    return message[:pos] + bytes([message[pos] ^ 1]) + message[pos + 1:]
+
+
+def testSegmentRoundTrip():
+    message = packSegment(42, b'payload', 'crc32')
+    assert unpackSegment(message[3:], 'crc32') == (42, b'payload', True)
+    # without the check the segment carries no crc32
+    assert packSegment(42, b'payload') == b'21242\x1cpayload'
+    assert unpackSegment(b'42\x1cpayload') == (42, b'payload', True)
+
+
+@pytest.mark.parametrize('pos', [3, 6, 8, 12, -1])
+def testFlippedBitIsDamaged(pos):
+    # a bit of the index, of the crc32 or of the payload
+    message = flipBit(packSegment(42, b'payload', 'crc32'), pos)
+    assert not unpackSegment(message[3:], 'crc32')[2]
+
+
+def testCutSegmentIsDamaged():
+    assert unpackSegment(b'42\x1c\x00\x01', 'crc32') == (42, b'', False)
+    assert unpackSegment(b'x\x1cpayload', 'crc32') == (None, b'', False)
+
+
+def testDamagedSegmentIsSentAgain(storage, monkeypatch):
+    import file
+    from sessions import FTP
+    from sessions.FTP import UdpFTPSession
+    from sessions.session import SessionClosedException
+
+    monkeypatch.setattr(FTP, 'FILE_PATH', storage)
+    file.writeFile('report', 'bin', storage, DATA)
+
+    opened = threading.Event()
+    ports = []
+
+    def serve():
+        try:
+            UdpFTPSession({'segment': 100, 'check': 'crc32'},
+                          onOpen=lambda port: (ports.append(port), opened.set()))
+        except SessionClosedException:
+            pass
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+    assert opened.wait(5)
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(5)
+    address = ('127.0.0.1', ports[0])
+    try:
+        client.sendto(b'2411', address)
+        header, _ = client.recvfrom(4096)
+        assert header[:3] == b'241'
+        _, _, numSegments, size, codec, checksum, first = header[3:].split(b'\x1c')
+        assert (int(numSegments), int(size), int(checksum, 16)) == (11, len(DATA), zlib.crc32(DATA))
+        first = int(first)
+        client.sendto(b'100', address)
+
+        received = {}
+        copies = {}
+        while len(received) < 11:
+            message, _ = client.recvfrom(4096)
+            sequence, payload, intact = unpackSegment(message[3:], 'crc32')
+            assert intact
+            copies[sequence] = copies.get(sequence, 0) + 1
+            if sequence == first and copies[sequence] == 1:
+                # the first copy of the first segment arrived damaged
+                client.sendto(f'101{sequence}'.encode(), address)
+                continue
+            received[sequence] = payload
+            client.sendto(f'100{sequence}'.encode(), address)
+
+        assert b''.join(received[first + i] for i in range(11)) == DATA
+        # the segment was sent again right away, before its timeout
+        assert copies[first] == 2
+
+        client.sendto(b'250', address)
+        stats, _ = client.recvfrom(65535)
+        transfer = json.loads(stats[3:])['transfers'][-1]
+        assert (transfer['corrupted'], transfer['retransmits'], transfer['timeouts']) == (1, 1, 0)
+        client.sendto(b'600', address)
+    finally:
+        client.close()
+        server.join(5)
+    assert not server.is_alive()
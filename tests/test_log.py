@@ -0,0 +1,51 @@
+import io
+import logging
+import time
+
+import log
+from log import Progress, getLogger
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def testProgressIsSampled(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(log.time, 'monotonic', clock)
+    progress = Progress(getLogger('Progress Test'), interval=0.5)
+
+    # the first step is reported, the next ones only once the interval passed
+    assert progress.due(1, 100)
+    clock.now += 0.2
+    assert not progress.due(2, 100)
+    clock.now += 0.3
+    assert progress.due(3, 100)
+    # the last step is always reported
+    assert progress.due(100, 100)
+
+
+def testProgressIsOffBelowInfo():
+    logger = getLogger('Quiet Test')
+    logger.setLevel(logging.WARNING)
+    assert not Progress(logger).due(1, 1)
+
+
+def testRecordsAreWrittenFromTheQueue(monkeypatch):
+    output = io.StringIO()
+    monkeypatch.setattr(log.logHandler, 'stream', output)
+
+    logger = getLogger('Queue Test')
+    assert getLogger('Queue Test') is logger
+    assert len(logger.handlers) == 1
+
+    logger.info('written by the listener')
+    logger.debug('below the level')
+    deadline = time.monotonic() + 5
+    while 'written by the listener' not in output.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert output.getvalue() == '[Queue Test]: written by the listener\n'
@@ -0,0 +1,96 @@
+import os
+import threading
+
+import pytest
+
+# four ranges of at least PARALLEL_MIN_RANGE bytes
+DATA = os.urandom((4 << 20) + 5)
+SEGMENT = 65536
+
+
+class Connection:
+    """
+    Stands for an FTP connection. Downloads its range of DATA through FileRange like the real connections.
+    """
+
+    def __init__(self, clientFile, fail=False):
+        self.clientFile = clientFile
+        self.fail = fail
+        self.ranges = []
+        self.closed = False
+
+    def getFileDetails(self, fileID):
+        return 'report', 'bin', len(DATA)
+
+    def downloadFile(self, fileID, directory, log, offset=0, length=None):
+        self.ranges.append((offset, length))
+        if self.fail:
+            raise ConnectionResetError('lost')
+
+        download = self.clientFile.FileRange('report', 'bin', directory, offset)
+        for seqNum, start in reversed(list(enumerate(range(offset, offset + length, SEGMENT)))):
+            download.writeSegment(seqNum, DATA[start:min(start + SEGMENT, offset + length)])
+        download.commit()
+        log(length, length, 0)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def clientModules(client):
+    return client('file'), client('connections.parallel')
+
+
+def testSplitRanges(clientModules):
+    parallel = clientModules[1]
+    assert parallel.splitRanges(10, 3, minimum=1) == [(0, 4), (4, 4), (8, 2)]
+    # no range smaller than the minimum
+    assert parallel.splitRanges(10, 4, minimum=5) == [(0, 5), (5, 5)]
+    assert parallel.splitRanges(10, 4, minimum=20) == [(0, 10)]
+    assert parallel.splitRanges(0, 4, minimum=1) == [(0, 0)]
+
+
+def testRangesAreWrittenInPlace(clientModules, tmp_path):
+    clientFile, parallel = clientModules
+    directory = str(tmp_path)
+    first = Connection(clientFile)
+    others = []
+    lock = threading.Lock()
+
+    def openConnection():
+        with lock:
+            others.append(Connection(clientFile))
+            return others[-1]
+
+    progress = []
+    used = parallel.downloadParallel(first, openConnection, 1, directory, streams=4,
+                                     log=lambda done, total, bitrate: progress.append((done, total)))
+    assert used == 4
+
+    with open(directory + "\\report.bin", 'rb') as f:
+        assert f.read() == DATA
+    assert not os.path.exists(directory + "\\report.bin.ranges")
+    assert sorted(first.ranges + [r for other in others for r in other.ranges]) == \
+        parallel.splitRanges(len(DATA), 4)
+    assert all(other.closed for other in others)
+    assert progress[-1][0] == progress[-1][1]
+
+
+def testFailedRangeDropsTheFile(clientModules, tmp_path):
+    clientFile, parallel = clientModules
+    directory = str(tmp_path)
+
+    with pytest.raises(ConnectionResetError):
+        parallel.downloadParallel(Connection(clientFile), lambda: Connection(clientFile, fail=True), 1, directory)
+    assert os.listdir(directory) == []
+
+
+def testSmallFileUsesOneSession(clientModules, tmp_path, monkeypatch):
+    clientFile, parallel = clientModules
+    connection = Connection(clientFile)
+    monkeypatch.setattr(connection, 'getFileDetails', lambda fileID: ('report', 'bin', 1000))
+    monkeypatch.setattr(connection, 'downloadFile', lambda fileID, directory, log: connection.ranges.append(None))
+
+    assert parallel.downloadParallel(connection, None, 1, str(tmp_path)) == 1
+    assert connection.ranges == [None]
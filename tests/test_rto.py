@@ -0,0 +1,75 @@
+import pytest
+
+from rto import RetransmitLimitError, RetransmitTimer
+
+
+def testFirstSampleSetsTheEstimate():
+    timer = RetransmitTimer(initial=1, minimum=0, maximum=60)
+    assert timer.timeout() == 1
+
+    timer.sample(0.1)
+    assert (timer.srtt, timer.rttvar) == (0.1, 0.05)
+    assert timer.timeout() == pytest.approx(0.3)
+
+
+def testSamplesAreSmoothed():
+    timer = RetransmitTimer(initial=1, minimum=0, maximum=60)
+    timer.sample(0.1)
+    timer.sample(0.2)
+    # rttvar = 3/4 * 0.05 + 1/4 * |0.1 - 0.2|, srtt = 7/8 * 0.1 + 1/8 * 0.2
+    assert timer.rttvar == pytest.approx(0.0625)
+    assert timer.srtt == pytest.approx(0.1125)
+    assert timer.timeout() == pytest.approx(0.3625)
+
+    # a steady round trip time brings the timeout down to it
+    for _ in range(100):
+        timer.sample(0.2)
+    assert timer.timeout() == pytest.approx(0.2, abs=1E-3)
+    assert timer.samples == 102
+
+
+def testTimeoutStaysBetweenBounds():
+    timer = RetransmitTimer(initial=1, minimum=0.2, maximum=2)
+    timer.sample(0.001)
+    assert timer.timeout() == 0.2
+
+    timer.sample(10)
+    assert timer.timeout() == 2
+
+
+def testExpiryBacksOffUntilTheNextSample():
+    timer = RetransmitTimer(initial=0.5, minimum=0.2, maximum=3)
+    timeouts = []
+    for _ in range(4):
+        timer.expire()
+        timeouts.append(timer.timeout())
+    assert timeouts == [1, 2, 3, 3]
+    assert timer.timeouts == 4
+
+    timer.sample(0.1)
+    assert timer.timeout() == pytest.approx(0.3)
+
+
+def testRetransmissionsAreLimited():
+    timer = RetransmitTimer()
+    for attempts in range(1, timer.MAX_RETRIES + 1):
+        timer.retransmit(attempts)
+    assert timer.retransmits == timer.MAX_RETRIES
+
+    with pytest.raises(RetransmitLimitError):
+        timer.retransmit(timer.MAX_RETRIES + 1)
+    assert timer.retransmits == timer.MAX_RETRIES
+
+
+def testSummaryIsInMicroseconds():
+    timer = RetransmitTimer(initial=1, minimum=0, maximum=60)
+    assert timer.summary()['srtt'] is None
+
+    timer.sample(0.1)
+    timer.expire()
+    timer.retransmit(1)
+    summary = timer.summary()
+    assert summary['srtt'] == pytest.approx(1E5)
+    assert summary['rttvar'] == pytest.approx(5E4)
+    assert summary['rto'] == pytest.approx(6E5)
+    assert (summary['samples'], summary['timeouts'], summary['retransmits']) == (1, 1, 1)
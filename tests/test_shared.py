@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules the server and the client both import. each side runs from its own directory, so each has a copy
+SHARED = ['compression.py', 'delta.py', 'integrity.py', 'log.py', 'rto.py']
+
+
+@pytest.mark.parametrize('name', SHARED)
+def testCopiesAreIdentical(name):
+    with open(os.path.join(ROOT, 'server', name), 'rb') as server, open(os.path.join(ROOT, 'client', name), 'rb') as client:
+        assert server.read() == client.read(), f'server/{name} and client/{name} differ'
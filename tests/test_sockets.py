@@ -0,0 +1,61 @@
+import socket
+
+import pytest
+
+import sockets
+from sockets import NoFreePortException, openSessionPort, releasePort
+
+
+def freePorts(count):
+    """
+    :returns (int, int) - a range of count ports that nothing listens on right now
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        first = sock.getsockname()[1]
+    return first, first + count - 1
+
+
+@pytest.fixture
+def portRange(monkeypatch):
+    monkeypatch.setattr(sockets, 'HOST_IP', '127.0.0.1')
+    monkeypatch.setattr(sockets, 'usedPorts', set())
+    ports = freePorts(2)
+    monkeypatch.setattr(sockets, 'DATA_PORT_RANGE', ports)
+    return ports
+
+
+def testSessionsGetDistinctPortsOfTheRange(portRange):
+    first, last = portRange
+    opened = [openSessionPort('UDP'), openSessionPort('TCP')]
+    try:
+        ports = [sock.getsockname()[1] for sock in opened]
+        assert sorted(ports) == list(range(first, last + 1))
+
+        with pytest.raises(NoFreePortException):
+            openSessionPort('UDP')
+
+        # a released port is handed out again
+        opened.pop(0).close()
+        releasePort(ports[0])
+        opened.append(openSessionPort('UDP'))
+        assert opened[-1].getsockname()[1] == ports[0]
+    finally:
+        for sock in opened:
+            sock.close()
+
+
+def testPortsTakenByOtherProgramsAreSkipped(portRange):
+    first, last = portRange
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as other:
+        other.bind(('127.0.0.1', first))
+        with openSessionPort('UDP') as sock:
+            assert sock.getsockname()[1] == last
+    assert sockets.usedPorts == {last}
+
+
+def testKernelChoosesThePortWithoutRange(monkeypatch):
+    monkeypatch.setattr(sockets, 'HOST_IP', '127.0.0.1')
+    monkeypatch.setattr(sockets, 'DATA_PORT_RANGE', None)
+    with openSessionPort('TCP') as sock:
+        assert sock.getsockname()[1] != 0
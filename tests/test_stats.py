@@ -0,0 +1,55 @@
+from stats import TransferStats, percentile
+
+
+def testLatencyExtremesCoverEverySegment(monkeypatch):
+    monkeypatch.setattr(TransferStats, 'LATENCY_SAMPLES', 8)
+    stats = TransferStats('send', 'report', 'bin')
+    latencies = [100.0] * 50 + [5.0] + [100.0] * 50 + [9000.0] + [100.0] * 50
+    for i, latency in enumerate(latencies):
+        stats.addSegment(10, latency=latency, timestamp=stats.start + i)
+
+    summary = stats.summary()['latency']
+    # the sample keeps 8 of the 152 latencies, the extremes are kept apart from it
+    assert len(stats.latencies) == 8
+    assert (summary['min'], summary['max']) == (5.0, 9000.0)
+    assert summary['p50'] == 100.0
+
+
+def testSegmentsAreAggregated():
+    stats = TransferStats('receive', 'report', 'bin')
+    start = stats.start
+    # 1000 bytes in 1000 µs are 8 Mbit/s, in 500 µs 16 Mbit/s
+    stats.addSegment(1000, timestamp=start + 1000)
+    stats.addSegment(1000, timestamp=start + 1500)
+    stats.addRaw(2 * 1010)
+    stats.addRetransmit(1010)
+    stats.addTimeout()
+    stats.addCorrupted()
+
+    assert (stats.minRate, stats.maxRate) == (8E6, 16E6)
+    # the moving average moves an eighth of the way to the newest rate
+    assert stats.rate == 8E6 + (16E6 - 8E6) / 8
+
+    stats.finish()
+    summary = stats.summary()
+    assert summary['file'] == 'report.bin'
+    assert summary['finished']
+    assert (summary['segments'], summary['bytes'], summary['rawBytes']) == (2, 2000, 3030)
+    assert (summary['retransmits'], summary['timeouts'], summary['corrupted']) == (1, 1, 1)
+    assert summary['rawRate'] > summary['goodput'] > 0
+    assert summary['latency']['p50'] == 500
+    assert (summary['latency']['min'], summary['latency']['max']) == (500, 1000)
+
+
+def testSummaryOfEmptyTransfer():
+    summary = TransferStats('send', 'report', 'bin').summary()
+    assert not summary['finished']
+    assert (summary['rate'], summary['minRate'], summary['maxRate']) == (0, 0, 0)
+    assert summary['latency'] == {'p50': 0, 'p90': 0, 'p99': 0, 'min': 0, 'max': 0}
+
+
+def testPercentileIsNearestRank():
+    values = list(range(1, 101))
+    assert [percentile(values, p) for p in (0, 1, 50, 90, 99, 100)] == [1, 1, 50, 90, 99, 100]
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) == 0
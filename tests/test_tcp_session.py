@@ -0,0 +1,104 @@
+import json
+import os
+import socket
+import threading
+import zlib
+
+import pytest
+
+from framing import FrameReader, packFrame
+
+# more than one sendfile call of SENDFILE_SEGMENTS * STREAM_SEGMENT bytes
+DATA = os.urandom(3 * 1024 * 1024 + 5)
+
+
+@pytest.fixture
+def streamSession(storage, monkeypatch):
+    """
+    Serves report.bin (DATA) from a TCP FTP session in streaming mode, and counts the bytes sent with sendfile.
+
+    :returns (socket, FrameReader, list) - a connected client socket, its reader, and the sizes sent with sendfile
+    """
+    import file
+    from sessions import FTP
+    from sessions.FTP import TcpFTPSession
+    from sessions.session import SessionClosedException
+
+    monkeypatch.setattr(FTP, 'FILE_PATH', storage)
+    file.writeFile('report', 'bin', storage, DATA)
+    file.addFile('report', 'bin')
+
+    sendfile = socket.socket.sendfile
+    sent = []
+
+    def countingSendfile(sock, f, offset=0, count=None):
+        result = sendfile(sock, f, offset, count)
+        sent.append(result)
+        return result
+
+    monkeypatch.setattr(socket.socket, 'sendfile', countingSendfile)
+
+    opened = threading.Event()
+    ports = []
+
+    def serve():
+        try:
+            TcpFTPSession({'mode': 'stream', 'segment': 1024}, onOpen=lambda port: (ports.append(port), opened.set()))
+        except SessionClosedException:
+            pass
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+    assert opened.wait(5)
+
+    client = socket.create_connection(('127.0.0.1', ports[0]), timeout=5)
+
+    yield client, FrameReader(client), sent
+
+    client.close()
+    server.join(5)
+    assert not server.is_alive()
+
+
+def download(client, reader, args):
+    """
+    Asks for a streamed download.
+    :returns (bytes, bytes) - the 241 header and the data
+    """
+    client.sendall(packFrame(b'241' + args))
+    header = reader.readFrame()
+    assert header[:3] == b'241'
+    data = reader.readFrame()
+    assert data[:3] == b'212'
+    return header[3:].split(b'\x1c'), data[3:]
+
+
+def testStreamIsSentWithSendfile(streamSession):
+    client, reader, sent = streamSession
+
+    header, data = download(client, reader, b'1')
+    assert (header[0], header[1], int(header[3])) == (b'report', b'bin', len(DATA))
+    assert data == DATA
+    client.sendall(packFrame(b'100' + f'{zlib.crc32(data):08x}'.encode()))
+
+    client.sendall(packFrame(b'250'))
+    transfer = json.loads(reader.readFrame()[3:])['transfers'][-1]
+    assert (transfer['bytes'], transfer['finished']) == (len(DATA), True)
+
+    # in parts of at most SENDFILE_SEGMENTS stream segments, without the frame header
+    assert sum(sent) == len(DATA)
+    assert len(sent) >= 4 and max(sent) <= 16 * 65536
+
+
+def testRangeIsSentWithSendfile(streamSession):
+    client, reader, sent = streamSession
+    offset, length = 1000000, 1500000
+
+    header, data = download(client, reader, b'1\x1c%d\x1c%d' % (offset, length))
+    assert int(header[3]) == length
+    assert data == DATA[offset:offset + length]
+
+    # a confirmation with another crc32 means the data was corrupted on the way
+    client.sendall(packFrame(b'100' + f'{zlib.crc32(data) ^ 1:08x}'.encode()))
+    assert reader.readFrame().startswith(b'400 File [report.bin] was corrupted in transit')
+    assert sum(sent) == length
@@ -0,0 +1,172 @@
+import json
+import socket
+import threading
+
+import pytest
+
+DATA = bytes(range(256)) * 4 + b'end'  # 1027 bytes: 10 segments of 100 bytes and a last one of 27
+
+
+@pytest.fixture
+def udpSession(storage, monkeypatch):
+    """
+    Serves report.bin (DATA) from a UDP FTP session with 100 byte segments and a window of 4.
+
+    :returns (socket, tuple) - a client socket and the address of the session
+    """
+    import file
+    from sessions import FTP
+    from sessions.FTP import UdpFTPSession
+    from sessions.session import SessionClosedException
+
+    monkeypatch.setattr(FTP, 'FILE_PATH', storage)
+    monkeypatch.setattr(FTP, 'UDP_WINDOW_SIZE', 4)
+    file.writeFile('report', 'bin', storage, DATA)
+
+    opened = threading.Event()
+    ports = []
+
+    def serve():
+        try:
+            UdpFTPSession({'segment': 100}, onOpen=lambda port: (ports.append(port), opened.set()))
+        except SessionClosedException:
+            pass
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+    assert opened.wait(5)
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(5)
+    address = ('127.0.0.1', ports[0])
+
+    yield client, address
+
+    client.sendto(b'600', address)
+    client.close()
+    server.join(5)
+    assert not server.is_alive()
+
+
+def startDownload(client, address):
+    """
+    :returns (int, int) - number of segments and sequence number of the first one
+    """
+    client.sendto(b'2411', address)
+    header, _ = client.recvfrom(4096)
+    assert header[:3] == b'241'
+    _, _, numSegments, size, _, _, first = header[3:].split(b'\x1c')
+    assert int(size) == len(DATA)
+    client.sendto(b'100', address)
+    return int(numSegments), int(first)
+
+
+def receiveSegment(client):
+    message, _ = client.recvfrom(65535)
+    assert message[:3] == b'212'
+    sequence, payload = message[3:].split(b'\x1c', 1)
+    return int(sequence), payload
+
+
+def getTransfer(client, address):
+    client.sendto(b'250', address)
+    stats, _ = client.recvfrom(65535)
+    return json.loads(stats[3:])['transfers'][-1]
+
+
+def testLostAcknowledgmentIsSentAgain(udpSession):
+    client, address = udpSession
+    numSegments, first = startDownload(client, address)
+    assert numSegments == 11
+
+    # the server stops at a full window until segments are acknowledged. the timer, already down to the round trip
+    # of the 241 exchange, sends the window again meanwhile
+    received = {}
+    copies = {}
+    client.settimeout(0.2)
+    try:
+        while True:
+            sequence, payload = receiveSegment(client)
+            received[sequence] = payload
+            copies[sequence] = copies.get(sequence, 0) + 1
+    except socket.timeout:
+        pass
+    client.settimeout(5)
+    assert sorted(received) == list(range(first, first + 4))
+
+    lost = first + 2
+    for sequence in received:
+        if sequence != lost:
+            client.sendto(f'100{sequence}'.encode(), address)
+    copies[lost] = 0
+
+    while len(received) < numSegments or not copies[lost]:
+        sequence, payload = receiveSegment(client)
+        received[sequence] = payload
+        copies[sequence] = copies.get(sequence, 0) + 1
+        client.sendto(f'100{sequence}'.encode(), address)
+
+    assert b''.join(received[first + i] for i in range(numSegments)) == DATA
+    transfer = getTransfer(client, address)
+    assert transfer['segments'] == 11
+    assert transfer['retransmits'] >= 4 and transfer['timeouts'] >= 1
+
+
+def testLateAcknowledgmentsAreSkipped(udpSession):
+    client, address = udpSession
+    numSegments, first = startDownload(client, address)
+
+    received = {}
+    while len(received) < numSegments:
+        sequence, payload = receiveSegment(client)
+        received[sequence] = payload
+        # acknowledgments of segments not in flight, and garbage, change nothing
+        client.sendto(f'100{sequence + 100}'.encode(), address)
+        client.sendto(b'100x', address)
+        client.sendto(f'100{sequence}'.encode(), address)
+        client.sendto(f'100{sequence}'.encode(), address)
+    assert b''.join(received[first + i] for i in range(numSegments)) == DATA
+
+    # the next file is numbered on, so the copies of the acknowledgments of the last file cannot count for it
+    assert startDownload(client, address) == (numSegments, first + numSegments)
+    received = {}
+    while len(received) < numSegments:
+        sequence, payload = receiveSegment(client)
+        received[sequence] = payload
+        client.sendto(f'100{sequence}'.encode(), address)
+    assert b''.join(received[first + numSegments + i] for i in range(numSegments)) == DATA
+    assert getTransfer(client, address)['segments'] == numSegments
+
+
+def testSegmentSizeIsCapped(monkeypatch):
+    from sessions import FTP
+    from sessions.FTP import chooseSegmentSize, UdpFTPSession
+
+    monkeypatch.setattr(FTP, 'MAX_SEGMENT_SIZE', 9000)
+    assert chooseSegmentSize('1400') == 1400
+    assert chooseSegmentSize('100000') == 9000
+    assert chooseSegmentSize('0') == 1
+    assert chooseSegmentSize('jumbo') == FTP.SEGMENT_SIZE
+    assert UdpFTPSession.negotiate({})['segment'] == FTP.SEGMENT_SIZE
+
+
+def testProbesAreAnsweredAndSegmentSizeIsSet(udpSession):
+    client, address = udpSession
+
+    # a probe is answered with the size it claims, whatever its padding
+    probe = b'2131400\x1c'
+    client.sendto(probe + bytes(1400 - len(probe)), address)
+    assert client.recvfrom(65535)[0] == b'2131400'
+
+    client.sendto(b'214500', address)
+    assert client.recvfrom(4096)[0] == b'214500'
+
+    # downloads are then cut in segments of the new size
+    numSegments, first = startDownload(client, address)
+    assert numSegments == 3
+    received = {}
+    while len(received) < numSegments:
+        sequence, payload = receiveSegment(client)
+        received[sequence] = payload
+        client.sendto(f'100{sequence}'.encode(), address)
+    assert [len(received[first + i]) for i in range(3)] == [500, 500, 27]